@@ -1,56 +1,42 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status, Query, Request
 from pydantic import BaseModel, root_validator
-from .llm import chat as llm_chat
-from ..utils.file_storage import save_upload_file
+from .llm import achat as llm_achat, astream_chat, call_with_disconnect, _chat_body
+from .context_packer import count_tokens, pack_passages
+from .audit_sink import audit
+from .upstream_limiter import UpstreamBusy
+from .rag import get_rag_index, mark_changed
+from ..utils.file_storage import STORAGE_ROOT, safe_filename, stream_upload
+from ..utils.remote_fetch import FetchError, FetchTooLarge, fetch_to_file
+from ..storage.artifacts import get_artifact_store
 from ..mongo import get_db
 from uuid import uuid4
 from datetime import datetime
-from ..tasks.celery_worker import process_detection_job_task
+from ..tasks.celery_worker import process_detection_job_task, process_detection_batch_task
+from ..tasks.local_executor import enqueue, QueueFull
 from ..dependencies import get_current_user
 import httpx
-from ..utils.s3_storage import s3_enabled, save_bytes_to_s3, generate_s3_key
+from ..utils.s3_storage import s3_enabled, upload_file_to_s3, generate_s3_key
 from fastapi.responses import JSONResponse
 from fastapi.responses import StreamingResponse
 import io, csv
 from .llm import llm_diagnostics
-import asyncio, json, httpx, os
+import asyncio, json, httpx, os, re
+import anyio
 
 router = APIRouter()
 
-# --- Simple in-memory rate limiter (per-IP, per-path) ---
-from time import time
-from functools import wraps
-from collections import defaultdict, deque
-
-_RATE_BUCKETS: dict[str, deque] = defaultdict(deque)
-
-def rate_limit(max_requests: int, window_sec: int):
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            request: Request | None = None
-            # Extract Request from FastAPI dependency-injected args
-            for a in args:
-                if isinstance(a, Request):
-                    request = a
-                    break
-            if request is None:
-                request = kwargs.get('request')
-            # Identify client IP (X-Forwarded-For first, then client host)
-            ip = (request.headers.get('x-forwarded-for', '').split(',')[0].strip() or
-                  (request.client.host if request and request.client else 'unknown'))
-            key = f"{ip}:{getattr(func, '__name__', 'endpoint')}"
-            now = time()
-            dq = _RATE_BUCKETS[key]
-            # Evict old
-            while dq and now - dq[0] > window_sec:
-                dq.popleft()
-            if len(dq) >= max_requests:
-                raise HTTPException(status_code=429, detail="Too many requests. Please slow down.")
-            dq.append(now)
-            return await func(*args, **kwargs)
-        return wrapper
-    return decorator
+# Per-IP, per-endpoint limits (GCRA; shared across workers with RATE_LIMIT_BACKEND=redis)
+from ..utils.rate_limiter import rate_limit
+
+async def _enqueue_job(db, collection: str, doc_id: str, task, *args) -> str:
+    """Dispatch a background task for a stored job doc; mark it failed and 503 if the local queue is full."""
+    try:
+        return enqueue(task, *args)
+    except QueueFull:
+        # Only a doc nothing has picked up yet; never overwrite a run that got started
+        await db.get_collection(collection).update_one({'_id': doc_id, 'status': 'pending'}, {'$set': {'status': 'failed', 'error': 'queue full'}})
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Job queue is full, retry shortly')
+
 
 @router.get('/health')
 async def ai_health():
@@ -63,10 +49,37 @@ async def llm_debug():
     return llm_diagnostics()
 
 
+@router.get('/llm/cache')
+async def llm_cache_stats():
+    """Response cache hit-rate and size counters, plus coalescing, streaming (TTFT, tokens/s), admission and audit-sink counters."""
+    from .llm_cache import get_llm_cache
+    from .llm import _inflight, stream_stats
+    from .upstream_limiter import get_upstream_limiter
+    from .audit_sink import get_audit_sink
+    cache = get_llm_cache()
+    limiter = get_upstream_limiter()
+    out = cache.stats() if cache is not None else { 'enabled': False }
+    return {
+        **out,
+        'coalescing': _inflight.stats(),
+        'streaming': stream_stats.stats(),
+        'admission': limiter.stats() if limiter is not None else None,
+        'audit': get_audit_sink().stats(),
+    }
+
+
+@router.get('/rag/index')
+async def rag_index_stats():
+    """Size, watermark and change-replay counters of the /ai/chat/rag retrieval index."""
+    return get_rag_index().stats()
+
+
 @router.post('/chat/stream')
 @rate_limit(max_requests=30, window_sec=60)
 async def chat_stream(data: 'ChatStreamIn', request: Request):
-    """Server-Sent Events streaming chat. Falls back to non-stream reply if streaming fails."""
+    """Server-Sent Events streaming chat. Falls back to non-stream reply if streaming fails.
+    Streaming bypasses the LLM response cache.
+    """
     from ..config import settings
     api_key = settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
     if not api_key:
@@ -81,44 +94,25 @@ async def chat_stream(data: 'ChatStreamIn', request: Request):
         + 'If out-of-domain, say: I do not have enough information. '
         + f'Respond in language code: {lang}. Keep replies concise.'
     )
-    messages = []
-    messages.append({ 'role': 'system', 'content': system })
-    messages.extend(data.messages or [])
-    body = {
-        'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
-        'messages': messages,
-        'temperature': 0.2,
-        'stream': True,
-        'max_tokens': 500,
-    }
+    # Same body (and history packing) as the non-streaming chat
+    body = _chat_body(data.messages or [], system)
 
     async def event_gen():
+        # Pooled client; tokens coalesced into frames; idle/total timeouts; stops on disconnect
+        meta: dict = {}
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream('POST', 'https://api.openai.com/v1/chat/completions',
-                                          headers={'Authorization': f'Bearer {api_key}', 'Content-Type':'application/json'},
-                                          json=body) as r:
-                    async for line in r.aiter_lines():
-                        if not line:
-                            continue
-                        if line.startswith('data:'):
-                            payload = line[5:].strip()
-                            if payload == '[DONE]':
-                                yield 'event:done\ndata:{}\n\n'
-                                break
-                            try:
-                                j = json.loads(payload)
-                                delta = j.get('choices',[{}])[0].get('delta',{}).get('content')
-                                if delta:
-                                    yield f'data:{json.dumps({"token": delta})}\n\n'
-                            except Exception:
-                                continue
-            await asyncio.sleep(0)
+            async for chunk in astream_chat(body, api_key, request=request, meta=meta):
+                yield f'data:{json.dumps({"token": chunk})}\n\n'
+            if meta.get('outcome') == 'completed':
+                yield f'event:done\ndata:{json.dumps({k: meta.get(k) for k in ("ttft_ms", "tokens", "tokens_per_s")})}\n\n'
+        except UpstreamBusy as e:
+            yield f'data:{json.dumps({"error": str(e), "retry_after": round(e.retry_after, 1)})}\n\n'
+            yield 'event:done\ndata:{}\n\n'
         except Exception as e:
             # Fallback single message event
             yield f'data:{json.dumps({"error": str(e)})}\n\n'
             yield 'event:done\ndata:{}\n\n'
-    return StreamingResponse(event_gen(), media_type='text/event-stream')
+    return StreamingResponse(event_gen(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 class ChatIn(BaseModel):
@@ -192,26 +186,25 @@ async def chat_endpoint(data: ChatIn, request: Request, db = Depends(get_db)):
             base + ' ' + context_clause + strict_clause + f'Respond in language code: {lang}. Keep replies concise.'
         )
     try:
-        reply = llm_chat(data.messages or [], system_prompt=system)
+        reply = await call_with_disconnect(request, llm_achat(data.messages or [], system_prompt=system))
+    except HTTPException:
+        raise
     except Exception as e:
         # If strict requirement of LLM, propagate service unavailable status
         from ..config import settings as _settings
         if _settings.LLM_REQUIRE:
             raise HTTPException(status_code=503, detail=f"LLM unavailable: {e}")
         reply = f"(fallback-error) {e}"
-    # Audit trail: persist Q/A for review boards
-    try:
-        await db.get_collection('ai_audit').insert_one({
-            'type': 'chat',
-            'messages': data.messages,
-            'system': system,
-            'on_topic': on_topic,
-            'on_topic_score': on_topic_score,
-            'reply': reply,
-            'created_at': datetime.utcnow(),
-        })
-    except Exception:
-        pass
+    # Audit trail: persist Q/A for review boards (write-behind, off the response path)
+    audit('ai_audit', {
+        'type': 'chat',
+        'messages': data.messages,
+        'system': system,
+        'on_topic': on_topic,
+        'on_topic_score': on_topic_score,
+        'reply': reply,
+        'created_at': datetime.utcnow(),
+    })
     return { 'reply': reply, 'on_topic': on_topic }
 
 
@@ -224,10 +217,32 @@ async def chat_unrestricted(data: ChatIn, request: Request):
     base = 'You are a helpful general AI assistant.'
     lang = (data.language or 'en').lower()
     system = base + f' Respond in language code: {lang}. Be clear and concise.'
-    reply = llm_chat(messages, system_prompt=system)
+    reply = await call_with_disconnect(request, llm_achat(messages, system_prompt=system))
     return { 'reply': reply }
 
 
+# Static product knowledge mixed into every RAG prompt (top-2 by relevance)
+_RAG_KB = [
+    "TrishulVision is a mining monitoring web app with a FastAPI backend and React frontend.",
+    "Backend modules: auth, ai (detection jobs, chat), alerts (WebSocket), iot (WebSocket), reports (PDF, blockchain pinning), blockchain (verify/list), gis (shapefiles), spatial (satellite/DEM/change detection), visualization (job visualization, heatmap), metrics (overview).",
+    "Realtime: /alerts/ws and /iot/ws require JWT and stream data.",
+    "Detection jobs endpoints: POST /ai/models/detect, /ai/models/detect-from-url, /ai/models/detect-from-bbox; list via GET /ai/models/jobs; details via GET /ai/models/jobs/{id}; visualization via GET /visualization/{job_id}.",
+    "Reports: GET /mining, GET /mining/{id}; PDF via GET /reports/{report_id}; authenticity via /reports/{report_id}/pin and /blockchain endpoints.",
+    "Visualization uses Cesium; layers include illegal_polygons, depth_polygons, legal_boundary; heatmap via /visualization/heatmap.",
+]
+_kb_index = None
+
+
+def _rag_kb_index():
+    global _kb_index
+    if _kb_index is None:
+        from .rag.bm25 import BM25Index
+        _kb_index = BM25Index()
+        for i, line in enumerate(_RAG_KB):
+            _kb_index.add(f'kb:{i}', line, {'kind': 'kb'})
+    return _kb_index
+
+
 class ChatRagIn(BaseModel):
     # Primary field
     question: str | None = None
@@ -278,71 +293,25 @@ class ChatRagIn(BaseModel):
 @rate_limit(max_requests=20, window_sec=60)
 async def chat_rag(data: ChatRagIn, request: Request, db = Depends(get_db)):
     """
-    Retrieval-augmented answer grounded on your database (reports, detection jobs).
-    No external vector store required; performs lightweight retrieval from Mongo.
+    Retrieval-augmented answer grounded on your database (reports, detection jobs, alerts, shapefiles).
+    Passages come from the in-process hybrid index (BM25 + embeddings, see ai/rag), kept current
+    via the rag_changes feed.
     """
     q = (data.question or '').strip()
     if not q:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Empty question')
 
-    # Collect recent candidates
-    reports = db.get_collection('mining_reports')
-    jobs = db.get_collection('detection_jobs')
-
-    contexts: list[str] = []
-    # Pull recent reports
-    try:
-        async for r in reports.find({}).sort('created_at', -1).limit(50):
-            parts = []
-            rid = r.get('_id')
-            parts.append(f"Report {rid}")
-            if r.get('summary'): parts.append(f"Summary: {r.get('summary')}")
-            if r.get('result'):
-                est = r['result'].get('estimation') or {}
-                vol = est.get('volume_m3'); dep = est.get('depth_m')
-                if vol is not None: parts.append(f"Volume m3: {vol}")
-                if dep is not None: parts.append(f"Depth m: {dep}")
-            if r.get('area_ha') is not None: parts.append(f"Area ha: {r.get('area_ha')}")
-            if r.get('notes'): parts.append(f"Notes: {r.get('notes')}")
-            contexts.append(" | ".join(parts))
-    except Exception:
-        pass
-
-    # Pull recent jobs
-    try:
-        async for j in jobs.find({}).sort('created_at', -1).limit(50):
-            parts = []
-            jid = j.get('_id'); status_ = j.get('status')
-            parts.append(f"Job {jid} status={status_}")
-            if j.get('area_illegal') is not None: parts.append(f"area_illegal: {j.get('area_illegal')}")
-            if j.get('volume_cubic_m') is not None: parts.append(f"volume_cubic_m: {j.get('volume_cubic_m')}")
-            if j.get('notes'): parts.append(f"notes: {j.get('notes')}")
-            contexts.append(" | ".join(parts))
-    except Exception:
-        pass
-
-    # Add a lightweight internal KB about this application (static product knowledge)
-    kb = [
-        "TrishulVision is a mining monitoring web app with a FastAPI backend and React frontend.",
-        "Backend modules: auth, ai (detection jobs, chat), alerts (WebSocket), iot (WebSocket), reports (PDF, blockchain pinning), blockchain (verify/list), gis (shapefiles), spatial (satellite/DEM/change detection), visualization (job visualization, heatmap), metrics (overview).",
-        "Realtime: /alerts/ws and /iot/ws require JWT and stream data.",
-        "Detection jobs endpoints: POST /ai/models/detect, /ai/models/detect-from-url, /ai/models/detect-from-bbox; list via GET /ai/models/jobs; details via GET /ai/models/jobs/{id}; visualization via GET /visualization/{job_id}.",
-        "Reports: GET /mining, GET /mining/{id}; PDF via GET /reports/{report_id}; authenticity via /reports/{report_id}/pin and /blockchain endpoints.",
-        "Visualization uses Cesium; layers include illegal_polygons, depth_polygons, legal_boundary; heatmap via /visualization/heatmap.",
-    ]
-
-    # Simple scoring: keyword overlap count over DB-derived contexts and KB
-    tokens = set([t.lower() for t in q.split() if len(t) > 2])
-    def score(text: str) -> int:
-        words = set([t.lower().strip('.,:;()') for t in text.split()])
-        return len(tokens & words)
-
-    contexts.sort(key=score, reverse=True)
-    kb.sort(key=score, reverse=True)
-    # Mix top DB signals with a couple of KB lines
-    top_db = contexts[: max(1, min(data.limit, 8))]
-    top_kb = kb[:2]
+    # Indexed hybrid retrieval over reports, jobs, alerts and shapefile metadata (all history, not just recent)
+    # Over-fetch, then let the packer fill the token budget by relevance and drop near-duplicates
+    from ..config import settings as _settings
+    budget = _settings.RAG_CONTEXT_BUDGET_TOKENS
+    k = max(1, min(data.limit, 8))
+    hits = await get_rag_index().search(db, q, k=k * 2)
+    top_kb = pack_passages([h['text'] for h in _rag_kb_index().search(q, k=2)] or _RAG_KB[:2], budget=budget // 5)
+    top_db = pack_passages([h['text'] for h in hits], budget=budget - sum(count_tokens(t) + 1 for t in top_kb))[:k]
     top = top_kb + top_db
+    used = set(top_db)
+    hits = [h for h in hits if h['text'] in used]
 
     persona = (data.persona or '').lower()
     lang = (data.language or 'en').lower()
@@ -357,8 +326,12 @@ async def chat_rag(data: ChatRagIn, request: Request, db = Depends(get_db)):
         { 'role': 'system', 'content': system },
         { 'role': 'user', 'content': f"CONTEXT\n\n" + "\n".join(top) + f"\n\nQUESTION: {q}\nIf the answer cannot be found in the CONTEXT, say you do not have enough information." },
     ]
-    reply = llm_chat(messages)
-    return { 'reply': reply, 'sources_used': len(top) }
+    reply = await call_with_disconnect(request, llm_achat(messages))
+    return {
+        'reply': reply,
+        'sources_used': len(top),
+        'sources': [{ 'kind': h.get('kind'), 'id': h.get('id'), 'score': h.get('score') } for h in hits],
+    }
 
 
 class PolicyQ(BaseModel):
@@ -367,7 +340,7 @@ class PolicyQ(BaseModel):
 
 
 @router.post('/policy/ask')
-async def policy_ask(payload: PolicyQ):
+async def policy_ask(payload: PolicyQ, request: Request):
     """
     Policy assistant tuned for Indian Mining Acts + NTRO guidelines (prompt-only stub).
     When external LLM API isn't configured, returns a succinct fallback string.
@@ -375,7 +348,7 @@ async def policy_ask(payload: PolicyQ):
     system = (
         "You are a legal compliance assistant for Indian mining. Cite relevant acts like MMDR Act, Mineral Concession Rules, and NTRO SOPs. If unsure, say not enough information."
     )
-    reply = llm_chat([{ 'role': 'user', 'content': payload.question }], system_prompt=system)
+    reply = await call_with_disconnect(request, llm_achat([{ 'role': 'user', 'content': payload.question }], system_prompt=system))
     return { 'reply': reply }
 
 
@@ -403,11 +376,11 @@ class CaptionIn(BaseModel):
 
 
 @router.post('/caption')
-async def caption_image(data: CaptionIn):
+async def caption_image(data: CaptionIn, request: Request):
     """Generate a short textual summary/caption for a satellite scene (stub)."""
     style = 'succinct' if (data.detail or 'short') == 'short' else 'detailed'
     prompt = f"Provide a {style} description of visible mining activity, boundaries, and vegetation condition."
-    reply = llm_chat([{ 'role': 'user', 'content': prompt }], system_prompt='Vision-text captioning stub for TrishulVision.')
+    reply = await call_with_disconnect(request, llm_achat([{ 'role': 'user', 'content': prompt }], system_prompt='Vision-text captioning stub for TrishulVision.'))
     return { 'caption': reply }
 
 
@@ -466,11 +439,8 @@ async def xai_explain(data: XAIExplainIn, db = Depends(get_db)):
         'factors': reasons,
         'attributions': attributions,
     }
-    # Log audit event
-    try:
-        await db.get_collection('ai_audit').insert_one({ 'type': 'xai', **out, 'created_at': datetime.utcnow() })
-    except Exception:
-        pass
+    # Log audit event (write-behind)
+    audit('ai_audit', { 'type': 'xai', **out, 'created_at': datetime.utcnow() })
     return out
 
 
@@ -569,18 +539,22 @@ async def detect_model(
     user = Depends(get_current_user),
 ):
     # Save files if provided
+    job_id = str(uuid4())
     paths = {}
-    if imagery: paths['imagery'] = await save_upload_file(imagery, 'detect/imagery')
-    if shapefile: paths['shapefile'] = await save_upload_file(shapefile, 'detect/shapefile')
-    if dem: paths['dem'] = await save_upload_file(dem, 'detect/dem')
+    hashes = {}
+    for kind, upload in (('imagery', imagery), ('shapefile', shapefile), ('dem', dem)):
+        if upload:
+            stored = await stream_upload(upload, f'detect/{kind}', ref=f'job:{job_id}')
+            paths[kind] = stored['path']
+            hashes[kind] = {'sha256': stored['sha256'], 'size': stored['size']}
 
-    job_id = str(uuid4())
     user_email = (user or {}).get('sub', 'anonymous')
     doc = {
         '_id': job_id,
         'status': 'pending',
         'created_at': datetime.utcnow(),
         'files': paths,
+        'file_hashes': hashes,
         'notes': notes,
         'user_email': user_email,
         'area_legal': None,
@@ -590,9 +564,10 @@ async def detect_model(
         'result_map_url': None,
     }
     await db.get_collection('detection_jobs').insert_one(doc)
+    await mark_changed(db, 'job', job_id)
     # enqueue background task
-    task = process_detection_job_task.delay(job_id, paths)
-    return { 'job_id': job_id, 'task_id': task.id, 'status': 'pending' }
+    task_id = await _enqueue_job(db, 'detection_jobs', job_id, process_detection_job_task, job_id, paths)
+    return { 'job_id': job_id, 'task_id': task_id, 'status': 'pending' }
 
 
 class DetectFromUrlIn(BaseModel):
@@ -601,45 +576,76 @@ class DetectFromUrlIn(BaseModel):
     content_type: str | None = None
     filename: str | None = None
     provider: str | None = None  # 'earthdata' | 'http'
+    sha256: str | None = None  # optional expected checksum, verified after download
+    aoi_bbox: list[float] | None = None  # [minLon,minLat,maxLon,maxLat]: read only this window of a COG, no download
 
 
 @router.post('/models/detect-from-url')
 async def detect_from_url(data: DetectFromUrlIn, db = Depends(get_db), user = Depends(get_current_user)):
-    # Download the remote file (optionally add auth headers in future for Earthdata)
-    if (data.provider or '').lower() == 'earthdata':
-        from ..providers.earthdata import download as ed_download
-        content = await ed_download(data.url)
-        ctype = data.content_type or 'application/octet-stream'
-        fname = data.filename or data.url.split('/')[-1] or 'scene.tif'
-    else:
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.get(data.url)
-            r.raise_for_status()
-            content = r.content
-            ctype = data.content_type or r.headers.get('Content-Type') or 'application/octet-stream'
-            fname = data.filename or data.url.split('/')[-1] or 'scene.tif'
-
     job_id = str(uuid4())
+    if data.aoi_bbox:
+        # Windowed mode: the job reads just the AOI from the remote COG over range requests
+        import math
+        bb = data.aoi_bbox
+        if len(bb) != 4 or not all(math.isfinite(v) for v in bb) or not (bb[0] < bb[2] and bb[1] < bb[3]):
+            raise HTTPException(status_code=400, detail='aoi_bbox must be [minLon,minLat,maxLon,maxLat] with finite values and min < max')
+        paths = {'imagery': data.url}
+        doc = {
+            '_id': job_id,
+            'status': 'pending',
+            'created_at': datetime.utcnow(),
+            'files': paths,
+            'aoi_bbox': data.aoi_bbox,
+            'imagery_provider': (data.provider or 'http').lower(),
+            'notes': data.notes,
+            'user_email': (user or {}).get('sub', 'anonymous'),
+        }
+        await db.get_collection('detection_jobs').insert_one(doc)
+        await mark_changed(db, 'job', job_id)
+        task_id = await _enqueue_job(db, 'detection_jobs', job_id, process_detection_job_task, job_id, paths)
+        return { 'job_id': job_id, 'task_id': task_id, 'status': 'pending', 'mode': 'window' }
+
+    # Stream the remote file to disk (never fully in memory), then hand it to S3 as a
+    # multipart upload or to the local artifact store
+    fname = safe_filename(data.filename or data.url.split('?')[0].split('/')[-1] or 'scene.tif')
+    dest = STORAGE_ROOT / 'staging' / f'{job_id}_{fname}'
+    try:
+        if (data.provider or '').lower() == 'earthdata':
+            from ..providers.earthdata import download_to_file as ed_download_to_file, EarthdataAuthError
+            try:
+                fetched = await ed_download_to_file(data.url, dest, expected_sha256=data.sha256)
+            except EarthdataAuthError as e:
+                raise HTTPException(status_code=502, detail=str(e))
+        else:
+            fetched = await fetch_to_file(data.url, dest, expected_sha256=data.sha256)
+    except FetchTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (FetchError, httpx.HTTPError) as e:
+        raise HTTPException(status_code=502, detail=f'Download failed: {e}')
+    ctype = data.content_type or fetched['content_type'] or 'application/octet-stream'
+
     paths = {}
     if s3_enabled():
         key = generate_s3_key('detect/imagery', fname)
-        url = save_bytes_to_s3(key, content, content_type=ctype)
-        paths['imagery'] = url
+        try:
+            paths['imagery'] = await anyio.to_thread.run_sync(lambda: upload_file_to_s3(key, fetched['path'], content_type=ctype))
+        finally:
+            try:
+                os.unlink(fetched['path'])
+            except OSError:
+                pass
     else:
-        # Save to local storage via save_upload_file requires UploadFile; write bytes manually
-        from ..utils.file_storage import STORAGE_ROOT
-        import os
-        os.makedirs(STORAGE_ROOT / 'detect' / 'imagery', exist_ok=True)
-        local_path = STORAGE_ROOT / 'detect' / 'imagery' / fname
-        with open(local_path, 'wb') as f:
-            f.write(content)
-        paths['imagery'] = str(local_path)
+        store = get_artifact_store()
+        stored = await anyio.to_thread.run_sync(lambda: store.put_file(
+            fetched['path'], name=fname, kind='detect/imagery', ref=f'job:{job_id}', sha256=fetched['sha256']))
+        paths['imagery'] = stored['path']
 
     doc = {
         '_id': job_id,
         'status': 'pending',
         'created_at': datetime.utcnow(),
         'files': paths,
+        'file_hashes': {'imagery': {'sha256': fetched['sha256'], 'size': fetched['size']}},
         'notes': data.notes,
         'user_email': (user or {}).get('sub', 'anonymous'),
         'area_legal': None,
@@ -649,8 +655,9 @@ async def detect_from_url(data: DetectFromUrlIn, db = Depends(get_db), user = De
         'result_map_url': None,
     }
     await db.get_collection('detection_jobs').insert_one(doc)
-    task = process_detection_job_task.delay(job_id, paths)
-    return { 'job_id': job_id, 'task_id': task.id, 'status': 'pending' }
+    await mark_changed(db, 'job', job_id)
+    task_id = await _enqueue_job(db, 'detection_jobs', job_id, process_detection_job_task, job_id, paths)
+    return { 'job_id': job_id, 'task_id': task_id, 'status': 'pending' }
 
 
 class DetectFromBboxIn(BaseModel):
@@ -673,8 +680,169 @@ async def detect_from_bbox(data: DetectFromBboxIn, db = Depends(get_db), user =
         'user_email': (user or {}).get('sub', 'anonymous'),
     }
     await db.get_collection('detection_jobs').insert_one(doc)
-    task = process_detection_job_task.delay(job_id, {})
-    return { 'job_id': job_id, 'task_id': task.id, 'status': 'pending' }
+    await mark_changed(db, 'job', job_id)
+    task_id = await _enqueue_job(db, 'detection_jobs', job_id, process_detection_job_task, job_id, {})
+    return { 'job_id': job_id, 'task_id': task_id, 'status': 'pending' }
+
+
+class AoiFilterIn(BaseModel):
+    # Exact matches over the 'aois' collection; never passed to Mongo as a raw filter
+    name: str | None = None
+    district: str | None = None  # metadata.district
+    state: str | None = None  # metadata.state
+    metadata: dict[str, str | int | float | bool] | None = None  # other metadata.<key> == value
+
+
+_METADATA_KEY = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def _aoi_filter_query(f: AoiFilterIn) -> dict:
+    query: dict = {}
+    for key, value in (f.metadata or {}).items():
+        if not _METADATA_KEY.match(key):
+            raise HTTPException(status_code=400, detail=f'Invalid aoi_filter metadata key: {key!r}')
+        query[f'metadata.{key}'] = value
+    if f.name is not None:
+        query['name'] = f.name
+    if f.district is not None:
+        query['metadata.district'] = f.district
+    if f.state is not None:
+        query['metadata.state'] = f.state
+    if not query:
+        raise HTTPException(status_code=400, detail='aoi_filter needs at least one of name, district, state, metadata')
+    return query
+
+
+class DetectBatchIn(BaseModel):
+    bboxes: list[list[float]] | None = None  # [[minLon,minLat,maxLon,maxLat], ...]
+    aoi_ids: list[str] | None = None  # ids from the 'aois' collection
+    aoi_filter: AoiFilterIn | None = None  # e.g. {"district": "X"}
+    notes: str | None = None
+    older_date: str | None = None
+    zoom: int = 10
+
+
+def _bbox_of_geojson(geom: dict | None) -> list[float] | None:
+    """Bounding box [minx,miny,maxx,maxy] of a GeoJSON geometry/Feature/FeatureCollection."""
+    xs: list[float] = []
+    ys: list[float] = []
+
+    def _walk(c):
+        if isinstance(c, (list, tuple)) and len(c) >= 2 and all(isinstance(v, (int, float)) for v in c[:2]):
+            xs.append(float(c[0])); ys.append(float(c[1]))
+        elif isinstance(c, (list, tuple)):
+            for cc in c:
+                _walk(cc)
+
+    def _collect(g):
+        if not isinstance(g, dict):
+            return
+        t = g.get('type')
+        if t == 'Feature':
+            _collect(g.get('geometry'))
+        elif t == 'FeatureCollection':
+            for f in g.get('features') or []:
+                _collect((f or {}).get('geometry'))
+        elif t == 'GeometryCollection':
+            for gg in g.get('geometries') or []:
+                _collect(gg)
+        else:
+            _walk(g.get('coordinates'))
+
+    _collect(geom)
+    if not xs:
+        return None
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+@router.post('/models/detect-batch')
+async def detect_batch(data: DetectBatchIn, db = Depends(get_db), user = Depends(get_current_user)):
+    """Submit detection for many AOIs at once.
+
+    Creates one detection job per AOI plus a single 'detection_batches' record with
+    per-AOI status. The worker plans the union of DEM tiles once and runs the jobs in parallel.
+    """
+    from ..config import settings as _settings
+    targets: list[dict] = []
+    for bb in (data.bboxes or []):
+        if not isinstance(bb, list) or len(bb) != 4:
+            raise HTTPException(status_code=400, detail='Each bbox must be [minLon,minLat,maxLon,maxLat]')
+        targets.append({ 'aoi_id': None, 'name': None, 'bbox': [float(v) for v in bb] })
+    query: dict | None = None
+    if data.aoi_ids:
+        query = { '_id': { '$in': list(data.aoi_ids) } }
+    elif data.aoi_filter:
+        query = _aoi_filter_query(data.aoi_filter)
+    if query is not None:
+        async for a in db.get_collection('aois').find(query).limit(int(_settings.DETECTION_BATCH_MAX_AOIS) + 1):
+            bb = _bbox_of_geojson(a.get('geometry'))
+            if bb:
+                targets.append({ 'aoi_id': str(a.get('_id')), 'name': a.get('name'), 'bbox': bb })
+    if not targets:
+        raise HTTPException(status_code=400, detail='No AOIs to process')
+    if len(targets) > int(_settings.DETECTION_BATCH_MAX_AOIS):
+        raise HTTPException(status_code=400, detail=f'Too many AOIs (max {_settings.DETECTION_BATCH_MAX_AOIS})')
+
+    batch_id = str(uuid4())
+    user_email = (user or {}).get('sub', 'anonymous')
+    now = datetime.utcnow()
+    zoom = max(1, min(int(data.zoom or 10), 15))
+    from ..dem.terrarium import plan_tiles
+    n_tiles = len(plan_tiles([t['bbox'] for t in targets], zoom))
+    if n_tiles > int(_settings.DETECTION_BATCH_MAX_TILES):
+        raise HTTPException(status_code=400, detail=(
+            f'Batch needs {n_tiles} DEM tiles at zoom {zoom} (max {_settings.DETECTION_BATCH_MAX_TILES}); '
+            'split it or lower the zoom'))
+    jobs: list[dict] = []
+    items: list[dict] = []
+    for t in targets:
+        job_id = str(uuid4())
+        jobs.append({
+            '_id': job_id,
+            'status': 'pending',
+            'created_at': now,
+            'files': {},
+            'aoi_bbox': t['bbox'],
+            'aoi_id': t['aoi_id'],
+            'batch_id': batch_id,
+            'dem_zoom': zoom,
+            'notes': data.notes,
+            'older_date': data.older_date,
+            'user_email': user_email,
+        })
+        items.append({ 'job_id': job_id, 'aoi_id': t['aoi_id'], 'name': t['name'], 'bbox': t['bbox'], 'status': 'pending' })
+    await db.get_collection('detection_jobs').insert_many(jobs)
+    await db.get_collection('detection_batches').insert_one({
+        '_id': batch_id,
+        'status': 'pending',
+        'created_at': now,
+        'user_email': user_email,
+        'zoom': zoom,
+        'items': items,
+        'summary': None,
+    })
+    task_id = await _enqueue_job(db, 'detection_batches', batch_id, process_detection_batch_task, batch_id)
+    return { 'batch_id': batch_id, 'task_id': task_id, 'status': 'pending', 'count': len(items) }
+
+
+@router.get('/models/batches/{batch_id}')
+async def get_detection_batch(batch_id: str, db = Depends(get_db), user = Depends(get_current_user)):
+    b = await db.get_collection('detection_batches').find_one({ '_id': batch_id })
+    if not b:
+        raise HTTPException(status_code=404, detail='Batch not found')
+    if (user or {}).get('role') != 'authority':
+        if b.get('user_email') and b.get('user_email') != (user or {}).get('sub'):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Forbidden')
+    return {
+        'id': b.get('_id'),
+        'status': b.get('status'),
+        'created_at': b.get('created_at'),
+        'completed_at': b.get('completed_at'),
+        'tiles_planned': b.get('tiles_planned'),
+        'tiles_fetched': b.get('tiles_fetched'),
+        'items': b.get('items') or [],
+        'summary': b.get('summary'),
+    }
 
 
 class RiskIn(BaseModel):
@@ -817,6 +985,22 @@ async def get_detection_job(job_id: str, db = Depends(get_db), user = Depends(ge
     }
 
 
+@router.delete('/models/jobs/{job_id}')
+async def delete_detection_job(job_id: str, db = Depends(get_db), user = Depends(get_current_user)):
+    col = db.get_collection('detection_jobs')
+    j = await col.find_one({'_id': job_id}, projection={'user_email': 1})
+    if not j:
+        raise HTTPException(status_code=404, detail='Job not found')
+    if (user or {}).get('role') != 'authority':
+        if j.get('user_email') and j.get('user_email') != (user or {}).get('sub'):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Forbidden')
+    await col.delete_one({'_id': job_id})
+    await mark_changed(db, 'job', job_id)
+    from ..storage.artifacts import release_artifacts
+    await anyio.to_thread.run_sync(release_artifacts, f'job:{job_id}')
+    return {'id': job_id, 'deleted': True}
+
+
 @router.get('/models/jobs/{job_id}/export')
 async def export_detection_job_geojson(job_id: str, db = Depends(get_db), user = Depends(get_current_user)):
     """
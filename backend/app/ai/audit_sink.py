@@ -0,0 +1,156 @@
+"""
+Write-behind sink for audit records ('ai_audit', 'ai_llm_failures').
+
+Request handlers call emit(), which only appends to an in-memory buffer; a daemon
+thread writes the buffer with unordered insert_many per collection whenever it holds
+AUDIT_BATCH_SIZE records or AUDIT_FLUSH_INTERVAL_S has passed. The buffer is capped
+at AUDIT_BUFFER_MAX records: beyond that new records are dropped and counted rather
+than growing memory while Mongo is slow or down. close() flushes what is left
+(API shutdown and interpreter exit).
+
+Uses a sync pymongo client so it works the same from the API event loop, worker
+threads and Celery processes.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Tuple
+
+from ..config import settings
+
+_client = None
+
+
+def _collection(name: str):
+    global _client
+    if _client is None:
+        from pymongo import MongoClient
+        _client = MongoClient(settings.MONGO_URL, serverSelectionTimeoutMS=1500, connectTimeoutMS=1500)
+    return _client[settings.MONGO_DB_NAME].get_collection(name)
+
+
+class AuditSink:
+    def __init__(self, batch_size: int, flush_interval_s: float, max_buffer: int) -> None:
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval_s = max(0.05, float(flush_interval_s))
+        self.max_buffer = max(self.batch_size, int(max_buffer))
+        self._buf: Deque[Tuple[str, Dict[str, Any]]] = deque()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_at: datetime | None = None
+
+    def emit(self, collection: str, doc: Dict[str, Any]) -> bool:
+        """Queue one record; never blocks on I/O. Returns False if it was dropped."""
+        doc.setdefault('created_at', datetime.utcnow())
+        with self._cond:
+            if self._closed or len(self._buf) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buf.append((collection, doc))
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='audit-sink', daemon=True)
+                    self._thread.start()
+
+    def _take(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = []
+        while self._buf and len(batch) < self.batch_size:
+            batch.append(self._buf.popleft())
+        return batch
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        by_col: Dict[str, List[Dict[str, Any]]] = {}
+        for col, doc in batch:
+            by_col.setdefault(col, []).append(doc)
+        for col, docs in by_col.items():
+            try:
+                _collection(col).insert_many(docs, ordered=False)
+                self.written += len(docs)
+            except Exception as e:
+                # Partial bulk failures still wrote the rest; count the batch as failed for visibility
+                self.failed_flushes += 1
+                written = int(((getattr(e, 'details', None) or {}).get('nInserted')) or 0)
+                self.written += written
+                self.dropped += len(docs) - written
+                logging.warning("audit flush to %s failed (%s records lost): %s", col, len(docs) - written, e)
+        self.last_flush_at = datetime.utcnow()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._buf) < self.batch_size and not self._closed:
+                    self._cond.wait(timeout=self.flush_interval_s)
+                batch = self._take()
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            elif closed:
+                return
+
+    def flush(self, timeout_s: float = 5.0) -> None:
+        """Write everything buffered now (blocking, bounded by timeout_s)."""
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout_s)
+        self.flush(timeout_s)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'buffered': len(self._buf),
+            'max_buffer': self.max_buffer,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+        }
+
+
+_sink: AuditSink | None = None
+_sink_lock = threading.Lock()
+
+
+def get_audit_sink() -> AuditSink:
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = AuditSink(settings.AUDIT_BATCH_SIZE, settings.AUDIT_FLUSH_INTERVAL_S, settings.AUDIT_BUFFER_MAX)
+                atexit.register(_sink.close)
+    return _sink
+
+
+def audit(collection: str, doc: Dict[str, Any]) -> bool:
+    """Queue an audit record for write-behind insertion into collection."""
+    return get_audit_sink().emit(collection, doc)
+
+
+def close_audit_sink() -> None:
+    if _sink is not None:
+        _sink.close()
@@ -0,0 +1,164 @@
+"""
+Token-budget-aware prompt packing for chat and RAG.
+
+pack_messages() keeps the newest turns that fit LLM_CONTEXT_BUDGET_TOKENS and folds the
+older ones into one short extractive "earlier conversation" note (no extra LLM call).
+pack_passages() fills RAG_CONTEXT_BUDGET_TOKENS with retrieved passages in relevance
+order, skipping near-duplicates. Token counts use tiktoken when installed and a
+~4 chars/token estimate otherwise.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..config import settings
+
+try:
+    import tiktoken  # type: ignore
+    _HAS_TIKTOKEN = True
+except Exception:
+    _HAS_TIKTOKEN = False
+
+_encoding = None
+_MSG_OVERHEAD = 4  # role/separators per chat message
+_WORD_RE = re.compile(r'\w+')
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(settings.OPENAI_MODEL or 'gpt-4o-mini')
+        except Exception:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _HAS_TIKTOKEN:
+        try:
+            return len(_get_encoding().encode(text))
+        except Exception:
+            pass
+    return max(1, (len(text) + 3) // 4)
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Cut text to roughly budget tokens, on a word boundary, marking the cut."""
+    if budget <= 0:
+        return ''
+    if count_tokens(text) <= budget:
+        return text
+    if _HAS_TIKTOKEN:
+        try:
+            enc = _get_encoding()
+            return enc.decode(enc.encode(text)[:max(0, budget - 1)]).rstrip() + '…'
+        except Exception:
+            pass
+    cut = text[:max(0, budget * 4 - 1)]
+    if ' ' in cut:
+        cut = cut[:cut.rfind(' ')]
+    return cut.rstrip() + '…'
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= n:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _near_duplicate(sh: set, kept: List[set], threshold: float) -> bool:
+    for other in kept:
+        union = len(sh | other)
+        if union and len(sh & other) / union >= threshold:
+            return True
+    return False
+
+
+def pack_passages(passages: Sequence[str], budget: Optional[int] = None, dedupe_threshold: float = 0.8) -> List[str]:
+    """Best-first passages that fit the token budget, without near-duplicates (word 3-gram Jaccard)."""
+    budget = int(budget if budget is not None else settings.RAG_CONTEXT_BUDGET_TOKENS)
+    out: List[str] = []
+    kept: List[set] = []
+    used = 0
+    for p in passages:
+        if not p:
+            continue
+        sh = _shingles(p)
+        if _near_duplicate(sh, kept, dedupe_threshold):
+            continue
+        cost = count_tokens(p) + 1  # newline separator
+        if used + cost > budget:
+            # A lower-ranked shorter passage may still fit
+            continue
+        out.append(p)
+        kept.append(sh)
+        used += cost
+    return out
+
+
+def _summarize_turns(turns: Sequence[Dict], budget: int) -> str:
+    """Extractive note of dropped turns: first sentence of each, oldest first, within budget."""
+    lines: List[str] = []
+    for m in turns:
+        content = str(m.get('content') or '').strip()
+        if not content:
+            continue
+        first = re.split(r'(?<=[.!?])\s', content, maxsplit=1)[0]
+        lines.append(f"{m.get('role', 'user')}: {truncate_tokens(first, 40)}")
+    text = 'Earlier conversation (condensed): ' + ' / '.join(lines)
+    return truncate_tokens(text, budget)
+
+
+def pack_messages(messages: Sequence[Dict], system_prompt: Optional[str] = None, budget: Optional[int] = None) -> Tuple[List[Dict], Dict]:
+    """Fit chat history into the budget. Returns (messages, info).
+
+    The system prompt and the newest message always stay (the latter truncated if it
+    alone exceeds the budget); older turns are kept newest-first while they fit and
+    the rest is replaced by one condensed summary message.
+    """
+    budget = int(budget if budget is not None else settings.LLM_CONTEXT_BUDGET_TOKENS)
+    msgs = [m for m in (messages or []) if isinstance(m, dict)]
+    info = {'input_messages': len(msgs), 'dropped': 0, 'summarized': False}
+    if not msgs:
+        return [], {**info, 'tokens': count_tokens(system_prompt or '')}
+    remaining = budget - (count_tokens(system_prompt or '') + _MSG_OVERHEAD if system_prompt else 0)
+    last = dict(msgs[-1])
+    last_cost = count_tokens(str(last.get('content') or '')) + _MSG_OVERHEAD
+    if last_cost > remaining:
+        last['content'] = truncate_tokens(str(last.get('content') or ''), max(16, remaining - _MSG_OVERHEAD))
+        last_cost = count_tokens(last['content']) + _MSG_OVERHEAD
+    remaining -= last_cost
+    # Reserve room for the summary only if something will be dropped
+    older = msgs[:-1]
+    older_cost = sum(count_tokens(str(m.get('content') or '')) + _MSG_OVERHEAD for m in older)
+    summary_budget = 0 if older_cost <= remaining else min(settings.LLM_HISTORY_SUMMARY_TOKENS, max(0, remaining // 3))
+    remaining -= summary_budget
+    kept: List[Dict] = []
+    i = len(older)
+    while i > 0:
+        m = older[i - 1]
+        cost = count_tokens(str(m.get('content') or '')) + _MSG_OVERHEAD
+        if cost > remaining:
+            break
+        kept.append(m)
+        remaining -= cost
+        i -= 1
+    kept.reverse()
+    dropped = older[:i]
+    out: List[Dict] = []
+    if dropped:
+        info['dropped'] = len(dropped)
+        if summary_budget > _MSG_OVERHEAD:
+            out.append({'role': 'system', 'content': _summarize_turns(dropped, summary_budget - _MSG_OVERHEAD)})
+            info['summarized'] = True
+    out.extend(kept)
+    out.append(last)
+    info['tokens'] = (count_tokens(system_prompt) + _MSG_OVERHEAD if system_prompt else 0) + sum(
+        count_tokens(str(m.get('content') or '')) + _MSG_OVERHEAD for m in out
+    )
+    return out, info
@@ -1,13 +1,62 @@
 import os
 import httpx
 import logging
+import random
 import time
 from ..config import settings
-from ..mongo import get_db as _get_mongo_db
+from .llm_cache import cache_key, get_llm_cache
+from .singleflight import SingleFlight
+from .upstream_limiter import UpstreamBusy, estimate_tokens, get_upstream_limiter
 import asyncio
+import json
 
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+# OPENAI_BASE_URL can point at any OpenAI-compatible server, e.g. scripts/llm_standin.py for load tests
+OPENAI_API_URL = f"{settings.OPENAI_BASE_URL.rstrip('/')}/chat/completions"
+OPENAI_EMBEDDINGS_URL = f"{settings.OPENAI_BASE_URL.rstrip('/')}/embeddings"
+
+RETRY_DELAYS = [0.5, 1.0, 2.0]
+
+# Shared async client (connection pool) for all request-path LLM calls
+_async_client: httpx.AsyncClient | None = None
+
+# Identical concurrent completions share one upstream call
+_inflight = SingleFlight()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT_S, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+                keepalive_expiry=30.0,
+            ),
+        )
+    return _async_client
+
+
+async def aclose_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _api_key() -> str:
+    return settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY') or ''
+
+
+def _headers(api_key: str) -> dict:
+    return { 'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json' }
+
+
+def _backoff(attempt: int) -> float:
+    # Base delay for this attempt plus up to 25% jitter so retries from many workers spread out
+    base = RETRY_DELAYS[min(attempt - 1, len(RETRY_DELAYS) - 1)]
+    return base * (1.0 + random.random() * 0.25)
 
 
 def _build_summary_prompt(report_result: dict) -> str:
@@ -25,114 +74,393 @@ def _build_summary_prompt(report_result: dict) -> str:
     return "\n".join([p for p in pieces if p])
 
 
-def summarize_report(report_result: dict) -> str:
-    api_key = settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        # Safe fallback if no key is configured
-        est = (report_result or {}).get('estimation') or {}
-        area = (report_result or {}).get('area_ha', 'unknown')
-        vol = est.get('volume_m3')
-        return f"Estimated excavated volume {vol if vol is not None else 'N/A'} m^3 over area {area} ha."
-
-    prompt = _build_summary_prompt(report_result)
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json',
-    }
-    body = {
+def summary_input_hash(report_result: dict) -> str:
+    """Hash of everything that determines a report summary; stored with precomputed summaries."""
+    import hashlib
+    # Key presence is part of the hash so offline fallback summaries get replaced once a key is configured
+    material = f"{settings.OPENAI_MODEL or 'gpt-4o-mini'}\n{bool(_api_key())}\n{_build_summary_prompt(report_result)}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _summary_body(report_result: dict) -> dict:
+    return {
         'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
         'messages': [
             { 'role': 'system', 'content': 'You are an expert mining compliance assistant.' },
-            { 'role': 'user', 'content': prompt },
+            { 'role': 'user', 'content': _build_summary_prompt(report_result) },
         ],
         'temperature': 0.2,
         'max_tokens': 200,
     }
-    attempts = 3
-    delays = [0.5, 1.0, 2.0]
+
+
+def _summary_fallback(report_result: dict) -> str:
+    est = (report_result or {}).get('estimation') or {}
+    area = (report_result or {}).get('area_ha', 'unknown')
+    vol = est.get('volume_m3')
+    return f"Estimated excavated volume {vol if vol is not None else 'N/A'} m^3 over area {area} ha."
+
+
+def _chat_body(messages: list[dict], system_prompt: str | None) -> dict:
+    from .context_packer import pack_messages
+    packed, info = pack_messages(messages, system_prompt)
+    if info['dropped']:
+        logging.debug("chat history packed: dropped %s of %s turns (~%s tokens)", info['dropped'], info['input_messages'], info['tokens'])
+    chat_messages = []
+    if system_prompt:
+        chat_messages.append({ 'role': 'system', 'content': system_prompt })
+    chat_messages.extend(packed)
+    return {
+        'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
+        'messages': chat_messages,
+        'temperature': 0.2,
+        'max_tokens': 500,
+    }
+
+
+def _no_key_reply(messages: list[dict]) -> str:
+    last_user = next((m.get('content') for m in reversed(messages) if m.get('role') == 'user'), '')
+    return f"(dev) You asked: {last_user}. Summaries and answers will be richer when an OpenAI key is configured."
+
+
+def _content_of(data: dict, default: str) -> str:
+    return (data.get('choices') or [{}])[0].get('message', {}).get('content') or default
+
+
+async def _apost_completion(body: dict, api_key: str, label: str, timeout: float | None = None) -> dict:
+    """POST a chat completion over the shared pool with async backoff. Raises after the last attempt."""
+    client = get_async_client()
+    limiter = get_upstream_limiter()
+    est = estimate_tokens(body)
+    attempts = max(1, int(settings.LLM_RETRY_ATTEMPTS))
+    req_timeout = httpx.Timeout(timeout or settings.LLM_TIMEOUT_S, connect=5.0)
+    for attempt in range(1, attempts + 1):
+        try:
+            if limiter is not None:
+                await limiter.acquire(est)
+            r = await client.post(OPENAI_API_URL, headers=_headers(api_key), json=body, timeout=req_timeout)
+            if limiter is not None:
+                limiter.on_response(r.status_code, r.headers)
+            if r.status_code >= 400:
+                logging.error("OpenAI %s error %s attempt %s: %s", label, r.status_code, attempt, r.text[:400])
+            r.raise_for_status()
+            return r.json()
+        except (asyncio.CancelledError, UpstreamBusy):
+            raise
+        except Exception as e:
+            logging.warning("%s attempt %s failed: %s", label, attempt, e)
+            if attempt == attempts:
+                raise
+            throttled = isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429
+            if not (throttled and limiter is not None):
+                # On 429 the limiter already paused admission per Retry-After; otherwise back off
+                await asyncio.sleep(_backoff(attempt))
+    raise RuntimeError(f"{label}: no attempts made")
+
+
+async def _acomplete(body: dict, api_key: str, label: str, default: str, timeout: float | None = None, use_cache: bool = True) -> str:
+    """Completion text for body, served from the response cache when possible.
+
+    On a miss, concurrent identical requests are coalesced into one upstream call.
+    """
+    cache = get_llm_cache() if use_cache else None
+    key = cache_key(body)
+    if cache is not None:
+        hit = await cache.get(key)
+        if hit is not None:
+            return hit
+
+    async def _fetch() -> str:
+        data = await _apost_completion(body, api_key, label, timeout=timeout)
+        text = _content_of(data, '')
+        if text and cache is not None:
+            await cache.set(key, text)
+        return text
+
+    if settings.LLM_COALESCE_ENABLED:
+        text = await _inflight.do(key, _fetch)
+    else:
+        text = await _fetch()
+    return text or default
+
+
+def summarize_report(report_result: dict) -> tuple[str, bool]:
+    """Blocking variant for Celery/worker code. Request handlers use asummarize_report.
+
+    Returns (text, degraded); degraded is True when the upstream call failed and text is the
+    local fallback, which callers should not store as the report's summary.
+    """
+    api_key = _api_key()
+    if not api_key:
+        # Safe fallback if no key is configured (key presence is part of summary_input_hash)
+        return _summary_fallback(report_result), False
+
+    body = _summary_body(report_result)
+    attempts = max(1, int(settings.LLM_RETRY_ATTEMPTS))
     for attempt in range(1, attempts+1):
         try:
             with httpx.Client(timeout=20) as client:
-                r = client.post(OPENAI_API_URL, headers=headers, json=body)
+                r = client.post(OPENAI_API_URL, headers=_headers(api_key), json=body)
                 if r.status_code >= 400:
                     logging.error("OpenAI summarize error %s attempt %s: %s", r.status_code, attempt, r.text[:400])
                 r.raise_for_status()
-                data = r.json()
-                return (data.get('choices') or [{}])[0].get('message', {}).get('content') or 'Summary unavailable.'
+                text = _content_of(r.json(), '')
+                return (text, False) if text else ('Summary unavailable.', True)
         except Exception as e:
             logging.warning("summarize_report attempt %s failed: %s", attempt, e, exc_info=True)
             if attempt == attempts and settings.LLM_REQUIRE:
                 raise
             if attempt < attempts:
-                time.sleep(delays[attempt-1])
+                time.sleep(_backoff(attempt))
     # Fallback only if not strictly required
     if settings.LLM_REQUIRE:
         raise RuntimeError("LLM required but unavailable for summarize_report")
-        # Non-fatal fallback
-        est = (report_result or {}).get('estimation') or {}
-        area = (report_result or {}).get('area_ha', 'unknown')
-        vol = est.get('volume_m3')
-        return f"Estimated excavated volume {vol if vol is not None else 'N/A'} m^3 over area {area} ha."
+    # Non-fatal fallback
+    return _summary_fallback(report_result), True
+
+
+async def asummarize_report(report_result: dict, timeout: float | None = None, use_cache: bool = True) -> tuple[str, bool]:
+    """(text, degraded), as summarize_report."""
+    api_key = _api_key()
+    if not api_key:
+        return _summary_fallback(report_result), False
+    try:
+        text = await _acomplete(_summary_body(report_result), api_key, 'summarize', '', timeout=timeout, use_cache=use_cache)
+        return (text, False) if text else ('Summary unavailable.', True)
+    except (asyncio.CancelledError, UpstreamBusy):
+        raise
+    except Exception:
+        if settings.LLM_REQUIRE:
+            raise
+    return _summary_fallback(report_result), True
 
 
 def chat(messages: list[dict], system_prompt: str | None = None) -> str:
     """
+    Blocking variant for worker code; request handlers use achat.
     messages: list of { role: 'user'|'assistant'|'system', content: str }
     Returns assistant text. If no API key, returns a concise fallback.
     """
-    api_key = settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
+    api_key = _api_key()
     if not api_key:
         # simple echo/fallback
-        last_user = next((m.get('content') for m in reversed(messages) if m.get('role') == 'user'), '')
-        return f"(dev) You asked: {last_user}. Summaries and answers will be richer when an OpenAI key is configured."
-    headers = { 'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json' }
-    chat_messages = []
-    if system_prompt:
-        chat_messages.append({ 'role': 'system', 'content': system_prompt })
-    chat_messages.extend(messages)
-    body = {
-        'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
-        'messages': chat_messages,
-        'temperature': 0.2,
-        'max_tokens': 500,
-    }
-    attempts = 3
-    delays = [0.5, 1.0, 2.0]
+        return _no_key_reply(messages)
+    body = _chat_body(messages, system_prompt)
+    attempts = max(1, int(settings.LLM_RETRY_ATTEMPTS))
     for attempt in range(1, attempts+1):
         try:
             with httpx.Client(timeout=30) as client:
-                r = client.post(OPENAI_API_URL, headers=headers, json=body)
+                r = client.post(OPENAI_API_URL, headers=_headers(api_key), json=body)
                 if r.status_code >= 400:
                     logging.error("OpenAI chat error %s attempt %s: %s", r.status_code, attempt, r.text[:400])
                 r.raise_for_status()
-                data = r.json()
-                return (data.get('choices') or [{}])[0].get('message', {}).get('content') or 'Reply unavailable.'
+                return _content_of(r.json(), 'Reply unavailable.')
         except Exception as e:
             logging.warning("chat attempt %s failed: %s", attempt, e, exc_info=True)
             if attempt == attempts and settings.LLM_REQUIRE:
                 raise
             if attempt < attempts:
-                time.sleep(delays[attempt-1])
+                time.sleep(_backoff(attempt))
     if settings.LLM_REQUIRE:
         raise RuntimeError("LLM required but unavailable for chat")
-    # async log failure fire-and-forget
+    _log_failure(messages, system_prompt)
+    return _chat_fallback(messages)
+
+
+async def achat(messages: list[dict], system_prompt: str | None = None, timeout: float | None = None, use_cache: bool = True) -> str:
+    """Async chat over the shared connection pool; same fallbacks as chat().
+
+    Replies are served from the response cache unless use_cache=False.
+    """
+    api_key = _api_key()
+    if not api_key:
+        return _no_key_reply(messages)
     try:
-        async def _log():
-            try:
-                db = await _get_mongo_db()
-                await db.get_collection('ai_llm_failures').insert_one({
-                    'at': __import__('datetime').datetime.utcnow(),
-                    'system_prompt': system_prompt,
-                    'messages_tail': messages[-5:],
-                    'model': settings.OPENAI_MODEL or 'gpt-4o-mini'
-                })
-            except Exception:
-                pass
-        asyncio.create_task(_log())
+        return await _acomplete(_chat_body(messages, system_prompt), api_key, 'chat', 'Reply unavailable.', timeout=timeout, use_cache=use_cache)
+    except (asyncio.CancelledError, UpstreamBusy):
+        raise
+    except Exception:
+        if settings.LLM_REQUIRE:
+            raise
+    _log_failure(messages, system_prompt)
+    return _chat_fallback(messages)
+
+
+class LLMStreamTimeout(Exception):
+    pass
+
+
+class _StreamStats:
+    def __init__(self) -> None:
+        self.streams = 0
+        self.completed = 0
+        self.disconnects = 0
+        self.timeouts = 0
+        self.tokens = 0
+        self.ttft_ms_total = 0.0
+        self.ttft_samples = 0
+        self.gen_seconds = 0.0
+
+    def record(self, meta: dict) -> None:
+        self.streams += 1
+        outcome = meta.get('outcome')
+        if outcome == 'completed':
+            self.completed += 1
+        elif outcome == 'disconnected':
+            self.disconnects += 1
+        elif outcome == 'timeout':
+            self.timeouts += 1
+        self.tokens += int(meta.get('tokens') or 0)
+        if meta.get('ttft_ms') is not None:
+            self.ttft_ms_total += float(meta['ttft_ms'])
+            self.ttft_samples += 1
+        self.gen_seconds += float(meta.get('gen_s') or 0.0)
+
+    def stats(self) -> dict:
+        return {
+            'streams': self.streams,
+            'completed': self.completed,
+            'disconnects': self.disconnects,
+            'timeouts': self.timeouts,
+            'avg_ttft_ms': round(self.ttft_ms_total / self.ttft_samples, 1) if self.ttft_samples else None,
+            'tokens_per_s': round(self.tokens / self.gen_seconds, 1) if self.gen_seconds > 0 else None,
+        }
+
+
+stream_stats = _StreamStats()
+
+
+async def astream_chat(body: dict, api_key: str, request=None, meta: dict | None = None):
+    """Stream a chat completion over the shared pool, yielding coalesced text chunks.
+
+    Tokens are buffered until LLM_STREAM_FLUSH_CHARS characters or LLM_STREAM_FLUSH_MS have
+    accumulated. Raises LLMStreamTimeout on idle/total timeout. Stops (closing the upstream
+    stream) when `request` reports a client disconnect. `meta` receives ttft_ms, tokens,
+    tokens_per_s and outcome.
+    """
+    meta = meta if meta is not None else {}
+    client = get_async_client()
+    idle = float(settings.LLM_STREAM_IDLE_TIMEOUT_S)
+    total = float(settings.LLM_STREAM_TOTAL_TIMEOUT_S)
+    flush_chars = max(1, int(settings.LLM_STREAM_FLUSH_CHARS))
+    flush_s = max(0.0, settings.LLM_STREAM_FLUSH_MS / 1000.0)
+    started = time.monotonic()
+    first_at: float | None = None
+    n_tokens = 0
+    buf: list[str] = []
+    buf_len = 0
+    last_flush = started
+    meta['outcome'] = 'error'
+    limiter = get_upstream_limiter()
+    if limiter is not None:
+        await limiter.acquire(estimate_tokens(body))
+    try:
+        async with client.stream(
+            'POST', OPENAI_API_URL,
+            headers=_headers(api_key),
+            json={**body, 'stream': True},
+            timeout=httpx.Timeout(total, connect=5.0, read=idle),
+        ) as r:
+            if limiter is not None:
+                limiter.on_response(r.status_code, r.headers)
+            r.raise_for_status()
+            lines = r.aiter_lines()
+            while True:
+                remaining = total - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise LLMStreamTimeout('total stream timeout exceeded')
+                try:
+                    line = await asyncio.wait_for(lines.__anext__(), timeout=min(idle, remaining))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise LLMStreamTimeout('upstream stream idle timeout')
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                try:
+                    delta = json.loads(payload).get('choices', [{}])[0].get('delta', {}).get('content')
+                except Exception:
+                    continue
+                if not delta:
+                    continue
+                now = time.monotonic()
+                if first_at is None:
+                    first_at = now
+                n_tokens += 1
+                buf.append(delta)
+                buf_len += len(delta)
+                if buf_len >= flush_chars or now - last_flush >= flush_s:
+                    if request is not None and await request.is_disconnected():
+                        meta['outcome'] = 'disconnected'
+                        return
+                    yield ''.join(buf)
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = now
+        if buf:
+            yield ''.join(buf)
+        meta['outcome'] = 'completed'
+    except LLMStreamTimeout:
+        meta['outcome'] = 'timeout'
+        raise
+    except (asyncio.CancelledError, GeneratorExit):
+        # Starlette cancels the generator when the browser goes away
+        meta['outcome'] = 'disconnected'
+        raise
+    finally:
+        end = time.monotonic()
+        meta['tokens'] = n_tokens
+        meta['ttft_ms'] = round((first_at - started) * 1000.0, 1) if first_at is not None else None
+        gen_s = (end - first_at) if first_at is not None else 0.0
+        meta['gen_s'] = round(gen_s, 3)
+        meta['tokens_per_s'] = round(n_tokens / gen_s, 1) if gen_s > 0 else None
+        stream_stats.record(meta)
+
+
+async def call_with_disconnect(request, coro, poll_s: float = 0.5):
+    """Await coro, cancelling it if the HTTP client disconnects first.
+
+    Raises HTTPException(499) on disconnect so no upstream tokens are spent on a dead request,
+    and HTTPException(503) with Retry-After when upstream admission control rejects the call.
+    """
+    from fastapi import HTTPException
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_s)
+            if done:
+                try:
+                    return task.result()
+                except UpstreamBusy as e:
+                    # Admission control rejected the call: fail fast instead of queueing
+                    raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': str(int(e.retry_after) + 1)})
+            if request is not None and await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=499, detail='Client disconnected')
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _log_failure(messages: list[dict], system_prompt: str | None) -> None:
+    # Write-behind: buffered and bulk-inserted by the audit sink, safe from threads without a loop
+    try:
+        from .audit_sink import audit
+        audit('ai_llm_failures', {
+            'at': __import__('datetime').datetime.utcnow(),
+            'system_prompt': system_prompt,
+            'messages_tail': messages[-5:],
+            'model': settings.OPENAI_MODEL or 'gpt-4o-mini'
+        })
     except Exception:
         pass
+
+
+def _chat_fallback(messages: list[dict]) -> str:
     last_user = next((m.get('content') for m in reversed(messages) if m.get('role') == 'user'), '').strip()
-    original = last_user
     # Extract QUESTION: line if a RAG context blob was echoed
     if 'CONTEXT' in last_user.upper():
         for line in last_user.splitlines():
@@ -161,8 +489,13 @@ def chat(messages: list[dict], system_prompt: str | None = None) -> str:
 def llm_diagnostics() -> dict:
     """Return non-secret diagnostics about LLM configuration for debugging."""
     key_present = bool(settings.OPENAI_API_KEY or os.getenv('OPENAI_API_KEY'))
+    cache = get_llm_cache()
     return {
         'openai_key_loaded': key_present,
         'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
         'using_env_var': bool(os.getenv('OPENAI_API_KEY') and not settings.OPENAI_API_KEY),
+        'cache': cache.stats() if cache is not None else None,
+        'coalescing': _inflight.stats(),
+        'streaming': stream_stats.stats(),
+        'admission': limiter.stats() if (limiter := get_upstream_limiter()) is not None else None,
     }
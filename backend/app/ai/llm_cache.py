@@ -0,0 +1,151 @@
+"""
+Response cache for non-streaming LLM completions.
+
+Keys are a SHA-256 of the normalized request (model, messages incl. system prompt,
+temperature, max_tokens). Runs of whitespace are collapsed so reflowed prompts share an
+entry; text stays case-sensitive, since case can change the answer (code, identifiers,
+acronyms). Entries live in a size-bounded
+in-memory LRU with TTL; with LLM_CACHE_BACKEND=mongo they are also written to the
+'llm_cache' collection (TTL-indexed) so they survive restarts and are shared by workers.
+
+Streaming responses are never cached.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from ..config import settings
+from ..mongo import get_db as _get_mongo_db
+
+
+def _norm_text(v: Any) -> Any:
+    if isinstance(v, str):
+        return " ".join(v.split())
+    return v
+
+
+def cache_key(body: Dict[str, Any]) -> str:
+    """Stable hash of the parts of a completion request that determine the answer."""
+    msgs = [
+        {'role': (m or {}).get('role'), 'content': _norm_text((m or {}).get('content'))}
+        for m in (body.get('messages') or [])
+    ]
+    material = {
+        'model': body.get('model'),
+        'messages': msgs,
+        'temperature': round(float(body.get('temperature') or 0.0), 3),
+        'max_tokens': body.get('max_tokens'),
+    }
+    raw = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, ttl_s: float, max_entries: int, backend: str = 'memory') -> None:
+        self.ttl_s = max(1.0, float(ttl_s))
+        self.max_entries = max(1, int(max_entries))
+        self.backend = (backend or 'memory').lower()
+        self._mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._index_ready = False
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    async def _collection(self):
+        db = await _get_mongo_db()
+        col = db.get_collection('llm_cache')
+        if not self._index_ready:
+            try:
+                await col.create_index('expires_at', expireAfterSeconds=0)
+            except Exception:
+                pass
+            self._index_ready = True
+        return col
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            self._mem.pop(key, None)
+            return None
+        self._mem.move_to_end(key)
+        return value
+
+    def _mem_put(self, key: str, value: str, ttl_s: float) -> None:
+        self._mem[key] = (time.monotonic() + ttl_s, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._mem_get(key)
+        if value is None and self.backend == 'mongo':
+            try:
+                col = await self._collection()
+                doc = await col.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+                if doc and isinstance(doc.get('value'), str):
+                    value = doc['value']
+                    remaining = (doc['expires_at'] - datetime.utcnow()).total_seconds()
+                    self._mem_put(key, value, max(1.0, remaining))
+            except Exception as e:
+                logging.debug("llm_cache mongo read skipped: %s", e)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl_s: float | None = None) -> None:
+        ttl = float(ttl_s or self.ttl_s)
+        self._mem_put(key, value, ttl)
+        self.stores += 1
+        if self.backend == 'mongo':
+            try:
+                col = await self._collection()
+                await col.update_one(
+                    {'_id': key},
+                    {'$set': {'value': value, 'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}},
+                    upsert=True,
+                )
+            except Exception as e:
+                logging.debug("llm_cache mongo write skipped: %s", e)
+
+    def clear(self) -> None:
+        self._mem.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'entries': len(self._mem),
+            'max_entries': self.max_entries,
+            'ttl_s': self.ttl_s,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_cache: LLMCache | None = None
+
+
+def get_llm_cache() -> LLMCache | None:
+    """Process-wide cache, or None when LLM_CACHE_ENABLED is false."""
+    global _cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = LLMCache(settings.LLM_CACHE_TTL_S, settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_BACKEND)
+    return _cache
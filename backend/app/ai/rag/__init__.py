@@ -0,0 +1,5 @@
+"""Retrieval for /ai/chat/rag: indexed search over the app's own Mongo collections."""
+from .documents import mark_changed, mark_changed_sync
+from .index import RagIndex, ensure_rag_indexes, get_rag_index
+
+__all__ = ['RagIndex', 'ensure_rag_indexes', 'get_rag_index', 'mark_changed', 'mark_changed_sync']
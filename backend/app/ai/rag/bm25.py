@@ -0,0 +1,84 @@
+"""
+In-memory BM25 inverted index.
+
+Postings map term -> {doc_key: term frequency}; a query only touches the postings of
+its own terms, so search cost depends on how common the query terms are, not on how
+many documents are indexed. Documents can be added, replaced and removed one at a time.
+The whole object is plain dicts/ints and pickles cleanly for snapshots.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+_TOKEN_RE = re.compile(r'[a-z0-9_]+')
+_STOPWORDS = frozenset(
+    'a an and are as at be by for from has have how in is it its of on or that the this to was were what when '
+    'where which who why will with'.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or '').lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}  # key -> {'text', **meta}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, key: str, text: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        """Index (or re-index) one document under key."""
+        if key in self.docs:
+            self.remove(key)
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[key] = tf
+        self.lengths[key] = len(terms)
+        self.total_len += len(terms)
+        self.docs[key] = {**(meta or {}), 'text': text}
+
+    def remove(self, key: str) -> bool:
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return False
+        for term in set(tokenize(doc['text'])):
+            plist = self.postings.get(term)
+            if plist is not None:
+                plist.pop(key, None)
+                if not plist:
+                    del self.postings[term]
+        self.total_len -= self.lengths.pop(key, 0)
+        return True
+
+    def search(self, query: str, k: int = 5, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Top-k documents for query as [{'key', 'score', 'text', **meta}], best first."""
+        n = len(self.docs)
+        if n == 0:
+            return []
+        allowed = set(kinds) if kinds else None
+        avg_len = (self.total_len / n) or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for key, tf in plist.items():
+                norm = self.k1 * (1.0 - self.b + self.b * self.lengths.get(key, 0) / avg_len)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+        if allowed is not None:
+            scores = {key: s for key, s in scores.items() if self.docs[key].get('kind') in allowed}
+        top = heapq.nlargest(max(1, int(k)), scores.items(), key=lambda kv: kv[1])
+        return [{'key': key, 'score': round(s, 4), **self.docs[key]} for key, s in top]
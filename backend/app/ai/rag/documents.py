@@ -0,0 +1,107 @@
+"""
+Source collections for RAG retrieval and the change feed that keeps indexes current.
+
+Each indexed kind maps to a Mongo collection and a formatter that turns a document
+into one passage of text. Writers call mark_changed()/mark_changed_sync() after they
+insert, update or delete a document; this upserts a small marker into 'rag_changes'
+which every API process replays into its in-memory index (see index.RagIndex.sync).
+Markers expire via a TTL index, so the feed stays small.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Tuple
+
+CHANGES_COLLECTION = 'rag_changes'
+
+
+def _fmt_report(r: Dict[str, Any]) -> str:
+    parts = [f"Report {r.get('_id')}"]
+    if r.get('status'): parts.append(f"status={r.get('status')}")
+    if r.get('filename'): parts.append(f"File: {r.get('filename')}")
+    if r.get('summary'): parts.append(f"Summary: {r.get('summary')}")
+    res = r.get('result') or {}
+    if isinstance(res, dict):
+        est = res.get('estimation') or {}
+        vol = est.get('volume_m3'); dep = est.get('depth_m')
+        if vol is not None: parts.append(f"Volume m3: {vol}")
+        if dep is not None: parts.append(f"Depth m: {dep}")
+        if res.get('area_ha') is not None: parts.append(f"Area ha: {res.get('area_ha')}")
+        persisted = res.get('detections_persisted') or {}
+        if persisted.get('inserted') is not None: parts.append(f"Detections: {persisted.get('inserted')}")
+    if r.get('area_ha') is not None: parts.append(f"Area ha: {r.get('area_ha')}")
+    if r.get('notes'): parts.append(f"Notes: {r.get('notes')}")
+    return " | ".join(parts)
+
+
+def _fmt_job(j: Dict[str, Any]) -> str:
+    parts = [f"Job {j.get('_id')} status={j.get('status')}"]
+    if j.get('area_legal') is not None: parts.append(f"area_legal: {j.get('area_legal')}")
+    if j.get('area_illegal') is not None: parts.append(f"area_illegal: {j.get('area_illegal')}")
+    if j.get('volume_cubic_m') is not None: parts.append(f"volume_cubic_m: {j.get('volume_cubic_m')}")
+    if j.get('error'): parts.append(f"error: {j.get('error')}")
+    if j.get('notes'): parts.append(f"notes: {j.get('notes')}")
+    return " | ".join(parts)
+
+
+def _fmt_alert(a: Dict[str, Any]) -> str:
+    parts = [f"Alert {a.get('_id')} type={a.get('type')}"]
+    for k in ('title', 'description', 'location', 'area'):
+        if a.get(k): parts.append(f"{k}: {a.get(k)}")
+    parts.append('acknowledged' if a.get('acknowledged') else 'open')
+    if a.get('created_at'): parts.append(f"created: {a.get('created_at')}")
+    return " | ".join(parts)
+
+
+def _fmt_shapefile(s: Dict[str, Any]) -> str:
+    parts = [f"Shapefile {s.get('_id')} name: {s.get('name')}"]
+    for k, v in (s.get('metadata') or {}).items():
+        parts.append(f"{k}: {v}")
+    # Attribute values of the first features (lease ids, owners, districts) are useful search terms
+    seen: set = set()
+    for f in ((s.get('geojson') or {}).get('features') or []):
+        for k, v in ((f or {}).get('properties') or {}).items():
+            if isinstance(v, (str, int, float)) and (k, v) not in seen and len(seen) < 100:
+                seen.add((k, v))
+                parts.append(f"{k}: {v}")
+    return " | ".join(parts)
+
+
+# kind -> (collection, projection, formatter)
+SOURCES: Dict[str, Tuple[str, Dict[str, Any], Callable[[Dict[str, Any]], str]]] = {
+    'report': ('mining_reports', {'status': 1, 'filename': 1, 'summary': 1, 'result.estimation': 1, 'result.area_ha': 1, 'result.detections_persisted.inserted': 1, 'area_ha': 1, 'notes': 1}, _fmt_report),
+    'job': ('detection_jobs', {'status': 1, 'area_legal': 1, 'area_illegal': 1, 'volume_cubic_m': 1, 'error': 1, 'notes': 1}, _fmt_job),
+    'alert': ('alerts', {'type': 1, 'title': 1, 'description': 1, 'location': 1, 'area': 1, 'acknowledged': 1, 'created_at': 1}, _fmt_alert),
+    'shapefile': ('shapefiles', {'name': 1, 'metadata': 1, 'geojson.features': {'$slice': 50}}, _fmt_shapefile),
+}
+
+
+def doc_key(kind: str, ref: Any) -> str:
+    return f"{kind}:{ref}"
+
+
+def format_document(kind: str, doc: Dict[str, Any]) -> str:
+    return SOURCES[kind][2](doc)
+
+
+def _marker(kind: str, ref: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    return {'_id': doc_key(kind, ref)}, {'$set': {'kind': kind, 'ref': ref, 'at': datetime.utcnow()}}
+
+
+async def mark_changed(db, kind: str, ref: Any) -> None:
+    """Record that a document was written so indexes pick it up (async Motor db). Best-effort."""
+    try:
+        flt, upd = _marker(kind, ref)
+        await db.get_collection(CHANGES_COLLECTION).update_one(flt, upd, upsert=True)
+    except Exception as e:
+        logging.debug("rag change marker skipped for %s:%s: %s", kind, ref, e)
+
+
+def mark_changed_sync(db, kind: str, ref: Any) -> None:
+    """Same as mark_changed for sync pymongo databases (Celery workers)."""
+    try:
+        flt, upd = _marker(kind, ref)
+        db.get_collection(CHANGES_COLLECTION).update_one(flt, upd, upsert=True)
+    except Exception as e:
+        logging.debug("rag change marker skipped for %s:%s: %s", kind, ref, e)
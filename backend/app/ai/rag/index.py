@@ -0,0 +1,290 @@
+"""
+Persistent hybrid retrieval index over reports, detection jobs, alerts and shapefiles.
+
+Each passage is held in a BM25 inverted index (exact terms, ids) and, once embedded, in a
+vector index (paraphrases: "excavation outside lease" ~ "boundary violation"); search
+fuses both rankings with reciprocal-rank fusion.
+
+The index lives in memory and is snapshotted to RAG_INDEX_DIR. On first use a process
+loads the snapshot (or does one full build if there is none, or it is older than the
+change-feed TTL) and from then on only replays 'rag_changes' markers newer than its
+watermark, at most every RAG_SYNC_INTERVAL_S. A query therefore costs one indexed
+marker lookup plus a postings walk, independent of collection sizes. New passages are
+embedded by a background task, never on the query path; until then they are found
+through BM25 only.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from itertools import islice
+import os
+import pickle
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from ...config import settings
+from .bm25 import BM25Index
+from .documents import CHANGES_COLLECTION, SOURCES, doc_key, format_document
+from .vectors import VectorIndex, get_embedder
+
+_SNAPSHOT_VERSION = 2
+# Replay markers slightly before the watermark: writer clocks may differ a little
+_WATERMARK_OVERLAP = timedelta(seconds=5)
+_SYNC_BATCH = 2000
+_EMBED_BATCH = 64
+_RRF_K = 60
+
+
+def _index_dir() -> Path:
+    if settings.RAG_INDEX_DIR:
+        return Path(settings.RAG_INDEX_DIR)
+    from ...utils.file_storage import STORAGE_ROOT
+    return STORAGE_ROOT / 'index'
+
+
+async def ensure_rag_indexes(db) -> None:
+    """TTL + watermark index for the change feed; called at API startup."""
+    try:
+        col = db.get_collection(CHANGES_COLLECTION)
+        await col.create_index('at', expireAfterSeconds=int(settings.RAG_CHANGES_TTL_S))
+        # Serves the (at, _id) paging cursor in _replay_changes
+        await col.create_index([('at', 1), ('_id', 1)])
+    except Exception:
+        pass
+
+
+class RagIndex:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.bm25 = BM25Index()
+        self.embedder = get_embedder()
+        self.vectors = VectorIndex(self.embedder.name)
+        # key -> (text, meta) written but not yet embedded (embedding may be remote and fail)
+        self._to_embed: Dict[str, tuple] = {}
+        self.watermark: Optional[datetime] = None  # None until built or loaded
+        self._lock = asyncio.Lock()
+        self._embed_task: Optional[asyncio.Task] = None
+        self._last_sync = 0.0
+        self._last_save = 0.0
+        self._unsaved = 0
+        self.applied = 0
+        self.rebuilds = 0
+
+    # --- snapshots ---
+    def load(self) -> bool:
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('version') != _SNAPSHOT_VERSION:
+                return False
+            self.bm25 = state['bm25']
+            self.watermark = state['watermark']
+            self.vectors = state['vectors']
+            self._to_embed = state['to_embed']
+            if self.vectors.embedder_name != self.embedder.name:
+                # Embedding model changed: vectors are not comparable, re-embed every passage
+                self.vectors = VectorIndex(self.embedder.name)
+                self._to_embed = {k: (d['text'], {m: v for m, v in d.items() if m != 'text'}) for k, d in self.bm25.docs.items()}
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning("RAG index snapshot unreadable (%s), rebuilding", e)
+            return False
+
+    def _save_sync(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump({
+                'version': _SNAPSHOT_VERSION,
+                'bm25': self.bm25,
+                'vectors': self.vectors,
+                'to_embed': self._to_embed,
+                'watermark': self.watermark,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+
+    async def save(self) -> None:
+        async with self._lock:
+            if self.watermark is None:
+                return
+            try:
+                # Mutations only happen under the lock, so pickling in a thread is safe
+                await asyncio.to_thread(self._save_sync)
+            except Exception as e:
+                logging.warning("RAG index snapshot failed: %s", e)
+
+    # --- building ---
+    def _apply(self, kind: str, ref: Any, doc: Optional[Dict[str, Any]]) -> None:
+        key = doc_key(kind, ref)
+        if doc is None:
+            self.bm25.remove(key)
+            self.vectors.remove(key)
+            self._to_embed.pop(key, None)
+        else:
+            text, meta = format_document(kind, doc), {'kind': kind, 'id': str(ref)}
+            self.bm25.add(key, text, meta)
+            self._to_embed[key] = (text, meta)
+        self._unsaved += 1
+        self.applied += 1
+
+    async def _rebuild(self, db) -> None:
+        started = datetime.utcnow()
+        fresh = BM25Index()
+        for kind, (collection, projection, _) in SOURCES.items():
+            async for d in db.get_collection(collection).find({}, projection=projection).batch_size(1000):
+                fresh.add(doc_key(kind, d['_id']), format_document(kind, d), {'kind': kind, 'id': str(d['_id'])})
+        # Swap in one step so concurrent searches see either the old or the complete index.
+        # Changes written during the scan are replayed by the next sync.
+        self.bm25 = fresh
+        self.vectors = VectorIndex(self.embedder.name)
+        self._to_embed = {k: (d['text'], {m: v for m, v in d.items() if m != 'text'}) for k, d in fresh.docs.items()}
+        self.watermark = started
+        self._unsaved += 1
+        self.rebuilds += 1
+
+    async def _replay_changes(self, db) -> None:
+        changes = db.get_collection(CHANGES_COLLECTION)
+        # Only the first page overlaps the watermark (late writers); later pages follow a strict
+        # (at, _id) cursor so a burst of markers sharing one timestamp cannot repeat a page forever
+        query: Dict[str, Any] = {'at': {'$gte': self.watermark - _WATERMARK_OVERLAP}}
+        while True:
+            batch = await changes.find(query).sort([('at', 1), ('_id', 1)]).limit(_SYNC_BATCH).to_list(_SYNC_BATCH)
+            by_kind: Dict[str, List[Any]] = {}
+            for m in batch:
+                if m.get('kind') in SOURCES:
+                    by_kind.setdefault(m['kind'], []).append(m.get('ref'))
+            for kind, refs in by_kind.items():
+                collection, projection, _ = SOURCES[kind]
+                found: Dict[str, Dict[str, Any]] = {}
+                async for d in db.get_collection(collection).find({'_id': {'$in': refs}}, projection=projection):
+                    found[str(d['_id'])] = d
+                for ref in refs:
+                    self._apply(kind, ref, found.get(str(ref)))
+            if batch:
+                self.watermark = max(self.watermark, batch[-1]['at'])
+            if len(batch) < _SYNC_BATCH:
+                return
+            last_at, last_id = batch[-1]['at'], batch[-1]['_id']
+            query = {'$or': [{'at': {'$gt': last_at}}, {'at': last_at, '_id': {'$gt': last_id}}]}
+
+    async def _embed_pending(self, max_batches: int = 50) -> None:
+        # Runs as a background task. The lock is held per batch only, so replays and
+        # snapshots interleave with a large backlog (e.g. after a rebuild)
+        for _ in range(max_batches):
+            async with self._lock:
+                if not self._to_embed:
+                    return
+                keys = list(islice(self._to_embed, _EMBED_BATCH))
+                texts = [self._to_embed[k][0] for k in keys]
+                try:
+                    mat = await self.embedder.embed(texts)
+                except Exception as e:
+                    # Remote embedder down: keep the backlog and retry after the next sync
+                    logging.warning("RAG embedding deferred (%s pending): %s", len(self._to_embed), e)
+                    return
+                for key, vec in zip(keys, mat):
+                    item = self._to_embed.pop(key, None)
+                    if item is not None:
+                        self.vectors.upsert(key, vec, item[1])
+                self._unsaved += 1
+            await asyncio.sleep(0)  # local embedding is CPU-bound: let requests run between batches
+
+    def _schedule_embedding(self) -> None:
+        if self._to_embed and (self._embed_task is None or self._embed_task.done()):
+            self._embed_task = asyncio.create_task(self._embed_pending())
+
+    async def sync(self, db, force: bool = False) -> None:
+        """Bring the index up to date with Mongo (throttled unless force)."""
+        if not force and time.monotonic() - self._last_sync < settings.RAG_SYNC_INTERVAL_S:
+            return
+        async with self._lock:
+            if not force and time.monotonic() - self._last_sync < settings.RAG_SYNC_INTERVAL_S:
+                return
+            # Set before the attempt so an unreachable Mongo is retried at most once per interval
+            self._last_sync = time.monotonic()
+            if self.watermark is None and not await asyncio.to_thread(self.load):
+                await self._rebuild(db)
+            elif self.watermark < datetime.utcnow() - timedelta(seconds=settings.RAG_CHANGES_TTL_S):
+                # Markers older than the TTL are gone: the snapshot cannot be caught up
+                await self._rebuild(db)
+            try:
+                await self._replay_changes(db)
+            except Exception as e:
+                logging.debug("RAG change replay skipped: %s", e)
+            self._schedule_embedding()
+            if self._unsaved and time.monotonic() - self._last_save > settings.RAG_SNAPSHOT_INTERVAL_S:
+                try:
+                    await asyncio.to_thread(self._save_sync)
+                except Exception as e:
+                    logging.warning("RAG index snapshot failed: %s", e)
+
+    async def search(self, db, query: str, k: int = 5, kinds: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        try:
+            # Never queue behind a running build/replay: answer from the current index instead
+            if not self._lock.locked():
+                await self.sync(db)
+        except Exception as e:
+            # Mongo down: answer from whatever the index already holds
+            logging.debug("RAG index sync failed: %s", e)
+        pool = max(1, int(k)) * 3
+        ranked = [self.bm25.search(query, k=pool, kinds=kinds)]
+        if len(self.vectors):
+            try:
+                qvec = (await self.embedder.embed([query]))[0]
+                hits = self.vectors.search(qvec, k=pool if not kinds else pool * 4)
+                if kinds:
+                    allowed = set(kinds)
+                    hits = [h for h in hits if h.get('kind') in allowed]
+                ranked.append(hits)
+            except Exception as e:
+                logging.debug("RAG vector search skipped: %s", e)
+        return self._fuse(ranked, k)
+
+    def _fuse(self, ranked: List[List[Dict[str, Any]]], k: int) -> List[Dict[str, Any]]:
+        """Reciprocal-rank fusion of several best-first hit lists."""
+        if len(ranked) == 1:
+            return ranked[0][:k]
+        scores: Dict[str, float] = {}
+        for hits in ranked:
+            for rank, h in enumerate(hits):
+                scores[h['key']] = scores.get(h['key'], 0.0) + 1.0 / (_RRF_K + rank + 1)
+        out = []
+        for key in sorted(scores, key=scores.get, reverse=True)[:max(1, int(k))]:
+            doc = self.bm25.docs.get(key)
+            if doc is not None:
+                out.append({'key': key, 'score': round(scores[key], 5), **doc})
+        return out
+
+    @property
+    def pending_embeddings(self) -> int:
+        return len(self._to_embed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'documents': len(self.bm25),
+            'terms': len(self.bm25.postings),
+            'watermark': self.watermark.isoformat() if self.watermark else None,
+            'applied_changes': self.applied,
+            'rebuilds': self.rebuilds,
+            'unsaved_changes': self._unsaved,
+            'pending_embeddings': len(self._to_embed),
+            **self.vectors.stats(),
+            'snapshot': str(self.path),
+        }
+
+
+_index: RagIndex | None = None
+
+
+def get_rag_index() -> RagIndex:
+    global _index
+    if _index is None:
+        _index = RagIndex(_index_dir() / 'rag_bm25.pkl')
+    return _index
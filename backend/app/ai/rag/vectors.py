@@ -0,0 +1,222 @@
+"""
+Embedding store with an in-process nearest-neighbour index.
+
+Vectors are L2-normalised float32 rows, so cosine similarity is a dot product. Up to
+RAG_ANN_THRESHOLD rows are searched brute force with one matrix-vector product; above
+that an IVF index (k-means coarse quantiser, nprobe lists scanned) is trained and kept
+current: new rows are assigned to their nearest centroid and the quantiser is retrained
+once the row count has doubled since training.
+
+Embedding functions are pluggable (see get_embedder): 'local' is a deterministic
+feature-hashing model that needs no network (offline/dev/tests), 'openai' calls the
+embeddings API through the shared LLM client.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ...config import settings
+from .bm25 import tokenize
+
+
+class HashingEmbedder:
+    """Deterministic local embedding: signed feature hashing of words, bigrams and char trigrams."""
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = int(dim)
+        self.name = f'local-hash-{self.dim}'
+
+    def _features(self, text: str) -> List[str]:
+        words = tokenize(text)
+        feats = list(words)
+        feats += [f'{a} {b}' for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f'#{w}#'
+            feats += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        return feats
+
+    def embed_one(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for f in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'little')
+            v[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        n = float(np.linalg.norm(v))
+        return v / n if n > 0 else v
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.vstack([self.embed_one(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings endpoint via the pooled async client (admission-controlled)."""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.name = f'openai-{model}'
+        self.dim = 0  # known after the first call
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        from ..llm import OPENAI_EMBEDDINGS_URL, get_async_client, _api_key, _headers
+        from ..upstream_limiter import get_upstream_limiter
+        api_key = _api_key()
+        if not api_key:
+            raise RuntimeError('OPENAI_API_KEY not configured')
+        limiter = get_upstream_limiter()
+        if limiter is not None:
+            await limiter.acquire(sum(len(t) for t in texts) // 4)
+        r = await get_async_client().post(
+            OPENAI_EMBEDDINGS_URL,
+            headers=_headers(api_key),
+            json={'model': self.model, 'input': list(texts)},
+            timeout=settings.LLM_TIMEOUT_S,
+        )
+        if limiter is not None:
+            limiter.on_response(r.status_code, r.headers)
+        r.raise_for_status()
+        rows = sorted(r.json()['data'], key=lambda d: d['index'])
+        m = np.asarray([d['embedding'] for d in rows], dtype=np.float32)
+        m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+        self.dim = m.shape[1]
+        return m
+
+
+_EMBEDDERS: Dict[str, Callable[[], Any]] = {
+    'local': lambda: HashingEmbedder(settings.RAG_EMBED_DIM),
+    'openai': lambda: OpenAIEmbedder(settings.RAG_EMBED_MODEL),
+}
+
+
+def register_embedder(name: str, factory: Callable[[], Any]) -> None:
+    """Plug in another embedding function (object with .name and async .embed(texts) -> ndarray)."""
+    _EMBEDDERS[name] = factory
+
+
+def get_embedder():
+    factory = _EMBEDDERS.get((settings.RAG_EMBEDDER or 'local').lower())
+    if factory is None:
+        logging.warning("Unknown RAG_EMBEDDER %r, using local", settings.RAG_EMBEDDER)
+        factory = _EMBEDDERS['local']
+    return factory()
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        for c in range(k):
+            members = x[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class VectorIndex:
+    def __init__(self, embedder_name: str) -> None:
+        self.embedder_name = embedder_name
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.meta: Dict[str, Dict[str, Any]] = {}
+        self.matrix: Optional[np.ndarray] = None  # capacity-doubling buffer; first len(keys) rows valid
+        # IVF state (only when above the brute-force threshold)
+        self.centroids: Optional[np.ndarray] = None
+        self.assign: Optional[np.ndarray] = None
+        self.trained_at = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _vectors(self) -> np.ndarray:
+        return self.matrix[:len(self.keys)]
+
+    def upsert(self, key: str, vec: np.ndarray, meta: Optional[Dict[str, Any]] = None) -> None:
+        vec = np.asarray(vec, dtype=np.float32)
+        if self.matrix is None:
+            self.matrix = np.zeros((64, vec.shape[0]), dtype=np.float32)
+        if key in self.rows:
+            i = self.rows[key]
+        else:
+            i = len(self.keys)
+            if i >= self.matrix.shape[0]:
+                grown = np.zeros((self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=np.float32)
+                grown[:i] = self.matrix[:i]
+                self.matrix = grown
+            self.keys.append(key)
+            self.rows[key] = i
+        self.matrix[i] = vec
+        self.meta[key] = meta or {}
+        if self.centroids is not None:
+            if len(self.assign) <= i:
+                self.assign = np.concatenate([self.assign, np.zeros(i + 1 - len(self.assign), dtype=np.int32)])
+            self.assign[i] = int(np.argmax(self.centroids @ vec))
+        self._maybe_train()
+
+    def remove(self, key: str) -> bool:
+        i = self.rows.pop(key, None)
+        if i is None:
+            return False
+        self.meta.pop(key, None)
+        last = len(self.keys) - 1
+        # Swap-remove keeps rows contiguous
+        if i != last:
+            moved = self.keys[last]
+            self.keys[i] = moved
+            self.rows[moved] = i
+            self.matrix[i] = self.matrix[last]
+            if self.assign is not None:
+                self.assign[i] = self.assign[last]
+        self.keys.pop()
+        if self.assign is not None:
+            self.assign = self.assign[:len(self.keys)]
+        return True
+
+    def _maybe_train(self) -> None:
+        n = len(self.keys)
+        if n < settings.RAG_ANN_THRESHOLD:
+            self.centroids = self.assign = None
+            self.trained_at = 0
+            return
+        if self.centroids is not None and n < 2 * self.trained_at:
+            return
+        x = self._vectors()
+        nlist = max(8, int(np.sqrt(n)))
+        sample = x if n <= 50 * nlist else x[np.random.default_rng(0).choice(n, size=50 * nlist, replace=False)]
+        self.centroids = _kmeans(sample, nlist)
+        self.assign = np.argmax(x @ self.centroids.T, axis=1).astype(np.int32)
+        self.trained_at = n
+
+    def search(self, qvec: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        n = len(self.keys)
+        if n == 0:
+            return []
+        x = self._vectors()
+        if self.centroids is None:
+            candidates = np.arange(n)
+        else:
+            nprobe = min(len(self.centroids), max(1, settings.RAG_ANN_NPROBE))
+            lists = np.argpartition(-(self.centroids @ qvec), nprobe - 1)[:nprobe]
+            candidates = np.nonzero(np.isin(self.assign, lists))[0]
+            if len(candidates) == 0:
+                return []
+        sims = x[candidates] @ qvec
+        k = min(max(1, int(k)), len(candidates))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        out = []
+        for j in top:
+            key = self.keys[int(candidates[j])]
+            out.append({'key': key, 'score': round(float(sims[j]), 4), **self.meta.get(key, {})})
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'embedder': self.embedder_name,
+            'vectors': len(self.keys),
+            'mode': 'ivf' if self.centroids is not None else 'brute-force',
+            'ivf_lists': int(len(self.centroids)) if self.centroids is not None else 0,
+        }
@@ -0,0 +1,195 @@
+"""
+Shared admission control for calls to the OpenAI API.
+
+Every request-path LLM call acquires from two token buckets (requests/min and estimated
+tokens/min) before going upstream. Rate-limit response headers and Retry-After pause the
+buckets; 429s halve the admitted rate (AIMD) and successes recover it additively. Waiters
+queue FIFO up to LLM_ADMISSION_QUEUE; beyond that, or past LLM_ADMISSION_MAX_WAIT_S,
+callers are rejected immediately with UpstreamBusy instead of piling up retries.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from ..config import settings
+
+
+class UpstreamBusy(Exception):
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = max(0.0, float(retry_after))
+
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations ('20ms', '1.5s', '6m0s') or plain seconds into seconds."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for num, unit in _DURATION_RE.findall(value):
+        matched = True
+        n = float(num)
+        total += n / 1000.0 if unit == 'ms' else n * {'s': 1, 'm': 60, 'h': 3600}[unit]
+    return total if matched else None
+
+
+def estimate_tokens(body: Dict[str, Any]) -> int:
+    """Rough prompt+completion token estimate (~4 chars per token) used for the TPM bucket."""
+    chars = sum(len(str((m or {}).get('content') or '')) for m in body.get('messages') or [])
+    return chars // 4 + int(body.get('max_tokens') or 256)
+
+
+def per_minute_limit(limit: Optional[str], reset: Optional[str]) -> Optional[float]:
+    """An x-ratelimit-limit-* value in the buckets' per-minute units, or None.
+
+    OpenAI's request/token limits are per minute. A limit whose reset is further out than
+    a minute (e.g. a daily request cap) is spread over that window instead.
+    """
+    try:
+        value = float(limit) if limit is not None else None
+    except ValueError:
+        return None
+    if not value or value <= 0:
+        return None
+    window = max(60.0, parse_duration(reset) or 60.0)
+    return value * 60.0 / window
+
+
+class _Bucket:
+    def __init__(self, per_minute: float) -> None:
+        self.base = max(1.0, float(per_minute))  # configured rate; server limits only cap it
+        self.capacity = self.base
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def set_ceiling(self, per_minute: float) -> None:
+        # Recomputed from every response that advertises a limit, so it also rises again
+        self.capacity = max(1.0, min(self.base, float(per_minute)))
+        self.level = min(self.level, self.capacity)
+
+    def refill(self, now: float, scale: float) -> None:
+        rate = self.capacity * scale / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, scale: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        rate = self.capacity * scale / 60.0
+        return (amount - self.level) / rate if rate > 0 else 1.0
+
+
+class UpstreamLimiter:
+    def __init__(self, rpm: int, tpm: int, max_waiters: int, max_wait_s: float) -> None:
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.max_waiters = max(1, int(max_waiters))
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self.scale = 1.0  # AIMD multiplier on the configured rates
+        self.min_scale = 0.05
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._waiters = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    async def acquire(self, est_tokens: int) -> None:
+        if self._waiters >= self.max_waiters:
+            self.rejected += 1
+            raise UpstreamBusy('LLM upstream queue full', retry_after=self._eta())
+        deadline = time.monotonic() + self.max_wait_s
+        self._waiters += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now, self.scale)
+                    self.tokens.refill(now, self.scale)
+                    wait = max(
+                        self.blocked_until - now,
+                        self.requests.wait_for(1, self.scale),
+                        self.tokens.wait_for(est_tokens, self.scale),
+                    )
+                    if wait <= 0:
+                        self.requests.level -= 1
+                        self.tokens.level -= min(est_tokens, self.tokens.capacity)
+                        self.admitted += 1
+                        return
+                    if now + wait > deadline:
+                        self.rejected += 1
+                        raise UpstreamBusy('LLM upstream rate limit: wait too long', retry_after=wait)
+                    await asyncio.sleep(wait)
+        finally:
+            self._waiters -= 1
+
+    def _eta(self) -> float:
+        return max(1.0, self.blocked_until - time.monotonic(), self._waiters * 60.0 / max(1.0, self.requests.capacity * self.scale))
+
+    def on_response(self, status_code: int, headers: Mapping[str, str] | None = None) -> None:
+        """Feed an upstream response back: honour rate-limit headers and adjust the AIMD scale."""
+        headers = headers or {}
+        now = time.monotonic()
+        if status_code == 429:
+            self.throttled += 1
+            self.scale = max(self.min_scale, self.scale * 0.5)
+            pause = parse_duration(headers.get('retry-after')) or parse_duration(headers.get('x-ratelimit-reset-requests')) or 1.0
+            self.blocked_until = max(self.blocked_until, now + pause)
+        elif status_code < 400:
+            self.scale = min(1.0, self.scale + 0.05)
+        # Server-advertised limits cap our configured rates; remaining=0 pauses until reset
+        for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            ceiling = per_minute_limit(headers.get(f'x-ratelimit-limit-{kind}'), headers.get(f'x-ratelimit-reset-{kind}'))
+            if ceiling is not None:
+                bucket.set_ceiling(ceiling)
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            try:
+                if remaining is not None:
+                    bucket.level = min(bucket.level, float(remaining))
+                    if float(remaining) <= 0:
+                        reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                        if reset:
+                            self.blocked_until = max(self.blocked_until, now + reset)
+            except ValueError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'scale': round(self.scale, 3),
+            'rpm_capacity': self.requests.capacity,
+            'tpm_capacity': self.tokens.capacity,
+            'waiting': self._waiters,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'throttled_429': self.throttled,
+            'paused_for_s': round(max(0.0, self.blocked_until - time.monotonic()), 2),
+        }
+
+
+_limiter: UpstreamLimiter | None = None
+
+
+def get_upstream_limiter() -> UpstreamLimiter | None:
+    global _limiter
+    if not settings.LLM_ADMISSION_ENABLED:
+        return None
+    if _limiter is None:
+        _limiter = UpstreamLimiter(
+            settings.LLM_RPM_LIMIT,
+            settings.LLM_TPM_LIMIT,
+            settings.LLM_ADMISSION_QUEUE,
+            settings.LLM_ADMISSION_MAX_WAIT_S,
+        )
+    return _limiter
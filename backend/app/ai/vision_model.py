@@ -1,80 +1,76 @@
 # Simple OpenCV-based segmentation placeholder that returns a few polygons as GeoJSON features.
 # Replace with real UNet/SAM inference and polygonization for production.
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 import numpy as np
 import rasterio
-from skimage import measure
+from rasterio.features import shapes
+from rasterio.windows import Window, transform as window_transform
 try:
-    from shapely.geometry import Polygon, mapping
+    from shapely.geometry import mapping, shape
+    from shapely.ops import unary_union
     _HAS_SHAPELY = True
 except Exception:
     _HAS_SHAPELY = False
 
+# Longest side of the decimated read used to estimate the band-1 fallback threshold
+_SAMPLE_SIZE = 1024
+
 def _demo_polygons() -> List[Dict[str, Any]]:
     # Demo fallback removed: return empty list so production uses real detections only.
     return []
 
 
-def _ndvi_from_raster(path: str) -> np.ndarray | None:
-    try:
-        with rasterio.open(path) as ds:
-            if ds.count >= 4:
-                # Sentinel-2 style: B8 (nir) often band 8; B4 (red) band 4 (this is heuristic)
-                red = ds.read(4).astype('float32')
-                nir = ds.read(8).astype('float32') if ds.count >= 8 else ds.read(ds.count).astype('float32')
-                denom = (nir + red)
-                denom[denom == 0] = 1e-6
-                ndvi = (nir - red) / denom
-                return ndvi
-    except Exception:
-        return None
-    return None
+def _block_masks(ds) -> Iterator[Tuple[Window, np.ndarray]]:
+    """(window, bare-ground mask) per block from the spectral engine.
+
+    Low NDVI (< 0.2); where SWIR is available also require BSI > 0 (exposed soil), which
+    drops water and shadow that are also low-NDVI. Without NIR/red, band 1 above its 75th
+    percentile (estimated from a decimated read) is used as a placeholder.
+    """
+    from ..spatial.spectral import available_indices, block_windows, default_band_map, iter_index_blocks
+    band_map = default_band_map(ds.count)
+    avail = available_indices(band_map)
+    if 'ndvi' in avail:
+        names = ['ndvi'] + (['bsi'] if 'bsi' in avail else [])
+        for w, idx in iter_index_blocks(ds, names, band_map):
+            m = idx['ndvi'].filled(np.inf) < 0.2
+            if 'bsi' in idx:
+                m &= idx['bsi'].filled(-np.inf) > 0.0
+            yield w, m
+        return
+    step = max(1, -(-max(ds.height, ds.width) // _SAMPLE_SIZE))
+    sample = ds.read(1, out_shape=(max(1, ds.height // step), max(1, ds.width // step))).astype('float32')
+    thr = float(np.percentile(sample, 75))
+    for w in block_windows(ds):
+        yield w, ds.read(1, window=w).astype('float32') > thr
+
 
+def _bare_ground_geoms(ds) -> List[Dict[str, Any]]:
+    """Bare-ground polygons in the dataset CRS, polygonized block by block.
 
-def _polygonize_mask(mask: np.ndarray, transform) -> List[Dict[str, Any]]:
-    feats: List[Dict[str, Any]] = []
-    # find contours at 0.5
-    contours = measure.find_contours(mask.astype('uint8'), 0.5)
-    for cnt in contours:
-        # cnt is array of (row, col)
-        # map to coordinates using affine transform
-        coords = []
-        for r, c in cnt:
-            x, y = rasterio.transform.xy(transform, r, c)
-            coords.append((x, y))
-        if _HAS_SHAPELY and len(coords) >= 3:
-            try:
-                poly = Polygon(coords)
-                if poly.area <= 0:
-                    continue
-                gj = mapping(poly)
-                feats.append({ 'type': 'Feature', 'geometry': gj, 'properties': { 'model': 'ndvi-thresh', 'confidence': 0.5 } })
-                continue
-            except Exception:
-                pass
-        # Fallback: output raw ring
-        if len(coords) >= 3:
-            ring = [[x, y] for x, y in coords]
-            if ring[0] != ring[-1]:
-                ring.append(ring[0])
-            feats.append({ 'type': 'Feature', 'geometry': { 'type': 'Polygon', 'coordinates': [ring] }, 'properties': { 'model': 'ndvi-thresh', 'confidence': 0.3 } })
-    return feats
+    Only one block's mask is in memory at a time (SPECTRAL_BLOCK_SIZE); regions cut at
+    block edges are merged back with shapely when it is installed, as in spatial/change.py.
+    """
+    geoms: List[Dict[str, Any]] = []
+    for w, m in _block_masks(ds):
+        if m.any():
+            transform = window_transform(w, ds.transform)
+            geoms.extend(g for g, _ in shapes(m.astype('uint8'), mask=m, transform=transform))
+    if _HAS_SHAPELY and geoms:
+        merged = unary_union([shape(g) for g in geoms])
+        geoms = [mapping(p) for p in getattr(merged, 'geoms', [merged]) if not p.is_empty and p.area > 0]
+    return geoms
 
 
 def detect_mining(image_path: str) -> List[Dict[str, Any]]:
-    """Return detection polygons: try NDVI threshold polygonization; fallback to demo polygons."""
+    """Return detection polygons: polygonize the spectral bare-ground mask (band-1 threshold without NIR)."""
+    from ..storage.artifacts import touch_artifact
+    touch_artifact(image_path)
     try:
         with rasterio.open(image_path) as ds:
-            arr1 = ds.read(1).astype('float32')
-            ndvi = _ndvi_from_raster(image_path)
-            if ndvi is None:
-                # Simple intensity threshold on band 1 as a placeholder
-                thr = float(np.percentile(arr1, 75))
-                mask = arr1 > thr
-            else:
-                # Bare soil / non-veg proxy: low NDVI
-                mask = ndvi < 0.2
-            feats = _polygonize_mask(mask, ds.transform)
+            confidence = 0.5 if _HAS_SHAPELY else 0.3
+            feats = [{ 'type': 'Feature', 'geometry': g, 'properties': { 'model': 'ndvi-thresh', 'confidence': confidence } }
+                     for g in _bare_ground_geoms(ds)]
             # If nothing found, return detected features (may be empty). No demo fallbacks.
             return feats
     except Exception:
@@ -5,6 +5,7 @@ from typing import List, Dict, Any
 from .ws_manager import manager
 from jose import jwt, JWTError
 from ..config import settings
+from ..ai.rag import mark_changed
 
 router = APIRouter()
 
@@ -60,6 +61,7 @@ async def geofence_check(payload: Dict[str, Any], db = Depends(get_db)):
             'acknowledged': False,
         }
         r = await db.get_collection('alerts').insert_one(alert_doc)
+        await mark_changed(db, 'alert', r.inserted_id)
         alert = { 'id': str(r.inserted_id), **{k: v for k,v in alert_doc.items() if k != '_id'} }
         try:
             await manager.broadcast_json({ 'type': 'alert.created', 'payload': alert })
@@ -86,6 +88,7 @@ async def create_alert(payload: Dict[str, Any], db = Depends(get_db)):
         'acknowledged': False,
     }
     r = await col.insert_one(doc)
+    await mark_changed(db, 'alert', r.inserted_id)
     out = { 'id': str(r.inserted_id), **{k: v for k, v in doc.items() if k != '_id'} }
     # Broadcast to WS listeners
     try:
@@ -98,17 +101,19 @@ async def create_alert(payload: Dict[str, Any], db = Depends(get_db)):
 @router.post('/{alert_id}/ack')
 async def acknowledge_alert(alert_id: str, db = Depends(get_db)):
     col = db.get_collection('alerts')
+    ref = alert_id
     res = await col.update_one({ '_id': alert_id }, { '$set': { 'acknowledged': True } })
     if res.matched_count == 0:
         # try ObjectId fallback if ObjectId used by mongo
         from bson import ObjectId
         try:
-            oid = ObjectId(alert_id)
+            ref = oid = ObjectId(alert_id)
             res = await col.update_one({ '_id': oid }, { '$set': { 'acknowledged': True } })
             if res.matched_count == 0:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Alert not found')
         except Exception:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Alert not found')
+    await mark_changed(db, 'alert', ref)
     return { 'status': 'ok' }
 
 
@@ -2,8 +2,9 @@ from __future__ import annotations
 import math
 from io import BytesIO
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Iterable, Optional, Set, Tuple
 
+import anyio
 import httpx
 import numpy as np
 from PIL import Image
@@ -48,12 +49,34 @@ def _bbox_to_tile_range(bbox: Tuple[float, float, float, float], z: int) -> Tupl
     return x_min, y_min, x_max, y_max
 
 
-async def _fetch_terrarium_tile(z: int, x: int, y: int) -> np.ndarray:
+def plan_tiles(bboxes: Iterable[Tuple[float, float, float, float]], z: int) -> Set[Tuple[int, int]]:
+    """Return the union of (x, y) tiles at zoom z needed to cover all bboxes."""
+    tiles: Set[Tuple[int, int]] = set()
+    for bbox in bboxes:
+        x_min, y_min, x_max, y_max = _bbox_to_tile_range(tuple(bbox), z)
+        for ty in range(y_min, y_max + 1):
+            for tx in range(x_min, x_max + 1):
+                tiles.add((tx, ty))
+    return tiles
+
+
+async def _fetch_terrarium_png(z: int, x: int, y: int, client: Optional[httpx.AsyncClient] = None) -> bytes:
     url = f"https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{z}/{x}/{y}.png"
-    async with httpx.AsyncClient(timeout=30) as client:
+    if client is None:
+        async with httpx.AsyncClient(timeout=30) as own_client:
+            r = await own_client.get(url)
+    else:
         r = await client.get(url)
-        r.raise_for_status()
-        img = Image.open(BytesIO(r.content)).convert('RGB')
+    r.raise_for_status()
+    return r.content
+
+
+async def _fetch_terrarium_tile(z: int, x: int, y: int, client: Optional[httpx.AsyncClient] = None) -> np.ndarray:
+    return _decode_terrarium(await _fetch_terrarium_png(z, x, y, client=client))
+
+
+def _decode_terrarium(png: bytes) -> np.ndarray:
+    img = Image.open(BytesIO(png)).convert('RGB')
     arr = np.asarray(img, dtype=np.float32)
     rch = arr[..., 0]
     gch = arr[..., 1]
@@ -62,7 +85,42 @@ async def _fetch_terrarium_tile(z: int, x: int, y: int) -> np.ndarray:
     return elev
 
 
-async def build_mosaic_geotiff(bbox: Tuple[float, float, float, float], z: int, out_path: Path, target_crs: str = 'EPSG:3857') -> Path:
+async def fetch_tiles(tiles: Iterable[Tuple[int, int]], z: int, cache_dir: Path, concurrency: int = 8) -> Dict[Tuple[int, int], Path]:
+    """Fetch a planned tile set once over a shared client, `concurrency` requests at a time.
+
+    Tiles are written to cache_dir as the upstream PNGs and returned as (x, y) -> path,
+    so a large plan costs disk rather than worker memory; the caller removes cache_dir.
+    Tiles that fail to download are left out of the result; build_mosaic_geotiff
+    fetches any missing tile on demand.
+    """
+    out: Dict[Tuple[int, int], Path] = {}
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    limiter = anyio.CapacityLimiter(max(1, int(concurrency)))
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def _one(tx: int, ty: int):
+            async with limiter:
+                try:
+                    png = await _fetch_terrarium_png(z, tx, ty, client=client)
+                    path = cache_dir / f'{z}_{tx}_{ty}.png'
+                    await anyio.Path(path).write_bytes(png)
+                    out[(tx, ty)] = path
+                except Exception:
+                    pass
+        async with anyio.create_task_group() as tg:
+            for tx, ty in tiles:
+                tg.start_soon(_one, tx, ty)
+    return out
+
+
+async def build_mosaic_geotiff(
+    bbox: Tuple[float, float, float, float],
+    z: int,
+    out_path: Path,
+    target_crs: str = 'EPSG:3857',
+    tiles: Optional[Dict[Tuple[int, int], Path]] = None,
+) -> Path:
+    """Build a Terrarium DEM mosaic for bbox. `tiles` is an optional prefetched (x, y) -> tile PNG path cache (see fetch_tiles)."""
     x_min, y_min, x_max, y_max = _bbox_to_tile_range(bbox, z)
     tiles_x = x_max - x_min + 1
     tiles_y = y_max - y_min + 1
@@ -78,7 +136,13 @@ async def build_mosaic_geotiff(bbox: Tuple[float, float, float, float], z: int,
     # Fetch tiles and paste
     for ty in range(y_min, y_max + 1):
         for tx in range(x_min, x_max + 1):
-            elev = await _fetch_terrarium_tile(z, tx, ty)
+            cached = tiles.get((tx, ty)) if tiles else None
+            try:
+                elev = _decode_terrarium(Path(cached).read_bytes()) if cached else None
+            except OSError:
+                elev = None
+            if elev is None:
+                elev = await _fetch_terrarium_tile(z, tx, ty)
             off_x = (tx - x_min) * TILE_SIZE
             off_y = (ty - y_min) * TILE_SIZE
             mosaic[off_y:off_y + TILE_SIZE, off_x:off_x + TILE_SIZE] = elev
@@ -1,6 +1,6 @@
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
 from typing import Any, Dict
-from ..utils.file_storage import save_upload_file
+from ..utils.file_storage import stream_upload
 from ..mongo import get_db
 from uuid import uuid4
 
@@ -9,7 +9,19 @@ router = APIRouter()
 
 @router.post('/upload')
 async def drone_upload(image: UploadFile = File(...), meta: str | None = None, db = Depends(get_db)):
-    path = await save_upload_file(image, 'drone')
-    doc: Dict[str, Any] = { '_id': str(uuid4()), 'path': path, 'meta': meta }
+    upload_id = str(uuid4())
+    stored = await stream_upload(image, 'drone', ref=f'drone:{upload_id}')
+    doc: Dict[str, Any] = { '_id': upload_id, 'path': stored['path'], 'size': stored['size'], 'sha256': stored['sha256'], 'meta': meta }
     await db.get_collection('drone_uploads').insert_one(doc)
-    return { 'id': doc['_id'], 'path': path }
+    return { 'id': doc['_id'], 'path': stored['path'], 'sha256': stored['sha256'] }
+
+
+@router.delete('/{upload_id}')
+async def drone_delete(upload_id: str, db = Depends(get_db)):
+    res = await db.get_collection('drone_uploads').delete_one({'_id': upload_id})
+    if res.deleted_count == 0:
+        raise HTTPException(status_code=404, detail='Upload not found')
+    import anyio
+    from ..storage.artifacts import release_artifacts
+    await anyio.to_thread.run_sync(release_artifacts, f'drone:{upload_id}')
+    return {'id': upload_id, 'deleted': True}
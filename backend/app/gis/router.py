@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from pydantic import BaseModel
 from typing import Any, Dict, List
 from ..mongo import get_db
+from ..ai.rag import mark_changed
 from uuid import uuid4
 from ..utils.file_storage import save_upload_file, STORAGE_ROOT
 from pathlib import Path
@@ -22,6 +23,7 @@ class ShapefileIn(BaseModel):
 async def create_shapefile(data: ShapefileIn, db=Depends(get_db)):
     sf = {"_id": str(uuid4()), "name": data.name, "geojson": data.geojson, "metadata": data.metadata or {}}
     await db.get_collection("shapefiles").insert_one(sf)
+    await mark_changed(db, 'shapefile', sf["_id"])
     return {"id": sf["_id"]}
 
 
@@ -38,6 +40,7 @@ async def delete_shapefile(sf_id: str, db=Depends(get_db)):
     r = await db.get_collection("shapefiles").delete_one({"_id": sf_id})
     if r.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Not found")
+    await mark_changed(db, 'shapefile', sf_id)
     return {"status": "deleted"}
 
 
@@ -121,6 +124,7 @@ async def upload_convert_geojson(file: UploadFile = File(...), db=Depends(get_db
         raise HTTPException(status_code=400, detail='Unsupported file type. Provide .zip (shapefile) or .kml')
     sf = { '_id': str(uuid4()), 'name': name, 'geojson': gj, 'metadata': { 'source': 'upload' } }
     await db.get_collection('shapefiles').insert_one(sf)
+    await mark_changed(db, 'shapefile', sf['_id'])
     return { 'id': sf['_id'], 'geojson': gj }
 
 # --- AOIs (Areas of Interest) ---
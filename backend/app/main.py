@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 import logging
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from .config import settings
 from fastapi import Request
@@ -174,20 +175,108 @@ async def ensure_dev_admin():
 
 @app.on_event("startup")
 async def ensure_indexes():
-    # Ensure 2dsphere index for detections geometry exists
+    # Ensure detection indexes (2dsphere on geometry, report_id) exist once per process
     try:
+        from .mining.detection_store import ensure_detection_indexes
         db = await get_db()
-        det = db.get_collection("detections")
-        try:
-            await det.create_index([("geometry", "2dsphere")])
-        except Exception:
-            # Non-fatal if index already exists
-            pass
+        await ensure_detection_indexes(db.get_collection("detections"))
     except Exception:
         # Non-fatal if Mongo is down at startup
         pass
 
 
+_rag_warmup = None
+
+
+@app.on_event("startup")
+async def warm_rag_index():
+    # Load the retrieval snapshot (or build it) in the background so the first /ai/chat/rag is fast
+    global _rag_warmup
+    try:
+        from .ai.rag import ensure_rag_indexes, get_rag_index
+        db = await get_db()
+        await ensure_rag_indexes(db)
+
+        async def _warm():
+            try:
+                idx = get_rag_index()
+                await idx.sync(db, force=True)
+                # Drain the embedding backlog of a fresh build without waiting for queries
+                while idx.pending_embeddings:
+                    before = idx.pending_embeddings
+                    await asyncio.sleep(settings.RAG_SYNC_INTERVAL_S)
+                    await idx.sync(db, force=True)
+                    if idx.pending_embeddings >= before:
+                        break  # embedder unavailable; searches retry later
+            except Exception as e:
+                logging.warning("RAG index warm-up skipped: %s", e)
+
+        _rag_warmup = asyncio.create_task(_warm())
+    except Exception as e:
+        logging.warning("RAG index warm-up skipped: %s", e)
+
+
+@app.on_event("startup")
+async def start_local_executor():
+    # Re-queue tasks persisted by a previous process when running without Redis
+    try:
+        from .tasks.local_executor import local_mode, get_local_executor
+        if local_mode():
+            import anyio
+            n = await anyio.to_thread.run_sync(get_local_executor().recover)
+            if n:
+                logging.info("Local executor re-queued %s pending task(s)", n)
+    except Exception as e:
+        logging.warning("Local executor recovery skipped: %s", e)
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    try:
+        from .ai.llm import aclose_client
+        await aclose_client()
+    except Exception:
+        pass
+
+
+@app.on_event("shutdown")
+async def close_nasa_client():
+    try:
+        from .providers.nasa import aclose_client
+        await aclose_client()
+    except Exception:
+        pass
+
+
+@app.on_event("shutdown")
+async def flush_audit_sink():
+    try:
+        import anyio
+        from .ai.audit_sink import close_audit_sink
+        await anyio.to_thread.run_sync(close_audit_sink)
+    except Exception:
+        pass
+
+
+@app.on_event("shutdown")
+async def save_rag_index():
+    try:
+        from .ai.rag import index as rag_index
+        if rag_index._index is not None:
+            await rag_index._index.save()
+    except Exception:
+        pass
+
+
+@app.on_event("shutdown")
+async def stop_local_executor():
+    try:
+        from .tasks.local_executor import shutdown_local_executor
+        shutdown_local_executor(wait=False)
+    except Exception:
+        pass
+
+
 @app.on_event("startup")
 async def start_mqtt():
     # Fire-and-forget MQTT worker if configured
@@ -0,0 +1,156 @@
+"""
+Validation and bulk persistence for the 'detections' collection.
+
+Geometries are checked and repaired before writing so MongoDB's 2dsphere index does not
+reject them, then written in chunked unordered inserts so one bad document never stops
+the rest. Indexes are created once at startup (see main.ensure_indexes), not per task.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+try:
+    from shapely.geometry import shape as shp_shape, mapping as shp_mapping
+    try:
+        from shapely.validation import make_valid as shp_make_valid
+    except Exception:  # shapely < 1.8
+        shp_make_valid = None
+    _HAS_SHAPELY = True
+except Exception:
+    _HAS_SHAPELY = False
+
+try:
+    from pymongo.errors import BulkWriteError
+except Exception:  # pragma: no cover - pymongo is a hard dependency of the worker
+    BulkWriteError = Exception  # type: ignore
+
+DETECTION_INDEXES: List[Tuple[list, dict]] = [
+    ([('geometry', '2dsphere')], {}),
+    ([('report_id', 1)], {}),
+]
+
+_GEOM_TYPES = ('Point', 'MultiPoint', 'LineString', 'MultiLineString', 'Polygon', 'MultiPolygon')
+
+
+def _coords_in_range(coords) -> bool:
+    if isinstance(coords, (list, tuple)) and len(coords) >= 2 and all(isinstance(v, (int, float)) for v in coords[:2]):
+        return -180.0 <= coords[0] <= 180.0 and -90.0 <= coords[1] <= 90.0
+    if isinstance(coords, (list, tuple)):
+        return all(_coords_in_range(c) for c in coords) and len(coords) > 0
+    return False
+
+
+def _close_rings(geom: Dict[str, Any]) -> Dict[str, Any]:
+    def _close(ring):
+        ring = [list(p) for p in ring]
+        if ring and ring[0] != ring[-1]:
+            ring.append(list(ring[0]))
+        return ring
+    t = geom.get('type')
+    if t == 'Polygon':
+        return {'type': t, 'coordinates': [_close(r) for r in geom.get('coordinates') or []]}
+    if t == 'MultiPolygon':
+        return {'type': t, 'coordinates': [[_close(r) for r in poly] for poly in geom.get('coordinates') or []]}
+    return geom
+
+
+def _listify(c):
+    if isinstance(c, (list, tuple)):
+        return [_listify(x) for x in c]
+    return c
+
+
+def normalize_geometry(geom: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Return (geometry, None) ready for a 2dsphere index, or (None, reason) if it cannot be repaired."""
+    if isinstance(geom, dict) and geom.get('type') == 'Feature':
+        geom = geom.get('geometry')
+    if not isinstance(geom, dict) or geom.get('type') not in _GEOM_TYPES:
+        return None, 'missing or unsupported geometry type'
+    if not _coords_in_range(geom.get('coordinates')):
+        return None, 'coordinates empty or outside lon/lat range (expected EPSG:4326)'
+    geom = _close_rings(geom)
+    if geom['type'] in ('Polygon', 'MultiPolygon'):
+        rings = geom['coordinates'] if geom['type'] == 'Polygon' else [r for p in geom['coordinates'] for r in p]
+        if any(len(r) < 4 for r in rings):
+            return None, 'polygon ring has fewer than 4 positions'
+        if _HAS_SHAPELY:
+            try:
+                s = shp_shape(geom)
+                if not s.is_valid:
+                    s = shp_make_valid(s) if shp_make_valid else s.buffer(0)
+                    # make_valid may yield a GeometryCollection; keep the polygonal part
+                    if s.geom_type == 'GeometryCollection':
+                        polys = [g for g in s.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
+                        if not polys:
+                            return None, 'geometry not repairable'
+                        from shapely.ops import unary_union
+                        s = unary_union(polys)
+                    if s.is_empty or s.geom_type not in ('Polygon', 'MultiPolygon'):
+                        return None, 'geometry not repairable'
+                    geom = shp_mapping(s)
+                    geom = {'type': geom['type'], 'coordinates': _listify(geom['coordinates'])}
+            except Exception as e:
+                return None, f'invalid geometry: {e}'
+    return geom, None
+
+
+def build_detection_docs(report_id: str, detections: Iterable[Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Turn raw detector output into detection documents. Returns (docs, rejected)."""
+    docs: List[Dict[str, Any]] = []
+    rejected: List[Dict[str, Any]] = []
+    for i, d in enumerate(detections or []):
+        if not isinstance(d, dict):
+            rejected.append({'index': i, 'error': 'detection is not an object'})
+            continue
+        geom, err = normalize_geometry(d.get('geometry') or d.get('geojson'))
+        if err:
+            rejected.append({'index': i, 'error': err})
+            continue
+        props = d.get('properties') if isinstance(d.get('properties'), dict) else {}
+        docs.append({
+            '_id': str(uuid4()),
+            'report_id': report_id,
+            'geometry': geom,
+            'properties': {
+                'area_sqm': d.get('area_sqm', props.get('area_sqm')),
+                'confidence': d.get('confidence', props.get('confidence')),
+                'model': d.get('model', props.get('model')),
+            },
+        })
+    return docs, rejected
+
+
+def write_detections(col, docs: List[Dict[str, Any]], chunk_size: int = 1000) -> Dict[str, Any]:
+    """Insert docs with unordered bulk writes in chunks (sync pymongo collection).
+
+    Returns {'inserted': n, 'failed': [{'_id', 'error'}]} so callers can record partial failures.
+    """
+    inserted = 0
+    failed: List[Dict[str, Any]] = []
+    size = max(1, int(chunk_size))
+    for start in range(0, len(docs), size):
+        chunk = docs[start:start + size]
+        try:
+            res = col.insert_many(chunk, ordered=False)
+            inserted += len(res.inserted_ids)
+        except BulkWriteError as e:
+            details = getattr(e, 'details', None) or {}
+            inserted += int(details.get('nInserted') or 0)
+            for we in details.get('writeErrors') or []:
+                idx = we.get('index')
+                doc_id = chunk[idx]['_id'] if isinstance(idx, int) and idx < len(chunk) else None
+                failed.append({'_id': doc_id, 'error': we.get('errmsg')})
+        except Exception as e:
+            failed.extend({'_id': d['_id'], 'error': str(e)} for d in chunk)
+    return {'inserted': inserted, 'failed': failed}
+
+
+async def ensure_detection_indexes(col) -> None:
+    """Create detection indexes once (async Motor collection); called at API startup."""
+    for keys, opts in DETECTION_INDEXES:
+        try:
+            await col.create_index(keys, **opts)
+        except Exception:
+            # Non-fatal if index already exists with different options
+            pass
@@ -5,8 +5,10 @@ from uuid import uuid4
 
 from ..mongo import get_db
 from ..dependencies import get_current_user
-from ..utils.file_storage import save_upload_file
+from ..utils.file_storage import stream_upload
 from ..tasks.celery_worker import process_mining_report_task
+from ..tasks.local_executor import enqueue, QueueFull
+from ..ai.rag import mark_changed
 from typing import Optional, List, Dict, Any, Iterable
 
 try:
@@ -23,9 +25,10 @@ router = APIRouter()
 @router.post('/upload')
 async def upload_file(file: UploadFile = File(...), db = Depends(get_db), user=Depends(get_current_user)):
     # Save file and create DB report
-    path = await save_upload_file(file, subpath='uploads')
-    col = db.get_collection('mining_reports')
     rid = str(uuid4())
+    stored = await stream_upload(file, subpath='uploads', ref=f'report:{rid}')
+    path = stored['path']
+    col = db.get_collection('mining_reports')
     doc = {
         '_id': rid,
         'user_email': (user or {}).get('sub', 'anonymous'),
@@ -34,11 +37,18 @@ async def upload_file(file: UploadFile = File(...), db = Depends(get_db), user=D
         'created_at': datetime.utcnow(),
         'result': None,
         'file_path': path,
+        'file_size': stored['size'],
+        'file_sha256': stored['sha256'],
     }
     await col.insert_one(doc)
-    # enqueue celery task
-    task = process_mining_report_task.delay(rid, path)
-    return JSONResponse({"report_id": rid, "task_id": task.id})
+    await mark_changed(db, 'report', rid)
+    # enqueue celery task (or the local executor when Redis is unavailable)
+    try:
+        task_id = enqueue(process_mining_report_task, rid, path)
+    except QueueFull:
+        await col.update_one({'_id': rid}, {'$set': {'status': 'failed', 'error': 'queue full'}})
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Job queue is full, retry shortly')
+    return JSONResponse({"report_id": rid, "task_id": task_id})
 
 
 ## NOTE: Keep dynamic '/{report_id}' at the end to avoid shadowing static routes like '/detections-recent'
@@ -236,6 +246,24 @@ async def get_illegal_by_boundary(
     return results
 
 
+@router.delete('/{report_id}')
+async def delete_report(report_id: str, db = Depends(get_db), user=Depends(get_current_user)):
+    col = db.get_collection('mining_reports')
+    report = await col.find_one({'_id': report_id}, projection={'user_email': 1})
+    if not report:
+        raise HTTPException(status_code=404, detail='Report not found')
+    if (user or {}).get('role') != 'authority' and report.get('user_email') != (user or {}).get('sub'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Forbidden')
+    await col.delete_one({'_id': report_id})
+    det = await db.get_collection('detections').delete_many({'report_id': report_id})
+    await mark_changed(db, 'report', report_id)
+    # The upload stays on disk until quota eviction; it is only unreferenced here
+    import anyio
+    from ..storage.artifacts import release_artifacts
+    await anyio.to_thread.run_sync(release_artifacts, f'report:{report_id}')
+    return {'id': report_id, 'deleted': True, 'detections_deleted': det.deleted_count}
+
+
 @router.get('/{report_id}')
 async def get_report(report_id: str, db = Depends(get_db)):
     col = db.get_collection('mining_reports')
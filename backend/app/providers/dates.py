@@ -0,0 +1,231 @@
+"""
+Cached acquisition-date discovery for the imagery time slider.
+
+Provider catalog queries (Sentinel Hub, GEE) are blocking network calls, so they run
+in worker threads and their results are cached per process, keyed by (provider,
+collection, AOI hash, cloud threshold, intersects). Each entry records the date range
+it covers:
+
+  - a request inside the covered range is answered from the cache;
+  - a request that extends the range only queries the missing days at either end;
+  - after DATES_CACHE_TTL_S an entry is stale: it is still served, and a background
+    refresh re-queries only the last DATES_REFRESH_DAYS of the covered range (older
+    acquisitions do not change); after a further DATES_CACHE_STALE_S the refresh
+    happens before answering;
+  - concurrent identical queries share one provider call, and a provider that just
+    failed is not asked again for DATES_CACHE_ERROR_TTL_S.
+
+When a provider is not configured or fails, callers get None and use the provider's
+synthetic cadence, as before.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anyio
+
+from ..ai.singleflight import SingleFlight
+from ..config import settings
+
+Fetch = Callable[[str, str], Optional[List[str]]]
+
+
+def _day(d: str, delta: int = 0) -> str:
+    return (datetime.fromisoformat(d[:10]) + timedelta(days=delta)).date().isoformat()
+
+
+def aoi_hash(aoi: Optional[Dict[str, Any]], bbox: Optional[List[float]], intersects: bool) -> str:
+    # Only the input the provider actually uses for the query is part of the key
+    payload = {
+        'aoi': aoi if (intersects or not bbox) else None,
+        'bbox': [round(float(v), 6) for v in bbox] if bbox else None,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def weekly_dates(start: str, end: str) -> List[str]:
+    """Weekly sampling for providers without a catalog."""
+    try:
+        d0 = datetime.fromisoformat(start[:10]); d1 = datetime.fromisoformat(end[:10])
+        if d1 < d0: d0, d1 = d1, d0
+        out: List[str] = []
+        cur = d0
+        while cur <= d1:
+            out.append(cur.date().isoformat())
+            cur += timedelta(days=7)
+        if out and out[-1] != d1.date().isoformat(): out.append(d1.date().isoformat())
+        return out
+    except Exception:
+        return [end[:10] or start[:10]]
+
+
+class DateDiscoveryCache:
+    def __init__(self, ttl_s: float, stale_s: float, refresh_days: int, max_entries: int = 512,
+                 error_ttl_s: float = 60.0) -> None:
+        self.ttl_s = float(ttl_s)
+        self.stale_s = float(stale_s)
+        self.refresh_days = max(0, int(refresh_days))
+        self.max_entries = max(1, int(max_entries))
+        self.error_ttl_s = float(error_ttl_s)
+        # key -> {'start', 'end', 'dates': set, 'fetched_at'}
+        self._entries: 'OrderedDict[Tuple, Dict[str, Any]]' = OrderedDict()
+        self._inflight = SingleFlight()
+        self._failed_at: Dict[Tuple, float] = {}
+        self._refreshing: set = set()
+        self._background: set = set()
+        self.counters = {'hit': 0, 'miss': 0, 'extended': 0, 'stale': 0, 'refreshed': 0, 'error': 0}
+
+    async def _fetch(self, key: Tuple, fetch: Fetch, start: str, end: str) -> Optional[List[str]]:
+        """Run fetch in a worker thread; identical concurrent calls share one run."""
+        return await self._inflight.do(repr((key, start, end)), lambda: anyio.to_thread.run_sync(fetch, start, end))
+
+    def _store(self, key: Tuple, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _revalidate(self, key: Tuple, fetch: Fetch) -> None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        tail_start = max(entry['start'], (date.today() - timedelta(days=self.refresh_days)).isoformat())
+        if tail_start <= entry['end']:
+            dates = await self._fetch(key, fetch, tail_start, entry['end'])
+            if dates is None:
+                return
+            entry['dates'] = {d for d in entry['dates'] if d < tail_start} | {d[:10] for d in dates}
+        entry['fetched_at'] = time.time()
+
+    async def _revalidate_quietly(self, key: Tuple, fetch: Fetch) -> None:
+        try:
+            await self._revalidate(key, fetch)
+        except Exception as e:
+            logging.warning('date discovery refresh failed for %s: %s', key[0], e)
+        finally:
+            self._refreshing.discard(key)
+
+    async def get(self, key: Tuple, fetch: Fetch, start: str, end: str) -> Tuple[Optional[List[str]], str]:
+        """(sorted dates in [start, end], cache state), or (None, state) when the provider
+        is unavailable or failed."""
+        start, end = sorted((start[:10], end[:10]))
+        now = time.time()
+        if now - self._failed_at.get(key, 0.0) < self.error_ttl_s:
+            return self._covered(key, start, end)
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                dates = await self._fetch(key, fetch, start, end)
+                if dates is None:
+                    return None, 'unavailable'
+                entry = {'start': start, 'end': end, 'dates': {d[:10] for d in dates}, 'fetched_at': now}
+                self._store(key, entry)
+                state = 'miss'
+            else:
+                self._entries.move_to_end(key)
+                age = now - entry['fetched_at']
+                state = 'hit'
+                if age > self.ttl_s + self.stale_s:
+                    await self._revalidate(key, fetch)
+                    state = 'refreshed'
+                elif age > self.ttl_s:
+                    state = 'stale'
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        task = asyncio.ensure_future(self._revalidate_quietly(key, fetch))
+                        self._background.add(task)
+                        task.add_done_callback(self._background.discard)
+                # Query only the days the cached range does not cover yet
+                segments = []
+                if start < entry['start']:
+                    segments.append((start, _day(entry['start'], -1)))
+                if end > entry['end']:
+                    segments.append((_day(entry['end'], 1), end))
+                for s, e in segments:
+                    dates = await self._fetch(key, fetch, s, e)
+                    if dates is None:
+                        return None, 'unavailable'
+                    entry['dates'] |= {d[:10] for d in dates}
+                    entry['start'] = min(entry['start'], s)
+                    entry['end'] = max(entry['end'], e)
+                if segments and state == 'hit':
+                    state = 'extended'
+        except Exception as e:
+            self._failed_at[key] = time.time()
+            self.counters['error'] += 1
+            logging.warning('date discovery failed for %s: %s', key[0], e)
+            return self._covered(key, start, end)
+        self._failed_at.pop(key, None)
+        self.counters[state] += 1
+        return sorted(d for d in entry['dates'] if start <= d <= end), state
+
+    def _covered(self, key: Tuple, start: str, end: str) -> Tuple[Optional[List[str]], str]:
+        # While the provider is failing, a cached entry that covers the request is still the best answer
+        entry = self._entries.get(key)
+        if entry is not None and entry['start'] <= start and end <= entry['end']:
+            return sorted(d for d in entry['dates'] if start <= d <= end), 'stale'
+        return None, 'error'
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), **self.counters}
+
+
+_cache: Optional[DateDiscoveryCache] = None
+
+
+def get_date_cache() -> DateDiscoveryCache:
+    global _cache
+    if _cache is None:
+        _cache = DateDiscoveryCache(
+            settings.DATES_CACHE_TTL_S, settings.DATES_CACHE_STALE_S, settings.DATES_REFRESH_DAYS,
+            settings.DATES_CACHE_MAX_ENTRIES, settings.DATES_CACHE_ERROR_TTL_S,
+        )
+    return _cache
+
+
+async def discover_dates(
+    provider: str,
+    aoi: Optional[Dict[str, Any]],
+    start: str,
+    end: str,
+    *,
+    collection: Optional[str] = None,
+    step_days: Optional[int] = None,
+    bbox: Optional[List[float]] = None,
+    max_cloud_percent: Optional[float] = None,
+    intersects: bool = False,
+) -> Dict[str, Any]:
+    """{'dates', 'cache', 'source'} for a provider; source is 'catalog' or 'synthetic'."""
+    provider = (provider or 'sentinelhub').lower()
+    if provider == 'gee':
+        from . import gee as mod
+        collection = collection or 'COPERNICUS/S2_SR'
+    elif provider == 'sentinelhub':
+        from . import sentinelhub as mod
+        collection = collection or 'S2L2A'
+    else:
+        # For earthdata or unknown, fallback to weekly sampling
+        return {'dates': weekly_dates(start, end), 'cache': 'bypass', 'source': 'synthetic'}
+
+    cloud = float(max_cloud_percent) if isinstance(max_cloud_percent, (int, float)) else None
+    key = (provider, collection.upper(), aoi_hash(aoi, bbox, intersects), cloud, bool(intersects))
+
+    def fetch(s: str, e: str) -> Optional[List[str]]:
+        return mod.catalog_dates(aoi, s, e, collection, bbox=bbox, max_cloud_percent=cloud, intersects=intersects)
+
+    dates, state = await get_date_cache().get(key, fetch, start, end)
+    # An empty Sentinel Hub answer falls back to the cadence too (previous behaviour); GEE's is returned as is
+    if dates or (dates is not None and provider == 'gee'):
+        return {'dates': dates, 'cache': state, 'source': 'catalog'}
+    if provider == 'sentinelhub':
+        dates = mod.fallback_dates(start, end, int(step_days or 5))
+    else:
+        dates = mod.fallback_dates(start, end)
+    return {'dates': dates, 'cache': state, 'source': 'synthetic'}
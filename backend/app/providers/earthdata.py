@@ -1,6 +1,8 @@
 from __future__ import annotations
+from pathlib import Path
 import httpx
 from ..config import settings
+from ..utils.remote_fetch import fetch_to_file
 
 
 class EarthdataAuthError(Exception):
@@ -15,14 +17,19 @@ def _auth_headers() -> dict:
     return {}
 
 
+def _basic_auth(headers: dict):
+    if not headers and (getattr(settings, 'EARTHDATA_USERNAME', None) and getattr(settings, 'EARTHDATA_PASSWORD', None)):
+        return (settings.__dict__['EARTHDATA_USERNAME'], settings.__dict__['EARTHDATA_PASSWORD'])
+    return None
+
+
 async def download(url: str, timeout: float = 120.0) -> bytes:
+    # Small files only (the whole body is returned); use download_to_file for granules.
     # Supports two auth modes:
     # - Bearer token via EARTHDATA_TOKEN
     # - Basic auth via EARTHDATA_USERNAME / EARTHDATA_PASSWORD
     headers = _auth_headers()
-    auth = None
-    if not headers and (getattr(settings, 'EARTHDATA_USERNAME', None) and getattr(settings, 'EARTHDATA_PASSWORD', None)):
-        auth = (settings.__dict__['EARTHDATA_USERNAME'], settings.__dict__['EARTHDATA_PASSWORD'])
+    auth = _basic_auth(headers)
     async with httpx.AsyncClient(timeout=timeout, follow_redirects=True, auth=auth) as client:
         r = await client.get(url, headers=headers)
         if r.status_code == 401:
@@ -31,6 +38,32 @@ async def download(url: str, timeout: float = 120.0) -> bytes:
         return r.content
 
 
+async def download_to_file(url: str, dest: Path | str, expected_sha256: str | None = None) -> dict:
+    """Stream a granule to dest (chunked, range-resumed, optionally parallel; see remote_fetch)."""
+    headers = _auth_headers()
+    try:
+        return await fetch_to_file(url, dest, headers=headers, auth=_basic_auth(headers), expected_sha256=expected_sha256)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401:
+            raise EarthdataAuthError('Unauthorized: check EARTHDATA_TOKEN or EARTHDATA_USERNAME/PASSWORD') from e
+        raise
+
+
+def gdal_auth_options() -> dict:
+    """GDAL config options carrying Earthdata credentials for /vsicurl/ (windowed COG reads)."""
+    headers = _auth_headers()
+    if headers:
+        return {'GDAL_HTTP_HEADERS': f"Authorization: {headers['Authorization']}"}
+    auth = _basic_auth(headers)
+    if auth:
+        # URS authenticates via redirect + cookie; keep the cookie for follow-up range requests
+        from ..utils.file_storage import STORAGE_ROOT
+        jar = str(STORAGE_ROOT / '.earthdata_cookies')
+        return {'GDAL_HTTP_USERPWD': f'{auth[0]}:{auth[1]}', 'GDAL_HTTP_AUTH': 'BASIC',
+                'GDAL_HTTP_COOKIEFILE': jar, 'GDAL_HTTP_COOKIEJAR': jar}
+    return {}
+
+
 def select_download_url(links: list[dict]) -> str | None:
     """Pick the best downloadable link from CMR links array.
     Preference: rel contains 'data#' or 'download', fallback to first http(s) href.
@@ -7,6 +7,7 @@ This stub exposes a minimal, no-network interface for development.
 """
 from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta
+import threading
 from ..config import settings
 
 
@@ -27,7 +28,24 @@ def compute_ndvi(aoi: Dict[str, Any]) -> Dict[str, Any]:
     return {"mean": 0.32, "min": 0.05, "max": 0.78}
 
 
-def available_dates(
+_ee_lock = threading.Lock()
+
+
+def _ee():
+    """The ee module, initialized once per process (not on every query)."""
+    import ee  # type: ignore
+    if not ee.data._initialized:  # type: ignore
+        with _ee_lock:
+            if not ee.data._initialized:  # type: ignore
+                if settings.GEE_SERVICE_ACCOUNT and settings.GEE_PRIVATE_KEY:
+                    credentials = ee.ServiceAccountCredentials(settings.GEE_SERVICE_ACCOUNT, key_data=settings.GEE_PRIVATE_KEY)
+                    ee.Initialize(credentials)
+                else:
+                    ee.Initialize()
+    return ee
+
+
+def catalog_dates(
     aoi: Dict[str, Any] | None,
     start: str,
     end: str,
@@ -35,49 +53,49 @@ def available_dates(
     bbox: Optional[List[float]] = None,
     max_cloud_percent: Optional[float] = None,
     intersects: bool = False,
-) -> List[str]:
-    """Return unique acquisition dates from GEE if enabled; else coarse monthly list.
+) -> Optional[List[str]]:
+    """Unique acquisition dates from GEE (blocking). None when GEE is disabled or not
+    installed; query/auth errors are raised.
 
     Uses ImageCollection.filterDate and filterBounds (geometry or bbox) and a cloud cover property filter when available.
     """
-    if settings.GEE_ENABLED:
-        try:
-            import ee  # type: ignore
-            if not ee.data._initialized:  # type: ignore
-                if settings.GEE_SERVICE_ACCOUNT and settings.GEE_PRIVATE_KEY:
-                    credentials = ee.ServiceAccountCredentials(settings.GEE_SERVICE_ACCOUNT, key_data=settings.GEE_PRIVATE_KEY)
-                    ee.Initialize(credentials)
-                else:
-                    ee.Initialize()
-            geom = None
-            if intersects and isinstance(aoi, dict):
-                geom = ee.Geometry(aoi)
-            elif bbox and len(bbox) == 4:
-                minx, miny, maxx, maxy = bbox
-                geom = ee.Geometry.Rectangle([minx, miny, maxx, maxy])
-            elif isinstance(aoi, dict):
-                geom = ee.Geometry(aoi).bounds()
-            coll = ee.ImageCollection(collection).filterDate(start[:10], end[:10])
-            if geom:
-                coll = coll.filterBounds(geom)
-            # Cloud cover property varies; try standard keys
-            if isinstance(max_cloud_percent, (int, float)):
-                for prop in ['CLOUD_COVER', 'CLOUDY_PIXEL_PERCENTAGE', 'cloudyPixelPercentage']:
-                    try:
-                        coll = coll.filter(ee.Filter.lt(prop, float(max_cloud_percent)))
-                        break
-                    except Exception:
-                        pass
-            # Map to dates
-            def _to_date(img):
-                return ee.Feature(None, {'date': ee.Date(img.get('system:time_start')).format('YYYY-MM-dd')})
-            dates_fc = ee.FeatureCollection(coll.map(_to_date))
-            dates = dates_fc.aggregate_array('date').getInfo()
-            if isinstance(dates, list):
-                return sorted(list(set([str(d)[:10] for d in dates])))
-        except Exception:
-            pass
-    # Fallback: coarse monthly list
+    if not settings.GEE_ENABLED:
+        return None
+    try:
+        ee = _ee()
+    except ImportError:
+        return None
+    geom = None
+    if intersects and isinstance(aoi, dict):
+        geom = ee.Geometry(aoi)
+    elif bbox and len(bbox) == 4:
+        minx, miny, maxx, maxy = bbox
+        geom = ee.Geometry.Rectangle([minx, miny, maxx, maxy])
+    elif isinstance(aoi, dict):
+        geom = ee.Geometry(aoi).bounds()
+    # filterDate's end is exclusive; callers pass inclusive ranges
+    end_excl = (datetime.fromisoformat(end[:10]) + timedelta(days=1)).date().isoformat()
+    coll = ee.ImageCollection(collection).filterDate(start[:10], end_excl)
+    if geom:
+        coll = coll.filterBounds(geom)
+    # Cloud cover property varies; try standard keys
+    if isinstance(max_cloud_percent, (int, float)):
+        for prop in ['CLOUD_COVER', 'CLOUDY_PIXEL_PERCENTAGE', 'cloudyPixelPercentage']:
+            try:
+                coll = coll.filter(ee.Filter.lt(prop, float(max_cloud_percent)))
+                break
+            except Exception:
+                pass
+    # Map to dates
+    def _to_date(img):
+        return ee.Feature(None, {'date': ee.Date(img.get('system:time_start')).format('YYYY-MM-dd')})
+    dates_fc = ee.FeatureCollection(coll.map(_to_date))
+    dates = dates_fc.aggregate_array('date').getInfo()
+    return sorted(list(set([str(d)[:10] for d in dates]))) if isinstance(dates, list) else []
+
+
+def fallback_dates(start: str, end: str, step_days: int | None = None) -> List[str]:
+    """Coarse monthly list for development."""
     try:
         d0 = datetime.fromisoformat(start[:10])
         d1 = datetime.fromisoformat(end[:10])
@@ -94,3 +112,25 @@ def available_dates(
         m = (cur.month % 12) + 1
         cur = datetime(y, m, 1)
     return out
+
+
+def available_dates(
+    aoi: Dict[str, Any] | None,
+    start: str,
+    end: str,
+    collection: str = "COPERNICUS/S2_SR",
+    bbox: Optional[List[float]] = None,
+    max_cloud_percent: Optional[float] = None,
+    intersects: bool = False,
+) -> List[str]:
+    """Return unique acquisition dates from GEE if enabled; else coarse monthly list.
+
+    Blocking and uncached; the API goes through providers/dates.py instead.
+    """
+    try:
+        dates = catalog_dates(aoi, start, end, collection, bbox=bbox, max_cloud_percent=max_cloud_percent, intersects=intersects)
+        if dates is not None:
+            return dates
+    except Exception:
+        pass
+    return fallback_dates(start, end)
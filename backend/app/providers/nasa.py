@@ -0,0 +1,226 @@
+"""
+Caching proxy for NASA CMR, EONET and GIBS.
+
+All requests go through one shared httpx.AsyncClient (pooled keep-alive connections
+instead of a TLS handshake per request). GET responses are kept in a per-process LRU
+bounded by NASA_CACHE_MAX_BYTES, each with the TTL its endpoint passes in (CMR
+searches and EONET events change within minutes, GIBS tiles of a past date never do).
+An expired entry is revalidated with If-None-Match / If-Modified-Since when the
+upstream sent an ETag or Last-Modified, so an unchanged answer costs a 304 and no
+body. If the upstream fails, an expired entry is served rather than an error.
+Identical concurrent requests share one upstream call.
+
+Large CMR searches are streamed page by page with CMR's search-after header (see
+iter_cmr_granules), so memory is bounded by one page instead of the whole result.
+project() trims JSON entries to the requested fields.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+from ..ai.singleflight import SingleFlight
+from ..config import settings
+
+CMR_GRANULES_URL = 'https://cmr.earthdata.nasa.gov/search/granules.json'
+EONET_EVENTS_URL = 'https://eonet.gsfc.nasa.gov/api/v3/events'
+GIBS_TILE_URL = 'https://gibs.earthdata.nasa.gov/wmts/epsg3857/best/{layer}/default/{time}/{tms}/{z}/{y}/{x}.{fmt}'
+
+# Upstream headers worth keeping with a cached body
+_KEEP_HEADERS = ('content-type', 'etag', 'last-modified', 'cmr-hits', 'cmr-search-after')
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.NASA_HTTP_TIMEOUT_S, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=30.0),
+            follow_redirects=True,
+            headers={'User-Agent': 'TrishulVision/1.0'},
+        )
+    return _client
+
+
+async def aclose_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class _Entry:
+    __slots__ = ('body', 'headers', 'fetched_at', '_json')
+
+    def __init__(self, body: bytes, headers: Dict[str, str]) -> None:
+        self.body = body
+        self.headers = headers
+        self.fetched_at = time.time()
+        self._json = None
+
+    def json(self) -> Any:
+        # Parsed once per cached body; callers must not mutate the result (see project())
+        if self._json is None:
+            self._json = json.loads(self.body)
+        return self._json
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self.bytes = 0
+        self.counters = {'hit': 0, 'miss': 0, 'revalidated': 0, 'stale': 0}
+
+    def get(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: _Entry) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old.body)
+        # A single body may use at most an eighth of the cache
+        if len(entry.body) > self.max_bytes // 8:
+            return
+        self._entries[key] = entry
+        self.bytes += len(entry.body)
+        while self.bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted.body)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'bytes': self.bytes, **self.counters}
+
+
+_cache: ResponseCache | None = None
+_inflight = SingleFlight()
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(settings.NASA_CACHE_MAX_BYTES)
+    return _cache
+
+
+def _cache_key(url: str, params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]]) -> str:
+    items = sorted((k, str(v)) for k, v in (params or {}).items() if v is not None)
+    extra = sorted((headers or {}).items())
+    return f'{url}?{urlencode(items)}#{urlencode(extra)}'
+
+
+async def cached_get(url: str, params: Optional[Dict[str, Any]] = None, *, ttl: float,
+                     headers: Optional[Dict[str, str]] = None) -> Tuple[_Entry, str]:
+    """(entry, cache state) for a GET; state is hit | miss | revalidated | stale.
+
+    Raises httpx.HTTPStatusError for upstream error statuses and httpx.HTTPError for
+    transport failures, unless an expired entry can be served instead.
+    """
+    cache = get_cache()
+    key = _cache_key(url, params, headers)
+    entry = cache.get(key)
+    if entry is not None and time.time() - entry.fetched_at < ttl:
+        cache.counters['hit'] += 1
+        return entry, 'hit'
+
+    async def fetch() -> Tuple[_Entry, str]:
+        req_headers = dict(headers or {})
+        if entry is not None:
+            if entry.headers.get('etag'):
+                req_headers['If-None-Match'] = entry.headers['etag']
+            if entry.headers.get('last-modified'):
+                req_headers['If-Modified-Since'] = entry.headers['last-modified']
+        r = await get_client().get(url, params={k: v for k, v in (params or {}).items() if v is not None}, headers=req_headers)
+        if r.status_code == 304 and entry is not None:
+            entry.fetched_at = time.time()
+            return entry, 'revalidated'
+        r.raise_for_status()
+        fresh = _Entry(r.content, {h: r.headers[h] for h in _KEEP_HEADERS if h in r.headers})
+        cache.put(key, fresh)
+        return fresh, 'miss'
+
+    try:
+        result, state = await _inflight.do(key, fetch)
+    except httpx.HTTPError as e:
+        if entry is None:
+            raise
+        logging.warning('NASA upstream failed, serving cached response for %s: %s', url, e)
+        result, state = entry, 'stale'
+    cache.counters[state] += 1
+    return result, state
+
+
+def _field_tree(fields: Iterable[str]) -> Dict[str, Dict]:
+    tree: Dict[str, Dict] = {}
+    for f in fields:
+        node = tree
+        for part in f.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _project(obj: Any, tree: Dict[str, Dict]) -> Any:
+    if not tree:
+        return obj
+    if isinstance(obj, list):
+        return [_project(o, tree) for o in obj]
+    if isinstance(obj, dict):
+        return {k: _project(obj[k], sub) for k, sub in tree.items() if k in obj}
+    return obj
+
+
+def project(items: List[Any], fields: Optional[Iterable[str]]) -> List[Any]:
+    """Keep only the dotted field paths of each item ('links.href' keeps href in every
+    link); returns new objects, so cached bodies are never modified."""
+    tree = _field_tree(fields or [])
+    return [_project(it, tree) for it in items] if tree else list(items)
+
+
+def split_fields(fields: Optional[str | List[str]]) -> List[str]:
+    if not fields:
+        return []
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return [f.strip() for f in fields if f and f.strip()]
+
+
+def cmr_params(short_name: str, bbox: Optional[str], temporal: Optional[str], page_size: int) -> Dict[str, Any]:
+    params: Dict[str, Any] = {'short_name': short_name, 'page_size': page_size}
+    if bbox: params['bounding_box'] = bbox
+    if temporal: params['temporal'] = temporal
+    return params
+
+
+async def iter_cmr_granules(params: Dict[str, Any], limit: int, first: Optional[httpx.Response] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Granule entries across pages, following CMR-Search-After, up to limit.
+
+    first is an already fetched first page (so errors surface before streaming starts).
+    Pages are not cached: search-after cursors are only valid for a few minutes.
+    """
+    sent = 0
+    r = first
+    search_after: Optional[str] = None
+    while sent < limit:
+        if r is None:
+            r = await get_client().get(CMR_GRANULES_URL, params=params, headers={'CMR-Search-After': search_after} if search_after else None)
+            r.raise_for_status()
+        entries = (r.json().get('feed') or {}).get('entry') or []
+        search_after = r.headers.get('cmr-search-after')
+        r = None
+        for e in entries[:limit - sent]:
+            yield e
+        sent += min(len(entries), limit - sent)
+        if not search_after or len(entries) < int(params.get('page_size') or 0):
+            return
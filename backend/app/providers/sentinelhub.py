@@ -7,6 +7,7 @@ Replace with real Sentinel Hub (sentinelhub-py) integration when credentials are
 """
 from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta
+import threading
 from ..config import settings
 
 
@@ -31,99 +32,108 @@ def download_preview(asset_id: str) -> bytes:
     return b""
 
 
-def available_dates(
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _get_catalog():
+    """Shared SentinelHubCatalog; building the config and client per query costs a token round trip."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                from sentinelhub import SHConfig, SentinelHubCatalog
+
+                cfg = SHConfig()
+                if settings.SENTINELHUB_CLIENT_ID and settings.SENTINELHUB_CLIENT_SECRET:
+                    cfg.sh_client_id = settings.SENTINELHUB_CLIENT_ID
+                    cfg.sh_client_secret = settings.SENTINELHUB_CLIENT_SECRET
+                # else rely on env or default config if available
+                _catalog = SentinelHubCatalog(config=cfg)
+    return _catalog
+
+
+def _aoi_bbox(aoi: Dict[str, Any]) -> Optional[List[float]]:
+    coords = []
+    def _collect(g):
+        t = g.get('type')
+        if t == 'Polygon':
+            for ring in g.get('coordinates', []):
+                coords.extend(ring)
+        elif t == 'MultiPolygon':
+            for poly in g.get('coordinates', []):
+                for ring in poly:
+                    coords.extend(ring)
+        elif t == 'Feature':
+            return _collect(g.get('geometry') or {})
+        elif t == 'FeatureCollection':
+            for f in g.get('features', []):
+                _collect(f.get('geometry') or {})
+    _collect(aoi)
+    xs = [c[0] for c in coords]; ys = [c[1] for c in coords]
+    return [min(xs), min(ys), max(xs), max(ys)] if xs and ys else None
+
+
+def catalog_dates(
     aoi: Dict[str, Any] | None,
     start: str,
     end: str,
     collection: str = "S2L2A",
-    step_days: int = 5,
     bbox: Optional[List[float]] = None,
     max_cloud_percent: Optional[float] = None,
     intersects: bool = False,
-) -> List[str]:
-    """Return available acquisition dates from Sentinel Hub if configured; else synthetic cadence.
+) -> Optional[List[str]]:
+    """Acquisition dates from the Sentinel Hub Catalog (blocking).
 
-    Args:
-        aoi: GeoJSON geometry; used when `intersects=True`.
-        bbox: [minx,miny,maxx,maxy] in EPSG:4326 when geometry not passed or intersects=False.
-        start,end: ISO date strings (YYYY-MM-DD) inclusive.
-        collection: 'S2L2A' maps to Sentinel-2 L2A.
-        max_cloud_percent: optional cloud cover threshold.
-        intersects: if True, use geometry intersects instead of bbox search.
+    Returns None when sentinelhub-py is not installed; catalog/auth errors are raised
+    so callers can tell "no acquisitions" from "could not ask".
     """
-    # Attempt real Sentinel Hub Catalog query when credentials are present
     try:
-        from sentinelhub import SHConfig, SentinelHubCatalog, BBox, CRS, DataCollection
-
-        cfg = SHConfig()
-        if settings.SENTINELHUB_CLIENT_ID and settings.SENTINELHUB_CLIENT_SECRET:
-            cfg.sh_client_id = settings.SENTINELHUB_CLIENT_ID
-            cfg.sh_client_secret = settings.SENTINELHUB_CLIENT_SECRET
-        # else rely on env or default config if available
+        from sentinelhub import BBox, CRS, DataCollection
+    except ImportError:
+        return None
+    collection_map = {
+        'S2L2A': DataCollection.SENTINEL2_L2A,
+        'S2L1C': DataCollection.SENTINEL2_L1C,
+    }
+    dc = collection_map.get(collection.upper(), DataCollection.SENTINEL2_L2A)
+    query: Dict[str, Any] = {}
+    if isinstance(max_cloud_percent, (int, float)):
+        # STAC query filter for cloud cover
+        query = { 'eo:cloud_cover': { 'lt': float(max_cloud_percent) } }
+    geom = None
+    bbox_obj = None
+    if intersects and isinstance(aoi, dict):
+        geom = aoi  # STAC-compatible GeoJSON geometry
+    else:
+        bb = bbox
+        if not bb and isinstance(aoi, dict):
+            # fallback: compute bbox from geometry
+            try:
+                bb = _aoi_bbox(aoi)
+            except Exception:
+                bb = None
+        if bb and len(bb) == 4:
+            bbox_obj = BBox(bb, crs=CRS.WGS84)
+    it = _get_catalog().search(
+        dc,
+        bbox=bbox_obj,
+        geometry=geom,
+        time=(start[:10], end[:10]),
+        query=query or None,
+        fields={"include": ["id", "properties.datetime", "properties.eo:cloud_cover"], "exclude": ["assets"]},
+    )
+    dates: List[str] = []
+    for item in it:
+        props = item.get('properties', {}) if isinstance(item, dict) else getattr(item, 'properties', {})
+        dt = props.get('datetime')
+        if isinstance(dt, str):
+            dates.append(dt[:10])
+    return sorted(list(set(dates)))
 
-        collection_map = {
-            'S2L2A': DataCollection.SENTINEL2_L2A,
-            'S2L1C': DataCollection.SENTINEL2_L1C,
-        }
-        dc = collection_map.get(collection.upper(), DataCollection.SENTINEL2_L2A)
-        cat = SentinelHubCatalog(config=cfg)
-        query: Dict[str, Any] = {}
-        if isinstance(max_cloud_percent, (int, float)):
-            # STAC query filter for cloud cover
-            query = { 'eo:cloud_cover': { 'lt': float(max_cloud_percent) } }
-        geom = None
-        bbox_obj = None
-        if intersects and isinstance(aoi, dict):
-            geom = aoi  # STAC-compatible GeoJSON geometry
-        else:
-            bb = bbox
-            if not bb and isinstance(aoi, dict):
-                # fallback: compute bbox from geometry
-                try:
-                    coords = []
-                    def _collect(g):
-                        t = g.get('type')
-                        if t == 'Polygon':
-                            for ring in g.get('coordinates', []):
-                                coords.extend(ring)
-                        elif t == 'MultiPolygon':
-                            for poly in g.get('coordinates', []):
-                                for ring in poly:
-                                    coords.extend(ring)
-                        elif t == 'Feature':
-                            return _collect(g.get('geometry') or {})
-                        elif t == 'FeatureCollection':
-                            for f in g.get('features', []):
-                                _collect(f.get('geometry') or {})
-                    _collect(aoi)
-                    xs = [c[0] for c in coords]; ys = [c[1] for c in coords]
-                    if xs and ys:
-                        bb = [min(xs), min(ys), max(xs), max(ys)]
-                except Exception:
-                    bb = None
-            if bb and len(bb) == 4:
-                bbox_obj = BBox(bb, crs=CRS.WGS84)
-        it = cat.search(
-            dc,
-            bbox=bbox_obj,
-            geometry=geom,
-            time=(start[:10], end[:10]),
-            query=query or None,
-            fields={"include": ["id", "properties.datetime", "properties.eo:cloud_cover"], "exclude": ["assets"]},
-        )
-        dates: List[str] = []
-        for item in it:
-            props = item.get('properties', {}) if isinstance(item, dict) else getattr(item, 'properties', {})
-            dt = props.get('datetime')
-            if isinstance(dt, str):
-                dates.append(dt[:10])
-        if dates:
-            return sorted(list(set(dates)))
-    except Exception:
-        # If sentinelhub not installed or auth missing, fallback to synthetic cadence
-        pass
 
-    # Fallback synthetic cadence (no external dependency)
+def fallback_dates(start: str, end: str, step_days: int = 5) -> List[str]:
+    """Synthetic cadence for development (no external dependency)."""
     try:
         d0 = datetime.fromisoformat(start[:10])
         d1 = datetime.fromisoformat(end[:10])
@@ -140,3 +150,35 @@ def available_dates(
     if out and out[-1] != d1.date().isoformat():
         out.append(d1.date().isoformat())
     return out
+
+
+def available_dates(
+    aoi: Dict[str, Any] | None,
+    start: str,
+    end: str,
+    collection: str = "S2L2A",
+    step_days: int = 5,
+    bbox: Optional[List[float]] = None,
+    max_cloud_percent: Optional[float] = None,
+    intersects: bool = False,
+) -> List[str]:
+    """Return available acquisition dates from Sentinel Hub if configured; else synthetic cadence.
+
+    Blocking and uncached; the API goes through providers/dates.py instead.
+
+    Args:
+        aoi: GeoJSON geometry; used when `intersects=True`.
+        bbox: [minx,miny,maxx,maxy] in EPSG:4326 when geometry not passed or intersects=False.
+        start,end: ISO date strings (YYYY-MM-DD) inclusive.
+        collection: 'S2L2A' maps to Sentinel-2 L2A.
+        max_cloud_percent: optional cloud cover threshold.
+        intersects: if True, use geometry intersects instead of bbox search.
+    """
+    try:
+        dates = catalog_dates(aoi, start, end, collection, bbox=bbox, max_cloud_percent=max_cloud_percent, intersects=intersects)
+        if dates:
+            return dates
+    except Exception:
+        # auth missing or catalog unreachable: fall back to synthetic cadence
+        pass
+    return fallback_dates(start, end, step_days)
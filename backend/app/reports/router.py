@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 import io
+from datetime import datetime
 from ..mongo import get_db
 from ..reports.pdf_generator import generate_pdf
-from ..ai.llm import summarize_report
+from ..ai.llm import asummarize_report, call_with_disconnect, summary_input_hash
+from ..ai.rag import mark_changed
 from ..storage.ipfs import pin_bytes_pinata
 from ..config import settings
 from ..blockchain.utils import log_report_hash, verify_hash
@@ -23,15 +25,27 @@ async def get_report(report_id: str, db = Depends(get_db)):
 
 
 @router.get('/{report_id}/summary')
-async def get_report_summary(report_id: str, db = Depends(get_db)):
+async def get_report_summary(report_id: str, request: Request, db = Depends(get_db)):
     col = db.get_collection('mining_reports')
-    report = await col.find_one({'_id': report_id})
+    report = await col.find_one({'_id': report_id}, projection={'status': 1, 'result': 1, 'summary': 1, 'summary_meta': 1})
     if not report:
         raise HTTPException(status_code=404, detail='Report not found')
     r = report.get('result') or {}
     status = report.get('status')
-    summary = summarize_report(r)
-    return { 'report_id': report_id, 'status': status, 'summary': summary }
+    meta = report.get('summary_meta') or {}
+    h = summary_input_hash(r)
+    # Precomputed at job completion; regenerate only if the result changed since
+    if report.get('summary') and meta.get('input_hash') == h:
+        return { 'report_id': report_id, 'status': status, 'summary': report['summary'], 'precomputed': True }
+    summary, degraded = await call_with_disconnect(request, asummarize_report(r))
+    # A fallback after an upstream failure is returned but not stored, so the next request retries
+    if report.get('result') and not degraded:
+        await col.update_one({'_id': report_id}, {'$set': {
+            'summary': summary,
+            'summary_meta': { 'input_hash': h, 'model': settings.OPENAI_MODEL or 'gpt-4o-mini', 'generated_at': datetime.utcnow() },
+        }})
+        await mark_changed(db, 'report', report_id)
+    return { 'report_id': report_id, 'status': status, 'summary': summary, 'precomputed': False }
 
 
 @router.post('/{report_id}/pin')
@@ -0,0 +1,322 @@
+"""
+Block-wise temporal change detection between two scenes.
+
+scene2 is aligned to scene1's grid (WarpedVRT when CRS/transform/size differ), the
+AOI is turned into a window plus a per-block polygon mask, and blocks are processed
+in a thread pool: per block both epochs' indices come from the spectral engine, the
+index delta (scene2 - scene1) is thresholded in the index's change direction, and
+changed pixels are vectorized. GDAL reads and the numpy work release the GIL, so
+threads scale without copying rasters between processes; each worker opens its own
+dataset handles. Memory is bounded by (workers x block size).
+
+run_pyramid() is the coarse-to-fine variant for large, sparsely changing AOIs: every
+block is compared at overview resolution first and only candidate blocks are read
+at full resolution.
+
+Returns changed area (ha), mean index deltas, and changed regions as GeoJSON in
+EPSG:4326 (merged across block edges when shapely is installed).
+"""
+from __future__ import annotations
+
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, shapes
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_geom
+from rasterio.windows import Window, from_bounds
+
+from ..config import settings
+from .cog import gdal_env
+from .spectral import block_windows, default_band_map, index_arrays, read_bands, resolve
+
+try:
+    from shapely.geometry import mapping as shp_mapping, shape as shp_shape
+    from shapely.ops import unary_union as shp_unary_union
+    _HAS_SHAPELY = True
+except Exception:
+    _HAS_SHAPELY = False
+
+# Which way an index moves when ground is cleared/excavated
+DEFAULT_DIRECTION = {'ndvi': 'decrease', 'nbr': 'decrease', 'ndwi': 'both', 'bsi': 'increase', 'ndbi': 'increase'}
+
+
+def aoi_geometries(aoi: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """GeoJSON geometries from a geometry, Feature, FeatureCollection or {'bbox': [...]}."""
+    if not aoi:
+        return []
+    if aoi.get('type') == 'FeatureCollection':
+        return [g for f in aoi.get('features') or [] for g in aoi_geometries(f)]
+    if aoi.get('type') == 'Feature':
+        return aoi_geometries(aoi.get('geometry'))
+    if 'bbox' in aoi and not aoi.get('type'):
+        x0, y0, x1, y1 = aoi['bbox']
+        return [{'type': 'Polygon', 'coordinates': [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]}]
+    return [aoi] if aoi.get('coordinates') else []
+
+
+def _bounds(geoms: Iterable[Dict[str, Any]]) -> Tuple[float, float, float, float]:
+    xs: List[float] = []
+    ys: List[float] = []
+
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            xs.append(float(c[0])); ys.append(float(c[1]))
+        else:
+            for part in c:
+                walk(part)
+
+    for g in geoms:
+        walk(g['coordinates'])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _ring_area(ring: Sequence[Sequence[float]]) -> float:
+    return abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))) / 2.0
+
+
+def _polygon_area(geom: Dict[str, Any]) -> float:
+    rings = geom['coordinates']
+    return _ring_area(rings[0]) - sum(_ring_area(r) for r in rings[1:])
+
+
+def pixel_area_m2(ds, window: Window) -> float:
+    """Area of one pixel in m² (at the window centre for geographic CRSs)."""
+    a, e = ds.transform.a, ds.transform.e
+    if ds.crs and ds.crs.is_geographic:
+        _, lat = ds.transform * (window.col_off + window.width / 2.0, window.row_off + window.height / 2.0)
+        return abs(a * 111320.0 * math.cos(math.radians(lat)) * e * 110540.0)
+    factor = ds.crs.linear_units_factor[1] if ds.crs is not None else 1.0
+    return abs(a * e) * factor * factor
+
+
+def _changed(delta: np.ma.MaskedArray, threshold: float, direction: str) -> np.ndarray:
+    d = delta.filled(0.0)
+    if direction == 'increase':
+        hit = d >= threshold
+    elif direction == 'decrease':
+        hit = d <= -threshold
+    else:
+        hit = np.abs(d) >= threshold
+    return hit & ~np.ma.getmaskarray(delta)
+
+
+class ChangeDetector:
+    """Per-job state: scene paths, AOI, index settings and per-thread dataset handles."""
+
+    def __init__(self, scene1: str, scene2: str, aoi: Optional[Dict[str, Any]] = None, *, index: str = 'ndvi',
+                 threshold: float = 0.2, direction: Optional[str] = None, min_pixels: int = 4,
+                 band_map1: Optional[Dict[str, int]] = None, band_map2: Optional[Dict[str, int]] = None) -> None:
+        self.scene1, self.scene2 = scene1, scene2
+        self.index = index.lower()
+        self.threshold = abs(float(threshold))
+        self.direction = (direction or DEFAULT_DIRECTION.get(self.index, 'both')).lower()
+        self.min_pixels = max(1, int(min_pixels))
+        self._local = threading.local()
+        self._opened: List[Any] = []
+        self._opened_lock = threading.Lock()
+        from ..storage.artifacts import touch_artifact
+        touch_artifact(scene1)
+        touch_artifact(scene2)
+        with gdal_env(), rasterio.open(scene1) as ds1, rasterio.open(scene2) as ds2:
+            self.crs, self.transform = ds1.crs, ds1.transform
+            self.width, self.height = ds1.width, ds1.height
+            self.block_shapes = ds1.block_shapes  # lets block_windows() take the detector as the grid
+            self.aligned = (ds2.crs == ds1.crs and ds2.transform == ds1.transform
+                            and ds2.width == ds1.width and ds2.height == ds1.height)
+            # NDVI is always reported; the thresholded index may be another one
+            self.names = list(dict.fromkeys([self.index, 'ndvi']))
+            bm1 = {**default_band_map(ds1.count), **(band_map1 or {})}
+            bm2 = {**default_band_map(ds2.count), **(band_map2 or {})}
+            if 'ndvi' != self.index and not {'red', 'nir'} <= (set(bm1) & set(bm2)):
+                self.names.remove('ndvi')
+            _, self.needed1 = resolve(self.names, bm1)
+            _, self.needed2 = resolve(self.names, bm2)
+            geoms = aoi_geometries(aoi)
+            self.geoms = [transform_geom('EPSG:4326', ds1.crs, g) for g in geoms] if geoms and ds1.crs else geoms
+            self.window = self._aoi_window(ds1)
+
+    def _aoi_window(self, ds) -> Window:
+        if not self.geoms:
+            return Window(0, 0, ds.width, ds.height)
+        raw = from_bounds(*_bounds(self.geoms), transform=ds.transform)
+        col0, row0 = max(0, int(math.floor(raw.col_off))), max(0, int(math.floor(raw.row_off)))
+        col1 = min(ds.width, int(math.ceil(raw.col_off + raw.width)))
+        row1 = min(ds.height, int(math.ceil(raw.row_off + raw.height)))
+        if col1 <= col0 or row1 <= row0:
+            raise ValueError('AOI does not intersect scene1')
+        return Window(col0, row0, col1 - col0, row1 - row0)
+
+    def _handles(self):
+        h = getattr(self._local, 'handles', None)
+        if h is None:
+            ds1 = rasterio.open(self.scene1)
+            ds2 = rasterio.open(self.scene2)
+            src2 = ds2 if self.aligned else WarpedVRT(
+                ds2, crs=self.crs, transform=self.transform, width=self.width, height=self.height,
+                resampling=Resampling.bilinear,
+            )
+            h = self._local.handles = (ds1, src2)
+            with self._opened_lock:
+                self._opened.extend([src2, ds2, ds1] if src2 is not ds2 else [ds2, ds1])
+        return h
+
+    def close(self) -> None:
+        with self._opened_lock:
+            for ds in self._opened:
+                try:
+                    ds.close()
+                except Exception:
+                    pass
+            self._opened.clear()
+        self._local = threading.local()
+
+    def block_result(self, w: Window, out_shape: Optional[Tuple[int, int]] = None,
+                     threshold: Optional[float] = None, vectorize: bool = True) -> Dict[str, Any]:
+        """Delta stats and changed-region polygons for one window.
+
+        With out_shape the window is read decimated (averaged, so small changes still
+        move the coarse pixel); counts are then in coarse pixels and 'scale' gives the
+        full-resolution pixels each one stands for.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        with gdal_env():
+            ds1, src2 = self._handles()
+            b1, inv1 = read_bands(ds1, self.needed1, w, out_shape, Resampling.average)
+            b2, inv2 = read_bands(src2, self.needed2, w, out_shape, Resampling.average)
+        i1 = index_arrays(b1, inv1, self.names)
+        i2 = index_arrays(b2, inv2, self.names)
+        shape = i1[self.index].shape
+        transform = ds1.window_transform(w)
+        if shape != (int(w.height), int(w.width)):
+            transform = transform * Affine.scale(w.width / shape[1], w.height / shape[0])
+        outside = geometry_mask(self.geoms, out_shape=shape, transform=transform) if self.geoms else None
+        scale = (w.width * w.height) / float(shape[0] * shape[1])
+        res: Dict[str, Any] = {'valid': 0, 'changed': 0, 'sums': {}, 'features': [], 'scale': scale}
+        for n in self.names:
+            delta = i2[n] - i1[n]
+            if outside is not None:
+                delta = np.ma.masked_where(outside, delta)
+            res['sums'][n] = (float(delta.sum()) if delta.count() else 0.0, int(delta.count()))
+            if n == self.index:
+                res['valid'] = int(delta.count())
+                hit = _changed(delta, threshold, self.direction)
+                res['changed'] = int(hit.sum())
+                if res['changed'] and vectorize:
+                    res['features'] = self._vectorize(hit, transform)
+        res['pixel_area_m2'] = pixel_area_m2(ds1, w) * scale
+        return res
+
+    def _vectorize(self, hit: np.ndarray, transform) -> List[Dict[str, Any]]:
+        px = abs(transform.a * transform.e)
+        feats = []
+        for geom, _ in shapes(hit.astype('uint8'), mask=hit, transform=transform):
+            if _polygon_area(geom) / px < self.min_pixels:
+                continue
+            feats.append(geom)
+        return feats
+
+    def run(self, workers: Optional[int] = None, windows: Optional[Iterable[Window]] = None) -> Dict[str, Any]:
+        """Process windows (default: every block of the AOI) in a thread pool and aggregate."""
+        windows = list(windows) if windows is not None else list(block_windows(self, self.window))
+        workers = max(1, int(workers or settings.CHANGE_WORKERS))
+        try:
+            if workers == 1 or len(windows) <= 1:
+                results = [self.block_result(w) for w in windows]
+            else:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='change') as pool:
+                    results = list(pool.map(self.block_result, windows))
+        finally:
+            self.close()
+        return self.aggregate(results, blocks=len(windows))
+
+    def run_pyramid(self, workers: Optional[int] = None, factor: Optional[int] = None,
+                    coarse_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """Coarse-to-fine: difference every block at 1/factor resolution (served from the
+        files' overviews when present), then read full resolution only for blocks whose
+        coarse delta passes coarse_threshold (default: half the pixel threshold, since
+        averaging dilutes small changes).
+
+        Untouched blocks contribute their coarse stats to the delta means and no changed
+        area. Changes much smaller than a coarse pixel can be missed; lower
+        coarse_threshold or factor to trade speed for recall.
+        """
+        factor = max(2, int(factor or settings.CHANGE_PYRAMID_FACTOR))
+        coarse_threshold = self.threshold / 2.0 if coarse_threshold is None else abs(float(coarse_threshold))
+        windows = list(block_windows(self, self.window))
+        workers = max(1, int(workers or settings.CHANGE_WORKERS))
+
+        def coarse(w: Window) -> Dict[str, Any]:
+            out_shape = (max(1, int(w.height) // factor), max(1, int(w.width) // factor))
+            return self.block_result(w, out_shape, threshold=coarse_threshold, vectorize=False)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='change') as pool:
+                coarse_results = list(pool.map(coarse, windows))
+                candidates = [i for i, r in enumerate(coarse_results) if r['changed']]
+                fine = dict(zip(candidates, pool.map(self.block_result, [windows[i] for i in candidates])))
+        finally:
+            self.close()
+        results = []
+        for i, r in enumerate(coarse_results):
+            results.append(fine[i] if i in fine else {**r, 'changed': 0, 'features': []})
+        return self.aggregate(
+            results, blocks=len(windows), candidate_blocks=len(candidates), coarse_factor=factor,
+            coarse_threshold=coarse_threshold, mode='pyramid',
+        )
+
+    def aggregate(self, results: Sequence[Dict[str, Any]], **extra_metrics) -> Dict[str, Any]:
+        changed_m2 = sum(r['changed'] * r['pixel_area_m2'] for r in results)
+        metrics: Dict[str, Any] = {
+            'index': self.index,
+            'threshold': self.threshold,
+            'direction': self.direction,
+            # Full-resolution-equivalent counts (coarse blocks scaled up)
+            'valid_pixels': int(sum(r['valid'] * r['scale'] for r in results)),
+            'changed_pixels': int(sum(r['changed'] * r['scale'] for r in results)),
+            **extra_metrics,
+        }
+        for n in self.names:
+            total = sum(r['sums'][n][0] * r['scale'] for r in results)
+            count = sum(r['sums'][n][1] * r['scale'] for r in results)
+            metrics[f'{n}_delta_mean'] = (total / count) if count else 0.0
+        geoms = [g for r in results for g in r['features']]
+        return {
+            'changed_area_ha': round(changed_m2 / 10000.0, 4),
+            'metrics': metrics,
+            'features': self._to_feature_collection(geoms),
+        }
+
+    def _to_feature_collection(self, geoms: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if _HAS_SHAPELY and geoms:
+            # Regions cut at block edges are merged back together
+            merged = shp_unary_union([shp_shape(g) for g in geoms])
+            parts = getattr(merged, 'geoms', [merged])
+            geoms = [shp_mapping(p) for p in parts if not p.is_empty]
+        geoms.sort(key=_polygon_area, reverse=True)
+        cap = int(settings.CHANGE_MAX_FEATURES)
+        feats = []
+        for g in geoms[:cap]:
+            g4326 = transform_geom(self.crs, 'EPSG:4326', g) if self.crs else g
+            feats.append({'type': 'Feature', 'geometry': g4326, 'properties': {'index': self.index}})
+        return {'type': 'FeatureCollection', 'features': feats, 'truncated': len(geoms) > cap}
+
+
+def detect_change(scene1: str, scene2: str, aoi: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+    """Changed area/metrics/regions between two scenes; blocking, run it off the event loop."""
+    workers = kwargs.pop('workers', None)
+    mode = (kwargs.pop('mode', None) or 'full').lower()
+    factor = kwargs.pop('coarse_factor', None)
+    coarse_threshold = kwargs.pop('coarse_threshold', None)
+    detector = ChangeDetector(scene1, scene2, aoi, **kwargs)
+    if mode == 'pyramid':
+        return detector.run_pyramid(workers, factor, coarse_threshold)
+    if mode != 'full':
+        raise ValueError(f"unknown mode {mode!r} (full | pyramid)")
+    return detector.run(workers)
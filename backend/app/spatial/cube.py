@@ -0,0 +1,410 @@
+"""
+Per-AOI time-series cube (time x y x x) for the temporal slider.
+
+Each AOI gets a fixed grid (UTM zone of the AOI centre, CUBE_RESOLUTION_M pixels,
+coarsened to stay under CUBE_MAX_PIXELS) under STORAGE_ROOT/cubes/<cube_id>/:
+
+  meta.json     grid, variables, one slot per ingested date, per-date stats
+  mask.npy      AOI polygon mask on the grid (pixels outside are NaN in every slot)
+  <var>.f32     float32 values, shape (slots, ny, nx, CUBE_CHUNK, CUBE_CHUNK)
+
+A variable is a spectral index (see spectral.INDICES) or a raw band name. Ingesting a
+date warps the scene onto the cube grid, computes the variables chunk by chunk with
+the spectral engine and appends one slab per variable, so each date is processed
+once. Reads memory-map the files: a pixel time series touches one value per slot, a
+timelapse frame is one contiguous slab, and per-date stats are stored at ingest.
+
+meta.json is replaced atomically after the slabs are flushed, so readers never see a
+slot whose data is not on disk. Writers to the same cube are serialized with a lock
+file (fcntl when available, otherwise per process).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform as warp_transform, transform_bounds, transform_geom
+from rasterio.windows import Window
+
+from ..config import settings
+from ..utils.file_storage import STORAGE_ROOT
+from .change import _bounds, aoi_geometries
+from .cog import gdal_env
+from .spectral import INDICES, RunningStats, default_band_map, index_arrays, read_bands, resolve
+
+try:
+    import fcntl
+    _HAS_FCNTL = True
+except Exception:
+    _HAS_FCNTL = False
+
+CUBE_ROOT = STORAGE_ROOT / 'cubes'
+
+_process_locks: Dict[str, threading.Lock] = {}
+_process_locks_guard = threading.Lock()
+
+
+def _aoi_geoms(aoi: Optional[Dict[str, Any]], bbox: Optional[Sequence[float]]) -> List[Dict[str, Any]]:
+    geoms = aoi_geometries(aoi) if aoi else []
+    if not geoms and bbox:
+        geoms = aoi_geometries({'bbox': list(bbox)})
+    if not geoms:
+        raise ValueError('an aoi or bbox is required')
+    return geoms
+
+
+def cube_id_for(aoi: Optional[Dict[str, Any]] = None, bbox: Optional[Sequence[float]] = None) -> str:
+    """Stable id for an AOI: the hash of its EPSG:4326 bounds rounded to ~10 cm."""
+    key = ','.join(f'{v:.6f}' for v in _bounds(_aoi_geoms(aoi, bbox)))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _utm_crs(lon: float, lat: float) -> str:
+    zone = min(60, max(1, int((lon + 180.0) // 6.0) + 1))
+    return f'EPSG:{(32600 if lat >= 0 else 32700) + zone}'
+
+
+def _write_json(path: Path, payload: Dict) -> None:
+    tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    tmp.write_text(json.dumps(payload))
+    os.replace(tmp, path)
+
+
+class TimeSeriesCube:
+    def __init__(self, cube_id: str, root: Optional[Path] = None) -> None:
+        self.cube_id = cube_id
+        self.dir = Path(root or CUBE_ROOT) / cube_id
+        self.meta = json.loads((self.dir / 'meta.json').read_text())
+
+    # ---- creation -----------------------------------------------------------------
+
+    @classmethod
+    def exists(cls, cube_id: str, root: Optional[Path] = None) -> bool:
+        return (Path(root or CUBE_ROOT) / cube_id / 'meta.json').exists()
+
+    @classmethod
+    def create(cls, aoi: Optional[Dict[str, Any]] = None, bbox: Optional[Sequence[float]] = None, *,
+               resolution: Optional[float] = None, root: Optional[Path] = None) -> 'TimeSeriesCube':
+        """Open the AOI's cube, creating its grid on first use."""
+        cube_id = cube_id_for(aoi, bbox)
+        if cls.exists(cube_id, root):
+            return cls(cube_id, root)
+        geoms = _aoi_geoms(aoi, bbox)
+        west, south, east, north = _bounds(geoms)
+        crs = _utm_crs((west + east) / 2.0, (south + north) / 2.0)
+        left, bottom, right, top = transform_bounds('EPSG:4326', crs, west, south, east, north, densify_pts=21)
+        res = float(resolution or settings.CUBE_RESOLUTION_M)
+        max_pixels = int(settings.CUBE_MAX_PIXELS)
+        if (right - left) * (top - bottom) / (res * res) > max_pixels:
+            res = math.sqrt((right - left) * (top - bottom) / max_pixels)
+        width = max(1, int(math.ceil((right - left) / res)))
+        height = max(1, int(math.ceil((top - bottom) / res)))
+        transform = Affine(res, 0.0, left, 0.0, -res, top)
+        chunk = int(settings.CUBE_CHUNK)
+        directory = Path(root or CUBE_ROOT) / cube_id
+        directory.mkdir(parents=True, exist_ok=True)
+        grid_geoms = [transform_geom('EPSG:4326', crs, g) for g in geoms]
+        inside = ~geometry_mask(grid_geoms, out_shape=(height, width), transform=transform)
+        np.save(directory / 'mask.npy', inside)
+        _write_json(directory / 'meta.json', {
+            'cube_id': cube_id,
+            'bounds_4326': [west, south, east, north],
+            'crs': crs,
+            'transform': list(transform)[:6],
+            'width': width,
+            'height': height,
+            'resolution': res,
+            'chunk': chunk,
+            'ny': int(math.ceil(height / chunk)),
+            'nx': int(math.ceil(width / chunk)),
+            'variables': [],
+            'slots': [],
+            'stats': {},
+            'failed': {},
+            'created_at': time.time(),
+        })
+        return cls(cube_id, root)
+
+    # ---- layout -------------------------------------------------------------------
+
+    @property
+    def transform(self) -> Affine:
+        return Affine(*self.meta['transform'])
+
+    @property
+    def _slot_shape(self) -> Tuple[int, int, int, int]:
+        m = self.meta
+        return m['ny'], m['nx'], m['chunk'], m['chunk']
+
+    @property
+    def _slab_bytes(self) -> int:
+        ny, nx, cy, cx = self._slot_shape
+        return ny * nx * cy * cx * 4
+
+    def _var_path(self, var: str) -> Path:
+        return self.dir / f'{var}.f32'
+
+    def dates(self) -> List[str]:
+        return sorted(s['date'] for s in self.meta['slots'])
+
+    def _slot(self, date: str) -> int:
+        for i, s in enumerate(self.meta['slots']):
+            if s['date'] == date[:10]:
+                return i
+        raise KeyError(date)
+
+    def _memmap(self, var: str, mode: str = 'r') -> np.memmap:
+        if var not in self.meta['variables']:
+            raise ValueError(f'variable {var!r} is not in this cube (has: {", ".join(self.meta["variables"]) or "none"})')
+        slots = len(self.meta['slots'])
+        return np.memmap(self._var_path(var), dtype='float32', mode=mode, shape=(slots, *self._slot_shape))
+
+    def chunk_windows(self) -> Iterator[Tuple[int, int, Window]]:
+        m = self.meta
+        c = m['chunk']
+        for iy in range(m['ny']):
+            for ix in range(m['nx']):
+                yield iy, ix, Window(ix * c, iy * c, min(c, m['width'] - ix * c), min(c, m['height'] - iy * c))
+
+    # ---- ingest -------------------------------------------------------------------
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        path = self.dir / '.lock'
+        if _HAS_FCNTL:
+            with open(path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        else:
+            with _process_locks_guard:
+                lock = _process_locks.setdefault(str(path), threading.Lock())
+            with lock:
+                yield
+
+    def _add_variables(self, variables: Sequence[str]) -> None:
+        # Variables added after the first dates are NaN for the existing slots
+        for var in variables:
+            if var in self.meta['variables']:
+                continue
+            slots = len(self.meta['slots'])
+            with open(self._var_path(var), 'wb') as f:
+                if slots:
+                    nan_slab = np.full(self._slot_shape, np.nan, dtype='float32').tobytes()
+                    for _ in range(slots):
+                        f.write(nan_slab)
+            self.meta['variables'].append(var)
+            self.meta['stats'].setdefault(var, {})
+
+    def ingest(self, date: str, scene: str, variables: Sequence[str] = ('ndvi',), *,
+               band_map: Optional[Dict[str, int]] = None) -> Dict:
+        """Process one scene into the slot for date (appended, or overwritten on re-ingest).
+
+        Blocking; called from the Celery task. Raises ValueError for unknown variables
+        or bands the scene does not have.
+        """
+        date = date[:10]
+        variables = [v.lower() for v in variables]
+        from ..storage.artifacts import touch_artifact
+        touch_artifact(scene)
+        with self._write_lock():
+            self.meta = json.loads((self.dir / 'meta.json').read_text())
+            with gdal_env(), rasterio.open(scene) as ds:
+                bm = {**default_band_map(ds.count), **(band_map or {})}
+                index_names = [v for v in variables if v in INDICES]
+                _, needed = resolve(index_names, bm)
+                for v in variables:
+                    if v not in INDICES:
+                        if v not in bm:
+                            raise ValueError(f'unknown variable {v!r}: not an index or a band of this scene/band map')
+                        needed[v] = int(bm[v])
+                self._add_variables(variables)
+                try:
+                    slot = self._slot(date)
+                    appended = False
+                except KeyError:
+                    slot = len(self.meta['slots'])
+                    appended = True
+                    for var in self.meta['variables']:
+                        with open(self._var_path(var), 'r+b') as f:
+                            f.truncate((slot + 1) * self._slab_bytes)
+                stats = {v: RunningStats() for v in variables}
+                inside = np.load(self.dir / 'mask.npy', mmap_mode='r')
+                slabs = {var: np.memmap(self._var_path(var), dtype='float32', mode='r+',
+                                        offset=slot * self._slab_bytes, shape=self._slot_shape)
+                         for var in self.meta['variables']}
+                for var, slab in slabs.items():
+                    if var not in variables:
+                        slab[:] = np.nan
+                m = self.meta
+                # float32 with NaN nodata: pixels outside the scene footprint (or source nodata)
+                # come back NaN instead of valid 0s
+                with WarpedVRT(ds, crs=m['crs'], transform=self.transform, width=m['width'], height=m['height'],
+                               resampling=Resampling.bilinear, dtype='float32', nodata=np.nan) as vrt:
+                    for iy, ix, w in self.chunk_windows():
+                        h, wd = int(w.height), int(w.width)
+                        r0, c0 = int(w.row_off), int(w.col_off)
+                        outside = ~inside[r0:r0 + h, c0:c0 + wd]
+                        if outside.all():
+                            for slab in slabs.values():
+                                slab[iy, ix] = np.nan
+                            continue
+                        bands, invalid = read_bands(vrt, needed, w)
+                        invalid = invalid | outside
+                        for arr in bands.values():
+                            invalid |= ~np.isfinite(arr)
+                        values = dict(index_arrays(bands, invalid, index_names))
+                        for v in variables:
+                            if v not in values:
+                                values[v] = np.ma.masked_array(bands[v], mask=invalid)
+                        for v, arr in values.items():
+                            stats[v].update(arr)
+                            slabs[v][iy, ix] = np.nan
+                            slabs[v][iy, ix, :h, :wd] = arr.filled(np.nan)
+                for slab in slabs.values():
+                    slab.flush()
+                del slabs
+            entry = {'date': date, 'scene': scene, 'ingested_at': time.time()}
+            if appended:
+                m['slots'].append(entry)
+            else:
+                m['slots'][slot] = entry
+            for var in m['variables']:
+                if var in stats:
+                    s = stats[var].as_dict()
+                    if var not in INDICES:  # percentiles come from a fixed index-range histogram
+                        s = {k: s[k] for k in ('count', 'min', 'max', 'mean', 'std')}
+                    m['stats'][var][date] = s
+                else:
+                    m['stats'][var].pop(date, None)
+            m['failed'].pop(date, None)
+            _write_json(self.dir / 'meta.json', m)
+        return {'date': date, 'slot': slot, 'variables': variables, 'appended': appended}
+
+    def record_failure(self, date: str, error: str) -> None:
+        with self._write_lock():
+            self.meta = json.loads((self.dir / 'meta.json').read_text())
+            self.meta['failed'][date[:10]] = error
+            _write_json(self.dir / 'meta.json', self.meta)
+
+    # ---- reads --------------------------------------------------------------------
+
+    def info(self) -> Dict:
+        m = self.meta
+        return {
+            'cube_id': self.cube_id,
+            'bounds': m['bounds_4326'],
+            'crs': m['crs'],
+            'width': m['width'],
+            'height': m['height'],
+            'resolution': m['resolution'],
+            'variables': m['variables'],
+            'dates': self.dates(),
+            'failed': m.get('failed') or {},
+        }
+
+    def pixel_series(self, var: str, lon: float, lat: float) -> Dict:
+        xs, ys = warp_transform('EPSG:4326', self.meta['crs'], [lon], [lat])
+        col, row = ~self.transform * (xs[0], ys[0])
+        row, col = int(math.floor(row)), int(math.floor(col))
+        if not (0 <= row < self.meta['height'] and 0 <= col < self.meta['width']):
+            raise ValueError('point is outside the cube')
+        c = self.meta['chunk']
+        if not self.meta['slots']:
+            return {'variable': var, 'row': row, 'col': col, 'series': []}
+        values = np.array(self._memmap(var)[:, row // c, col // c, row % c, col % c])
+        by_date = {s['date']: values[i] for i, s in enumerate(self.meta['slots'])}
+        return {
+            'variable': var,
+            'row': row,
+            'col': col,
+            'series': [{'date': d, 'value': None if not np.isfinite(by_date[d]) else float(by_date[d])} for d in self.dates()],
+        }
+
+    def date_stats(self, var: str) -> List[Dict]:
+        if var not in self.meta['variables']:
+            raise ValueError(f'variable {var!r} is not in this cube')
+        per_date = self.meta['stats'].get(var) or {}
+        return [{'date': d, **per_date.get(d, {'count': 0})} for d in self.dates()]
+
+    def frame(self, var: str, date: str, max_size: Optional[int] = None) -> np.ndarray:
+        """One date as a (height, width) float32 array, NaN outside the AOI/scene.
+
+        With max_size the frame is strided down so neither side exceeds it.
+        """
+        ny, nx, cy, cx = self._slot_shape
+        slab = self._memmap(var)[self._slot(date)]
+        arr = np.asarray(slab).transpose(0, 2, 1, 3).reshape(ny * cy, nx * cx)[:self.meta['height'], :self.meta['width']]
+        if max_size:
+            step = max(1, int(math.ceil(max(arr.shape) / float(max_size))))
+            arr = arr[::step, ::step]
+        return arr
+
+    def frame_etag(self, var: str, date: str) -> str:
+        """Validator for a rendered frame: changes when the date is re-ingested or the
+        shared display range of var moves. Raises KeyError for unknown dates."""
+        slot = self.meta['slots'][self._slot(date)]
+        material = f"{self.cube_id}|{var}|{slot['date']}|{slot.get('ingested_at')}|{self.value_range(var)}"
+        return '"' + hashlib.sha1(material.encode()).hexdigest()[:20] + '"'
+
+    def value_range(self, var: str) -> Tuple[float, float]:
+        """Display range shared by every frame of var, so a timelapse does not flicker."""
+        lo, hi = math.inf, -math.inf
+        for s in (self.meta['stats'].get(var) or {}).values():
+            if s.get('count'):
+                lo = min(lo, s.get('p10') if s.get('p10') is not None else s['min'])
+                hi = max(hi, s.get('p90') if s.get('p90') is not None else s['max'])
+        if not math.isfinite(lo) or hi <= lo:
+            return (-1.0, 1.0) if var in INDICES else (0.0, 1.0)
+        return lo, hi
+
+
+# brown -> yellow -> green, a common ramp for vegetation/soil indices
+_RAMP = np.array([[140, 81, 10], [246, 232, 195], [255, 255, 191], [199, 234, 229], [1, 133, 113]], dtype='float32')
+
+
+def render_png(arr: np.ndarray, vmin: float, vmax: float) -> bytes:
+    """RGBA PNG of a frame; NaN pixels are transparent."""
+    import io
+    from PIL import Image
+    valid = np.isfinite(arr)
+    t = np.clip((np.where(valid, arr, vmin) - vmin) / max(vmax - vmin, 1e-9), 0.0, 1.0) * (len(_RAMP) - 1)
+    lo = np.floor(t).astype('int32').clip(0, len(_RAMP) - 2)
+    frac = (t - lo)[..., None]
+    rgb = _RAMP[lo] * (1.0 - frac) + _RAMP[lo + 1] * frac
+    rgba = np.dstack([rgb.astype('uint8'), np.where(valid, 255, 0).astype('uint8')])
+    buf = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def open_cube(cube_id: str) -> TimeSeriesCube:
+    if not TimeSeriesCube.exists(cube_id):
+        raise KeyError(cube_id)
+    return TimeSeriesCube(cube_id)
+
+
+def cube_dates_for(aoi: Optional[Dict[str, Any]] = None, bbox: Optional[Sequence[float]] = None) -> Optional[Dict]:
+    """{'cube_id', 'dates'} when the AOI already has a cube, else None."""
+    try:
+        cube_id = cube_id_for(aoi, bbox)
+    except Exception:
+        return None
+    if not TimeSeriesCube.exists(cube_id):
+        return None
+    return {'cube_id': cube_id, 'dates': TimeSeriesCube(cube_id).dates()}
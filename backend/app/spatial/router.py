@@ -1,12 +1,15 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Any, Dict, List, Optional
-from ..utils.file_storage import save_upload_file
+from ..utils.file_storage import stream_upload
 from ..config import settings
 import httpx
 import rasterio
 import numpy as np
 from pathlib import Path
+from uuid import uuid4
+import anyio
+import re
 from ..utils.file_storage import STORAGE_ROOT
 from ..mongo import get_db
 from ..dem.terrarium import build_mosaic_geotiff
@@ -156,6 +159,8 @@ class DemDeltaIn(BaseModel):
 async def dem_delta(input: DemDeltaIn):
     """Compute Δh statistics between two DEM rasters using Rasterio."""
     def read_raster(path: str):
+        from ..storage.artifacts import touch_artifact
+        touch_artifact(path)
         with rasterio.open(path) as ds:
             arr = ds.read(1, masked=True)
             profile = ds.profile
@@ -182,21 +187,48 @@ async def dem_delta(input: DemDeltaIn):
 
 @router.post('/lidar/import')
 async def lidar_import(file: UploadFile = File(...)):
-    # Stub: save file, later process via PDAL/laspy
-    path = await save_upload_file(file, 'lidar')
-    return { 'status': 'stored', 'path': path }
+    # Stub: save file, later process via PDAL/laspy. There is no owning record yet, so the
+    # returned path is referenced by the import itself and is not evicted under quota pressure.
+    stored = await stream_upload(file, 'lidar')
+    from ..storage.artifacts import get_artifact_store
+    await anyio.to_thread.run_sync(get_artifact_store().add_ref, stored['sha256'], f"lidar:{stored['sha256']}")
+    return { 'status': 'stored', 'path': stored['path'], 'size': stored['size'], 'sha256': stored['sha256'] }
 
 
 class ChangeDetectIn(BaseModel):
     scene1: str
     scene2: str
     aoi: Dict[str, Any]
+    index: str = 'ndvi'  # ndvi | bsi | ndbi | nbr | ndwi
+    threshold: float = 0.2  # minimum index change per pixel
+    direction: str | None = None  # increase | decrease | both; default depends on the index
+    min_pixels: int = 4  # smaller changed regions are dropped
+    bands1: Dict[str, int] | None = None
+    bands2: Dict[str, int] | None = None
+    # 'pyramid': compare overviews first, read full resolution only where they changed
+    mode: str = 'full'
+    coarse_factor: int | None = None
+    coarse_threshold: float | None = None
 
 
 @router.post('/change-detection')
 async def change_detection(data: ChangeDetectIn):
-    # Stub: later use SAR/optical temporal differencing
-    return { 'changed_area_ha': 0.0, 'metrics': { 'ndvi_delta_mean': 0.0 } }
+    """Temporal differencing of scene2 against scene1 over the AOI (optical indices).
+
+    Block-wise in a worker pool (see spatial/change.py); returns changed area, mean
+    index deltas and the changed regions as a GeoJSON FeatureCollection.
+    """
+    from .change import detect_change
+    try:
+        return await anyio.to_thread.run_sync(lambda: detect_change(
+            data.scene1, data.scene2, data.aoi, index=data.index, threshold=data.threshold,
+            direction=data.direction, min_pixels=data.min_pixels, band_map1=data.bands1, band_map2=data.bands2,
+            mode=data.mode, coarse_factor=data.coarse_factor, coarse_threshold=data.coarse_threshold,
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except rasterio.errors.RasterioIOError as e:
+        raise HTTPException(status_code=400, detail=f'Could not read scene: {e}')
 
 
 # NASA CMR Search (common entry point for Sentinel/Landsat via CMR)
@@ -205,22 +237,64 @@ class CmrSearchIn(BaseModel):
     bbox: str | None = None  # 'minLon,minLat,maxLon,maxLat'
     temporal: str | None = None  # 'start,end' ISO8601
     page_size: int = 25
+    fields: list[str] | None = None  # e.g. ['id', 'title', 'time_start', 'links.href']
+    search_after: str | None = None  # cursor from the previous page's response
 
 
 @router.post('/nasa/cmr/search')
 async def nasa_cmr_search(input: CmrSearchIn):
-    url = 'https://cmr.earthdata.nasa.gov/search/granules.json'
-    params = { 'short_name': input.short_name, 'page_size': max(1, min(input.page_size, 2000)) }
-    if input.bbox: params['bounding_box'] = input.bbox
-    if input.temporal: params['temporal'] = input.temporal
+    """One page of CMR granules (cached for NASA_CMR_TTL_S). Larger result sets: pass
+    the returned search_after back, or use /nasa/cmr/search/stream."""
+    from ..providers.nasa import CMR_GRANULES_URL, cached_get, cmr_params, project, split_fields
+    params = cmr_params(input.short_name, input.bbox, input.temporal, max(1, min(input.page_size, settings.NASA_CMR_MAX_PAGE_SIZE)))
+    headers = { 'CMR-Search-After': input.search_after } if input.search_after else None
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            j = r.json()
-            return j
+        entry, state = await cached_get(CMR_GRANULES_URL, params, ttl=settings.NASA_CMR_TTL_S, headers=headers)
+        j = entry.json()
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"NASA CMR error: {e}")
+    feed = j.get('feed') or {}
+    hits = entry.headers.get('cmr-hits')
+    return {
+        **j,
+        'feed': { **feed, 'entry': project(feed.get('entry') or [], split_fields(input.fields)) },
+        'hits': int(hits) if hits and hits.isdigit() else None,
+        'search_after': entry.headers.get('cmr-search-after'),
+        'cache': state,
+    }
+
+
+class CmrStreamIn(CmrSearchIn):
+    limit: int = 2000  # total granules to return
+
+
+@router.post('/nasa/cmr/search/stream')
+async def nasa_cmr_search_stream(input: CmrStreamIn):
+    """All matching granules (up to limit) as NDJSON, one entry per line, fetched page by
+    page with CMR search-after; nothing is buffered beyond one page."""
+    import json
+    from fastapi.responses import StreamingResponse
+    from ..providers.nasa import CMR_GRANULES_URL, get_client, cmr_params, iter_cmr_granules, project, split_fields
+    limit = max(1, min(int(input.limit), settings.NASA_CMR_STREAM_MAX))
+    params = cmr_params(input.short_name, input.bbox, input.temporal, min(settings.NASA_CMR_STREAM_PAGE_SIZE, limit))
+    fields = split_fields(input.fields)
+    # First page before the response starts, so upstream errors are still a 502
+    try:
+        r = await get_client().get(CMR_GRANULES_URL, params=params)
+        r.raise_for_status()
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"NASA CMR error: {e}")
+
+    async def lines():
+        try:
+            async for g in iter_cmr_granules(params, limit, first=r):
+                yield json.dumps(project([g], fields)[0]) + '\n'
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            yield json.dumps({ 'error': f'NASA CMR error: {e}' }) + '\n'
+
+    headers = { 'X-CMR-Hits': r.headers['cmr-hits'] } if 'cmr-hits' in r.headers else None
+    return StreamingResponse(lines(), media_type='application/x-ndjson', headers=headers)
 
 
 # NASA GIBS WMTS layer template reference
@@ -244,7 +318,41 @@ async def nasa_gibs_layers():
         'MODIS_Aqua_CorrectedReflectance_TrueColor': 'MODIS Aqua True Color',
         'VIIRS_SNPP_CorrectedReflectance_BandsM11-I2-I1': 'VIIRS Color Infrared',
     }
-    return { 'template': template, 'layers': layers, 'time': 'current', 'friendly': friendly }
+    # Same tiles through the caching proxy below
+    proxy_template = '/spatial/nasa/gibs/tile/{layer}/{time}/{set}/{z}/{y}/{x}.{fmt}'
+    return { 'template': template, 'proxy_template': proxy_template, 'layers': layers, 'time': 'current', 'friendly': friendly }
+
+
+_GIBS_NAME = re.compile(r'^[A-Za-z0-9_.\-]+$')
+_GIBS_TIME = re.compile(r'^(\d{4}-\d{2}-\d{2}|default|current)$')
+
+
+@router.get('/nasa/gibs/tile/{layer}/{time}/{tms}/{z}/{y}/{x}.{fmt}')
+async def nasa_gibs_tile(layer: str, time: str, tms: str, z: int, y: int, x: int, fmt: str, request: Request):
+    """GIBS WMTS tile through the shared cache. Tiles of past dates are cached for
+    NASA_GIBS_TTL_S, 'current'/'default'/today's for NASA_GIBS_CURRENT_TTL_S."""
+    from datetime import date
+    from ..providers.nasa import GIBS_TILE_URL, cached_get
+    if fmt not in ('jpg', 'jpeg', 'png') or not _GIBS_NAME.match(layer) or not _GIBS_NAME.match(tms) or not _GIBS_TIME.match(time):
+        raise HTTPException(status_code=400, detail='invalid GIBS tile request')
+    past = time[:4].isdigit() and time < date.today().isoformat()
+    ttl = settings.NASA_GIBS_TTL_S if past else settings.NASA_GIBS_CURRENT_TTL_S
+    url = GIBS_TILE_URL.format(layer=layer, time=time, tms=tms, z=z, y=y, x=x, fmt=fmt)
+    try:
+        entry, state = await cached_get(url, ttl=ttl)
+    except httpx.HTTPStatusError as e:
+        # 400/404 mean no tile at this date/zoom; pass them through
+        code = e.response.status_code
+        raise HTTPException(status_code=code if code in (400, 404) else 502, detail=f"NASA GIBS error: {code}")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"NASA GIBS error: {e}")
+    headers = { 'Cache-Control': f'public, max-age={int(ttl)}', 'X-Cache': state }
+    etag = entry.headers.get('etag')
+    if etag:
+        headers['ETag'] = etag
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.headers.get('content-type') or f'image/{fmt}', headers=headers)
 
 
 # Available imagery dates for discrete timelapse snapping
@@ -267,46 +375,40 @@ async def imagery_available_dates(input: AvailableDatesIn):
     end = input.end
     if not start or not end:
         raise HTTPException(status_code=400, detail='start and end are required (YYYY-MM-DD)')
+    # Catalog queries run in worker threads behind a TTL / stale-while-revalidate cache
+    from ..providers.dates import discover_dates
     try:
-        if prov == 'gee':
-            from ..providers.gee import available_dates as gee_dates  # type: ignore
-            dates = gee_dates(input.aoi, start, end, input.collection or 'COPERNICUS/S2_SR', bbox=input.bbox, max_cloud_percent=input.max_cloud_percent, intersects=bool(input.intersects))
-        elif prov == 'sentinelhub':
-            from ..providers.sentinelhub import available_dates as sh_dates  # type: ignore
-            dates = sh_dates(input.aoi or {}, start, end, input.collection or 'S2L2A', step_days=int(input.step_days or 5), bbox=input.bbox, max_cloud_percent=input.max_cloud_percent, intersects=bool(input.intersects))
-        else:
-            # For earthdata or unknown, fallback to weekly sampling
-            from datetime import datetime, timedelta
-            try:
-                d0 = datetime.fromisoformat(start[:10]); d1 = datetime.fromisoformat(end[:10])
-                if d1 < d0: d0, d1 = d1, d0
-                out: List[str] = []
-                cur = d0
-                while cur <= d1:
-                    out.append(cur.date().isoformat())
-                    cur += timedelta(days=7)
-                if out and out[-1] != d1.date().isoformat(): out.append(d1.date().isoformat())
-                dates = out
-            except Exception:
-                dates = [end[:10] or start[:10]]
+        found = await discover_dates(prov, input.aoi, start, end, collection=input.collection, step_days=input.step_days,
+                                     bbox=input.bbox, max_cloud_percent=input.max_cloud_percent, intersects=bool(input.intersects))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"failed to compute available dates: {e}")
     # ensure unique + sorted
-    dates = sorted(list({ d[:10] for d in dates }))
-    return { 'provider': prov, 'start': start[:10], 'end': end[:10], 'count': len(dates), 'dates': dates }
+    dates = sorted(list({ d[:10] for d in found['dates'] }))
+    out = { 'provider': prov, 'start': start[:10], 'end': end[:10], 'count': len(dates), 'dates': dates,
+            'source': found['source'], 'cache': found['cache'] }
+    # Dates already in the AOI's time-series cube can be served without reprocessing
+    from .cube import cube_dates_for
+    cube = cube_dates_for(input.aoi, input.bbox)
+    if cube:
+        out['cube_id'] = cube['cube_id']
+        out['cube_dates'] = [d for d in cube['dates'] if start[:10] <= d <= end[:10]]
+    return out
 
 
 # NASA EONET events (natural events)
 @router.get('/nasa/eonet/events')
-async def nasa_eonet_events(limit: int = 50):
-    url = 'https://eonet.gsfc.nasa.gov/api/v3/events'
+async def nasa_eonet_events(limit: int = 50, status: str | None = None, days: int | None = None,
+                            category: str | None = None, bbox: str | None = None, fields: str | None = None):
+    """EONET events, cached for NASA_EONET_TTL_S. fields: comma-separated event fields
+    to keep (e.g. 'id,title,geometry.date')."""
+    from ..providers.nasa import EONET_EVENTS_URL, cached_get, project, split_fields
+    params = { 'limit': max(1, min(limit, 200)), 'status': status, 'days': days, 'category': category, 'bbox': bbox }
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            r = await client.get(url, params={'limit': max(1, min(limit, 200))})
-            r.raise_for_status()
-            return r.json()
+        entry, state = await cached_get(EONET_EVENTS_URL, params, ttl=settings.NASA_EONET_TTL_S)
+        j = entry.json()
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"NASA EONET error: {e}")
+    return { **j, 'events': project(j.get('events') or [], split_fields(fields)), 'cache': state }
 
 
 # ISRO Bhuvan tiles reference (public tile endpoints vary; provide configurable template)
@@ -321,32 +423,60 @@ class NdviIn(BaseModel):
     scene_url: str | None = None
     red_band: int | None = None
     nir_band: int | None = None
+    # Extra indices from the same pass: ndvi, bsi, ndbi, nbr, ndwi
+    indices: list[str] | None = None
+    # Band numbers by name (blue, green, red, nir, swir1, swir2); defaults by band count
+    bands: Dict[str, int] | None = None
+    write_rasters: bool = False
 
 
 @router.post('/ndvi')
 async def compute_ndvi(input: NdviIn):
-    """Compute NDVI from a GeoTIFF scene (stub fallback to synthetic NDVI map).
-    Returns summary stats and an optional small thumbnail URL in future.
+    """Compute NDVI (and any other requested indices) from a GeoTIFF scene in one
+    block-wise pass (stub fallback to synthetic NDVI map, also for scenes without
+    NIR/red unless `indices` or `bands` were given).
+    Returns summary stats per index and, with write_rasters, one GeoTIFF per index.
+    The output GeoTIFFs are unreferenced store blobs: fetch them promptly, they can be
+    evicted once the store is over quota.
     """
-    try:
-        if input.scene_url and input.scene_url.lower().endswith('.tif'):
-            import rasterio
-            import numpy as np
-            with rasterio.open(input.scene_url) as ds:
-                r = ds.read(input.red_band or 3).astype('float32')
-                n = ds.read(input.nir_band or 4).astype('float32')
-                nd = (n - r) / ((n + r) + 1e-6)
-                vals = nd.flatten()
-                vals = vals[np.isfinite(vals)]
-                stats = {
-                    'min': float(np.min(vals)),
-                    'max': float(np.max(vals)),
-                    'mean': float(np.mean(vals)),
-                    'std': float(np.std(vals)),
-                }
-                return { 'stats': stats }
-    except Exception:
-        pass
+    if input.scene_url and input.scene_url.lower().split('?')[0].endswith(('.tif', '.tiff')):
+        from .spectral import MissingBandError, compute_indices
+        names = list(dict.fromkeys(['ndvi', *[i.lower() for i in (input.indices or [])]]))
+        band_map = dict(input.bands or {})
+        if input.red_band:
+            band_map['red'] = input.red_band
+        if input.nir_band:
+            band_map['nir'] = input.nir_band
+        out_dir = STORAGE_ROOT / 'spectral' / uuid4().hex if input.write_rasters else None
+
+        def run():
+            res = compute_indices(input.scene_url, names, band_map=band_map, out_dir=out_dir)
+            if res['outputs']:
+                # Output rasters are quota-managed, unreferenced (ephemeral) artifacts
+                from ..storage.artifacts import get_artifact_store
+                store = get_artifact_store()
+                res['outputs'] = {n: store.put_file(p, kind='spectral')['path'] for n, p in res['outputs'].items()}
+            return res
+
+        try:
+            res = await anyio.to_thread.run_sync(run)
+        except MissingBandError as e:
+            # Plain NDVI requests on RGB / single-band imagery keep the legacy synthetic answer
+            if input.indices or input.bands:
+                raise HTTPException(status_code=400, detail=str(e))
+            res = None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception:
+            res = None
+        if res is not None:
+            ndvi = res['indices']['ndvi']
+            return {
+                'stats': {k: ndvi[k] for k in ('min', 'max', 'mean', 'std')},
+                'indices': res['indices'],
+                'outputs': res['outputs'],
+                'band_map': res['band_map'],
+            }
     # synthetic
     return { 'stats': { 'min': -0.1, 'max': 0.72, 'mean': 0.28, 'std': 0.12 } }
 
@@ -367,25 +497,121 @@ async def cloud_mask(input: CloudMaskIn):
 @router.post('/evolution/available-dates')
 async def evolution_available_dates(aoi: Dict[str, Any], start: str, end: str):
     """Proxy to imagery available dates for time slider 4D evolution."""
-    from . import router as _r  # self
-    # Delegate to providers via existing endpoint
+    from ..providers.dates import discover_dates, weekly_dates
     try:
         # reuse sentinelhub cadence
-        from ..providers.sentinelhub import available_dates
-        dates = available_dates(aoi, start, end, collection='S2L2A', step_days=10, intersects=True)
+        found = await discover_dates('sentinelhub', aoi, start, end, collection='S2L2A', step_days=10, intersects=True)
+        dates = found['dates']
     except Exception:
         dates = []
     if not dates:
-        # weekly fallback
-        from datetime import datetime, timedelta
-        try:
-            d0 = datetime.fromisoformat(start[:10]); d1 = datetime.fromisoformat(end[:10])
-            if d1 < d0: d0, d1 = d1, d0
-            out = []
-            cur = d0
-            while cur <= d1:
-                out.append(cur.date().isoformat()); cur += timedelta(days=7)
-            dates = out
-        except Exception:
-            dates = [end[:10] or start[:10]]
-    return { 'dates': sorted(list({d[:10] for d in dates})) }
\ No newline at end of file
+        dates = weekly_dates(start, end)
+    out = { 'dates': sorted(list({d[:10] for d in dates})) }
+    from .cube import cube_dates_for
+    cube = cube_dates_for(aoi)
+    if cube:
+        out['cube_id'] = cube['cube_id']
+        out['cube_dates'] = [d for d in cube['dates'] if start[:10] <= d <= end[:10]]
+    return out
+
+
+# Time-series cube: process each date once, then serve the slider by slicing
+class CubeSceneIn(BaseModel):
+    date: str  # YYYY-MM-DD
+    url: str  # GeoTIFF path or COG URL
+
+
+class CubeIngestIn(BaseModel):
+    aoi: Dict[str, Any] | None = None
+    bbox: Optional[list[float]] = None
+    scenes: list[CubeSceneIn]
+    variables: list[str] = ['ndvi']  # indices (ndvi, bsi, ...) or band names (red, nir, ...)
+    bands: Dict[str, int] | None = None
+    resolution: float | None = None  # metres; only used when the cube is created
+
+
+@router.post('/cube/ingest')
+async def cube_ingest(input: CubeIngestIn):
+    """Queue dated scenes for the AOI's cube (created on first use). Dates already in the
+    cube are re-processed, so sync jobs can simply send every new date they find."""
+    from .cube import TimeSeriesCube
+    from ..tasks.celery_worker import ingest_cube_task
+    from ..tasks.local_executor import enqueue, QueueFull
+    if not input.scenes:
+        raise HTTPException(status_code=400, detail='scenes is empty')
+    try:
+        cube = await anyio.to_thread.run_sync(lambda: TimeSeriesCube.create(input.aoi, input.bbox, resolution=input.resolution))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    scenes = [{ 'date': s.date, 'url': s.url } for s in input.scenes]
+    try:
+        task_id = enqueue(ingest_cube_task, cube.cube_id, scenes, [v.lower() for v in input.variables], input.bands)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail='Job queue is full, retry shortly')
+    return { 'cube_id': cube.cube_id, 'task_id': task_id, 'queued': len(scenes) }
+
+
+def _open_cube(cube_id: str):
+    from .cube import open_cube
+    try:
+        return open_cube(cube_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail='cube not found')
+
+
+@router.get('/cube/{cube_id}')
+async def cube_info(cube_id: str):
+    return _open_cube(cube_id).info()
+
+
+@router.get('/cube/{cube_id}/pixel')
+async def cube_pixel(cube_id: str, lon: float, lat: float, variable: str = 'ndvi'):
+    """Time series of one pixel: one value per ingested date."""
+    cube = _open_cube(cube_id)
+    try:
+        return await anyio.to_thread.run_sync(lambda: cube.pixel_series(variable.lower(), lon, lat))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get('/cube/{cube_id}/stats')
+async def cube_stats(cube_id: str, variable: str = 'ndvi'):
+    """Per-date AOI statistics, computed when each date was ingested."""
+    try:
+        return { 'variable': variable.lower(), 'dates': _open_cube(cube_id).date_stats(variable.lower()) }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get('/cube/{cube_id}/frame')
+async def cube_frame(cube_id: str, request: Request, date: str, variable: str = 'ndvi', vmin: float | None = None,
+                     vmax: float | None = None, max_size: int = 1024):
+    """One timelapse frame as an RGBA PNG (transparent outside the AOI/scene).
+
+    The default colour range is shared by all dates of the variable. Frames carry an
+    ETag from the slot's ingest time, so a re-ingested date is never served stale.
+    """
+    from .cube import render_png
+    cube = _open_cube(cube_id)
+    var = variable.lower()
+    try:
+        etag = cube.frame_etag(var, date)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f'date {date[:10]} is not in the cube')
+    # Revalidate on every use: /cube/ingest can overwrite a date in place
+    headers = {'Cache-Control': 'private, no-cache', 'ETag': etag}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    def run():
+        lo, hi = cube.value_range(var)
+        arr = cube.frame(var, date, max_size=max(16, min(int(max_size), 4096)))
+        return render_png(arr, lo if vmin is None else vmin, hi if vmax is None else vmax)
+
+    try:
+        png = await anyio.to_thread.run_sync(run)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f'date {date[:10]} is not in the cube')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=png, media_type='image/png', headers=headers)
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Spectral index engine: any set of indices in one block-wise pass over a scene.
+
+Indices are vectorized expressions over named bands (blue, green, red, nir, swir1,
+swir2). For each block, only the bands the requested indices need are read, once,
+as float32. Pixels that are nodata/masked in any input band, or whose denominator
+is zero, are masked in the output. Memory is bounded by the block size, not by the
+scene.
+
+  - iter_index_blocks(): (window, {index: masked array}) per block, for callers that
+    combine blocks themselves (detection masks, change detection);
+  - compute_indices(): streaming stats (min/max/mean/std and histogram percentiles)
+    per index, optionally writing one float32 GeoTIFF per index.
+
+Band numbers come from default_band_map() (by band count: 4-band B,G,R,NIR; Sentinel-2
+8-band subset, 12-band L2A, 13-band L1C); a caller's band_map overrides single bands.
+"""
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from ..config import settings
+
+Bands = Dict[str, np.ndarray]
+
+_HIST_BINS = 400
+_HIST_RANGE = (-2.0, 2.0)
+
+
+class MissingBandError(ValueError):
+    """An index needs a band the scene / band map does not provide (e.g. NIR on an RGB image)."""
+
+
+def _nd(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Normalized difference (a - b) / (a + b); zero denominators become NaN."""
+    den = a + b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den != 0, (a - b) / den, np.nan)
+
+
+# name -> (bands needed, expression over float32 band arrays)
+INDICES: Dict[str, Tuple[Tuple[str, ...], Callable[[Bands], np.ndarray]]] = {
+    'ndvi': (('nir', 'red'), lambda b: _nd(b['nir'], b['red'])),
+    # Bare soil index: high over exposed soil/pits, low over vegetation and water
+    'bsi': (('swir1', 'red', 'nir', 'blue'), lambda b: _nd(b['swir1'] + b['red'], b['nir'] + b['blue'])),
+    'ndbi': (('swir1', 'nir'), lambda b: _nd(b['swir1'], b['nir'])),
+    'nbr': (('nir', 'swir2'), lambda b: _nd(b['nir'], b['swir2'])),
+    # McFeeters NDWI: open water (pit lakes, tailings ponds) is positive
+    'ndwi': (('green', 'nir'), lambda b: _nd(b['green'], b['nir'])),
+}
+
+
+def register_index(name: str, bands: Sequence[str], fn: Callable[[Bands], np.ndarray]) -> None:
+    INDICES[name.lower()] = (tuple(bands), fn)
+
+
+def default_band_map(count: int) -> Dict[str, int]:
+    """1-based band numbers by common band layouts."""
+    if count >= 13:  # Sentinel-2 L1C: B1..B8, B8A, B9, B10, B11, B12
+        return {'blue': 2, 'green': 3, 'red': 4, 'nir': 8, 'swir1': 12, 'swir2': 13}
+    if count >= 12:  # Sentinel-2 L2A (no B10)
+        return {'blue': 2, 'green': 3, 'red': 4, 'nir': 8, 'swir1': 11, 'swir2': 12}
+    if count >= 8:  # Sentinel-2 B1..B8 subset
+        return {'blue': 2, 'green': 3, 'red': 4, 'nir': 8}
+    if count >= 4:  # B, G, R, NIR
+        return {'blue': 1, 'green': 2, 'red': 3, 'nir': 4}
+    return {}
+
+
+def resolve(indices: Sequence[str], band_map: Dict[str, int]) -> Tuple[List[str], Dict[str, int]]:
+    """(index names, {band name: band number} to read). Raises ValueError for unknown
+    indices or bands the map does not provide."""
+    names = [i.lower() for i in indices]
+    needed: Dict[str, int] = {}
+    for name in names:
+        if name not in INDICES:
+            raise ValueError(f'unknown index {name!r} (known: {", ".join(sorted(INDICES))})')
+        for band in INDICES[name][0]:
+            if band not in band_map:
+                raise MissingBandError(f'index {name!r} needs band {band!r}, which this scene/band map does not provide')
+            needed[band] = int(band_map[band])
+    return names, needed
+
+
+def available_indices(band_map: Dict[str, int]) -> List[str]:
+    return [n for n, (bands, _) in INDICES.items() if all(b in band_map for b in bands)]
+
+
+def block_windows(ds, window: Optional[Window] = None, size: Optional[int] = None) -> Iterator[Window]:
+    """Windows of about size x size pixels, aligned to the dataset's internal blocks."""
+    size = int(size or settings.SPECTRAL_BLOCK_SIZE)
+    bh, bw = ds.block_shapes[0] if ds.block_shapes else (size, size)
+    step_h = max(bh, size // bh * bh) if bh < size else bh
+    step_w = max(bw, size // bw * bw) if bw < size else bw
+    win = window or Window(0, 0, ds.width, ds.height)
+    col0, row0 = int(win.col_off), int(win.row_off)
+    col1, row1 = col0 + int(win.width), row0 + int(win.height)
+    for r in range(row0, row1, step_h):
+        for c in range(col0, col1, step_w):
+            yield Window(c, r, min(step_w, col1 - c), min(step_h, row1 - r))
+
+
+def read_bands(ds, needed: Dict[str, int], window: Window, out_shape: Optional[Tuple[int, int]] = None,
+               resampling: Resampling = Resampling.nearest) -> Tuple[Bands, np.ndarray]:
+    """Needed bands of one window as float32 plus the combined invalid-pixel mask.
+
+    With out_shape the window is read decimated (from an overview when the file has one).
+    """
+    order = list(needed)
+    kwargs = {'window': window, 'masked': True}
+    if out_shape is not None:
+        kwargs['out_shape'] = (len(order), *out_shape)
+        kwargs['resampling'] = resampling
+    data = ds.read([needed[b] for b in order], **kwargs)
+    invalid = np.ma.getmaskarray(data).any(axis=0)
+    arr = np.ma.getdata(data).astype('float32', copy=False)
+    return {b: arr[i] for i, b in enumerate(order)}, invalid
+
+
+def index_arrays(bands: Bands, invalid: np.ndarray, names: Sequence[str]) -> Dict[str, np.ma.MaskedArray]:
+    out = {}
+    for name in names:
+        vals = INDICES[name][1](bands).astype('float32', copy=False)
+        out[name] = np.ma.masked_array(vals, mask=invalid | ~np.isfinite(vals))
+    return out
+
+
+def iter_index_blocks(ds, indices: Sequence[str], band_map: Optional[Dict[str, int]] = None,
+                      window: Optional[Window] = None, size: Optional[int] = None) -> Iterator[Tuple[Window, Dict[str, np.ma.MaskedArray]]]:
+    names, needed = resolve(indices, {**default_band_map(ds.count), **(band_map or {})})
+    for w in block_windows(ds, window, size):
+        bands, invalid = read_bands(ds, needed, w)
+        yield w, index_arrays(bands, invalid, names)
+
+
+class RunningStats:
+    """Streaming min/max/mean/std plus a fixed-range histogram for percentiles."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.hist = np.zeros(_HIST_BINS, dtype='int64')
+
+    def update(self, values: np.ma.MaskedArray) -> None:
+        vals = values.compressed() if isinstance(values, np.ma.MaskedArray) else values[np.isfinite(values)]
+        if not vals.size:
+            return
+        v64 = vals.astype('float64')
+        self.count += int(v64.size)
+        self.total += float(v64.sum())
+        self.total_sq += float(np.dot(v64, v64))
+        self.min = min(self.min, float(v64.min()))
+        self.max = max(self.max, float(v64.max()))
+        self.hist += np.histogram(np.clip(vals, *_HIST_RANGE), bins=_HIST_BINS, range=_HIST_RANGE)[0]
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        k = np.searchsorted(np.cumsum(self.hist), p / 100.0 * self.count)
+        lo, hi = _HIST_RANGE
+        return round(lo + (min(k, _HIST_BINS - 1) + 0.5) * (hi - lo) / _HIST_BINS, 4)
+
+    def as_dict(self) -> Dict:
+        if not self.count:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None, 'std': None}
+        mean = self.total / self.count
+        var = max(0.0, self.total_sq / self.count - mean * mean)
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': mean,
+            'std': math.sqrt(var),
+            'p10': self.percentile(10),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+        }
+
+
+def compute_indices(path: str, indices: Sequence[str], *, band_map: Optional[Dict[str, int]] = None,
+                    out_dir: Optional[Path | str] = None, size: Optional[int] = None) -> Dict:
+    """Stats for every requested index from one pass over path (local or remote).
+
+    With out_dir, also writes <out_dir>/<index>.tif (float32, NaN nodata) per index.
+    Blocking; run it in a worker thread from async code.
+    """
+    from .cog import gdal_env
+    from ..storage.artifacts import touch_artifact
+    touch_artifact(path)
+    with gdal_env():
+        with rasterio.open(path) as ds:
+            band_map = {**default_band_map(ds.count), **(band_map or {})}
+            names, needed = resolve(indices, band_map)
+            stats = {n: RunningStats() for n in names}
+            writers = {}
+            try:
+                if out_dir is not None:
+                    out_dir = Path(out_dir)
+                    out_dir.mkdir(parents=True, exist_ok=True)
+                    profile = {
+                        'driver': 'GTiff', 'width': ds.width, 'height': ds.height, 'count': 1,
+                        'dtype': 'float32', 'crs': ds.crs, 'transform': ds.transform, 'nodata': float('nan'),
+                        'compress': 'deflate', 'predictor': 3, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+                    }
+                    for n in names:
+                        writers[n] = rasterio.open(out_dir / f'{n}.tif', 'w', **profile)
+                for w in block_windows(ds, None, size):
+                    bands, invalid = read_bands(ds, needed, w)
+                    for n, arr in index_arrays(bands, invalid, names).items():
+                        stats[n].update(arr)
+                        if n in writers:
+                            writers[n].write(arr.filled(np.nan), 1, window=w)
+            finally:
+                for wr in writers.values():
+                    wr.close()
+    return {
+        'indices': {n: s.as_dict() for n, s in stats.items()},
+        'outputs': {n: str(Path(out_dir) / f'{n}.tif') for n in writers},
+        'band_map': band_map,
+    }
@@ -0,0 +1,309 @@
+"""
+Content-addressed artifact store under STORAGE_ROOT/cas.
+
+Blobs are named by their SHA-256 and sharded two levels deep
+(cas/sha256/ab/cd/abcd…[.ext]), so identical uploads are stored once and no upload
+can overwrite another. A small SQLite index next to the blobs records size, kind,
+last access and references ("report:<id>", "job:<id>", …) from the records that use
+each blob. It is local rather than in Mongo because it describes this host's disk.
+
+Readers open blobs by their stored path and call touch_artifact(path) so last access
+reflects reads, not just writes. Owners drop their references with release() when
+the record is deleted.
+
+When the store exceeds ARTIFACT_QUOTA_BYTES, put() evicts least-recently-used
+unreferenced blobs (older than a short grace period so a blob is not evicted between
+being stored and being referenced). Referenced blobs are never evicted, because
+records still point at their paths. If they alone exceed the quota, the store logs a
+warning and keeps them.
+
+Several processes share the store, so a dedupe (index lookup + ref insert) and an
+eviction (ref check + index delete + moving the blob aside) each run in one
+BEGIN IMMEDIATE transaction; the evicted file is deleted only after that commits.
+
+The API is blocking (file moves and SQLite); call it through anyio.to_thread from
+async code.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from ..config import settings
+from ..utils.file_storage import STORAGE_ROOT
+
+_UNREFERENCED_GRACE_S = 60.0
+_TOUCH_EVERY_S = 60.0
+_OVER_QUOTA_LOG_EVERY_S = 600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    ext TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL,
+    kind TEXT,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+CREATE TABLE IF NOT EXISTS refs (
+    digest TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (digest, owner)
+);
+CREATE INDEX IF NOT EXISTS refs_owner ON refs (owner);
+"""
+
+
+def sha256_file(path: Path | str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ext(name: str | None) -> str:
+    # Keep the suffix so format sniffing by extension (GDAL, zip readers) still works
+    suffix = Path(name or '').suffix.lower()
+    return suffix if 1 < len(suffix) <= 10 and suffix[1:].isalnum() else ''
+
+
+class ArtifactStore:
+    def __init__(self, root: Path, quota_bytes: int = 0) -> None:
+        self.root = Path(root)
+        self.quota_bytes = max(0, int(quota_bytes))
+        self.tmp_dir = self.root / 'tmp'
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # timeout: the API and Celery processes share the index file
+        self._db = sqlite3.connect(str(self.root / 'index.sqlite3'), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self.evicted = 0
+        self.deduplicated = 0
+        self._over_quota_logged = 0.0
+
+    def blob_path(self, digest: str, ext: str = '') -> Path:
+        return self.root / 'sha256' / digest[:2] / digest[2:4] / f'{digest}{ext}'
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so other processes' puts and evictions wait
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def put_file(self, src: Path | str, *, name: str | None = None, kind: str | None = None,
+                 ref: str | None = None, sha256: str | None = None, move: bool = True) -> Dict:
+        """Store a local file; returns {'digest', 'path', 'size', 'deduplicated'}.
+
+        With move=True (the default) src is consumed: renamed into place, or deleted if
+        the same content is already stored. Pass sha256 when it was computed while
+        writing src to skip re-hashing.
+        """
+        src = Path(src)
+        digest = sha256 or sha256_file(src)
+        size = src.stat().st_size
+        ext = _ext(src.name if name is None else name)
+        staged = src
+        if not move:
+            # Copy outside the transaction so the index write lock is only held for a rename
+            staged = self.tmp_dir / f'{digest}.{os.getpid()}.{threading.get_ident()}.copy'
+            shutil.copyfile(src, staged)
+        try:
+            with self._lock, self._transaction():
+                now = time.time()
+                row = self._db.execute('SELECT ext FROM blobs WHERE digest = ?', (digest,)).fetchone()
+                if row is not None and self.blob_path(digest, row[0]).exists():
+                    path = self.blob_path(digest, row[0])
+                    self._db.execute('UPDATE blobs SET last_access = ? WHERE digest = ?', (now, digest))
+                    deduplicated = True
+                else:
+                    # New content, or an index row whose file went missing: (re)materialise the blob
+                    if row is not None and row[0] != ext:
+                        self.blob_path(digest, row[0]).unlink(missing_ok=True)
+                    path = self.blob_path(digest, ext)
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(staged, path)
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO blobs (digest, ext, size, kind, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                        (digest, ext, size, kind, now, now),
+                    )
+                    deduplicated = False
+                if ref:
+                    self._db.execute('INSERT OR IGNORE INTO refs (digest, owner) VALUES (?, ?)', (digest, ref))
+        finally:
+            if not move:
+                staged.unlink(missing_ok=True)
+        if deduplicated:
+            self.deduplicated += 1
+            if move:
+                src.unlink(missing_ok=True)
+        self.enforce_quota()
+        return {'digest': digest, 'path': str(path), 'size': size, 'deduplicated': deduplicated}
+
+    def put_bytes(self, data: bytes, *, name: str | None = None, kind: str | None = None, ref: str | None = None) -> Dict:
+        digest = hashlib.sha256(data).hexdigest()
+        tmp = self.tmp_dir / f'{digest}.{os.getpid()}.{threading.get_ident()}.part'
+        tmp.write_bytes(data)
+        try:
+            return self.put_file(tmp, name=name or '', kind=kind, ref=ref, sha256=digest)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _touch(self, digest: str) -> None:
+        now = time.time()
+        self._db.execute('UPDATE blobs SET last_access = ? WHERE digest = ? AND last_access < ?',
+                         (now, digest, now - _TOUCH_EVERY_S))
+
+    def get_path(self, digest: str) -> Optional[Path]:
+        """Path of a stored blob (and mark it used), or None if unknown or evicted."""
+        with self._lock:
+            row = self._db.execute('SELECT ext FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                return None
+            self._touch(digest)
+        path = self.blob_path(digest, row[0])
+        return path if path.exists() else None
+
+    def digest_of(self, path: Path | str) -> Optional[str]:
+        """Digest of a blob path inside this store, else None."""
+        p = Path(path)
+        try:
+            p.relative_to(self.root / 'sha256')
+        except ValueError:
+            return None
+        digest = p.name.split('.', 1)[0]
+        return digest if len(digest) == 64 else None
+
+    def touch(self, path: Path | str) -> None:
+        """Mark the blob at a stored path as used (for readers that open blobs by path)."""
+        digest = self.digest_of(path)
+        if digest:
+            with self._lock:
+                self._touch(digest)
+
+    def add_ref(self, digest: str, owner: str) -> None:
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO refs (digest, owner) VALUES (?, ?)', (digest, owner))
+
+    def release(self, owner: str) -> int:
+        """Drop every reference held by owner (e.g. when a report is deleted)."""
+        with self._lock:
+            return self._db.execute('DELETE FROM refs WHERE owner = ?', (owner,)).rowcount
+
+    def refs(self, digest: str) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._db.execute('SELECT owner FROM refs WHERE digest = ?', (digest,))]
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return int(self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0])
+
+    def _candidates(self, older_than: float) -> Iterable[tuple]:
+        return self._db.execute(
+            'SELECT digest, ext, size FROM blobs b WHERE NOT EXISTS (SELECT 1 FROM refs r WHERE r.digest = b.digest) '
+            'AND last_access < ? ORDER BY last_access LIMIT 500',
+            (older_than,),
+        ).fetchall()
+
+    def enforce_quota(self) -> int:
+        """Evict LRU unreferenced blobs until the store fits ARTIFACT_QUOTA_BYTES. Returns bytes freed."""
+        if not self.quota_bytes:
+            return 0
+        freed = 0
+        with self._lock:
+            excess = int(self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]) - self.quota_bytes
+            older_than = time.time() - _UNREFERENCED_GRACE_S
+            while excess > 0:
+                batch = self._candidates(older_than)
+                if not batch:
+                    break
+                victims = []
+                doomed: List[Path] = []
+                with self._transaction():
+                    for digest, ext, size in batch:
+                        if excess <= 0:
+                            break
+                        # Re-check under the write lock: another process may have referenced or re-put it
+                        if self._db.execute(
+                            'DELETE FROM blobs WHERE digest = ? AND last_access < ? '
+                            'AND NOT EXISTS (SELECT 1 FROM refs r WHERE r.digest = blobs.digest)',
+                            (digest, older_than),
+                        ).rowcount == 1:
+                            victims.append((digest, ext))
+                            excess -= size
+                            freed += size
+                    # Move the files aside before committing, so a put after the commit writes
+                    # a fresh blob that the unlinks below cannot touch
+                    for digest, ext in victims:
+                        aside = self.tmp_dir / f'{digest}{ext}.{os.getpid()}.evicted'
+                        try:
+                            os.replace(self.blob_path(digest, ext), aside)
+                            doomed.append(aside)
+                        except FileNotFoundError:
+                            pass
+                self.evicted += len(victims)
+                for path in doomed:
+                    path.unlink(missing_ok=True)
+            if excess > 0 and time.time() - self._over_quota_logged > _OVER_QUOTA_LOG_EVERY_S:
+                self._over_quota_logged = time.time()
+                logging.warning("artifact store over quota by %s bytes; remaining blobs are referenced and kept", excess)
+        return freed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            blobs, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            referenced = self._db.execute('SELECT COUNT(DISTINCT digest) FROM refs').fetchone()[0]
+        return {
+            'blobs': int(blobs),
+            'bytes': int(size),
+            'referenced_blobs': int(referenced),
+            'quota_bytes': self.quota_bytes,
+            'evicted': self.evicted,
+            'deduplicated': self.deduplicated,
+        }
+
+
+_store: ArtifactStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore(STORAGE_ROOT / 'cas', settings.ARTIFACT_QUOTA_BYTES)
+    return _store
+
+
+def touch_artifact(path) -> None:
+    """Best-effort ArtifactStore.touch for readers; ignores paths outside the store."""
+    try:
+        if path and str(Path(path)).startswith(str(STORAGE_ROOT / 'cas')):
+            get_artifact_store().touch(path)
+    except Exception as e:
+        logging.debug("artifact touch skipped for %s: %s", path, e)
+
+
+def release_artifacts(owner: str) -> int:
+    """Best-effort release() for delete handlers; returns the number of references dropped."""
+    try:
+        return get_artifact_store().release(owner)
+    except Exception as e:
+        logging.warning("artifact release failed for %s: %s", owner, e)
+        return 0
@@ -1,8 +1,8 @@
-import hashlib
 import json
 import httpx
 from pathlib import Path
 from ..utils.file_storage import STORAGE_ROOT
+from .artifacts import get_artifact_store
 from ..config import settings
 
 
@@ -11,15 +11,15 @@ IPFS_DIR.mkdir(parents=True, exist_ok=True)
 
 
 def add_bytes(data: bytes) -> str:
-    h = hashlib.sha256(data).hexdigest()
-    p = IPFS_DIR / h
-    if not p.exists():
-        p.write_bytes(data)
-    return h
+    # Local fallback when Pinata isn't configured: the "CID" is the sha256 in the artifact store
+    return get_artifact_store().put_bytes(data, kind='ipfs', ref='ipfs:local')['digest']
 
 
 def get_bytes(cid: str) -> bytes:
-    p = IPFS_DIR / cid
+    p = get_artifact_store().get_path(cid)
+    if p is None:
+        # Blobs written before the artifact store lived flat under IPFS_DIR
+        p = IPFS_DIR / cid
     return p.read_bytes()
 
 
@@ -47,7 +47,6 @@ def process_mining_report_task(self, report_id: str, path: str):
     # Mongo-only backend; SQLAlchemy fallback removed
     from ..config import settings
     from pymongo import MongoClient
-    from uuid import uuid4
 
     print(f'Processing report {report_id} for file {path}')
 
@@ -60,33 +59,19 @@ def process_mining_report_task(self, report_id: str, path: str):
     db = client[settings.MONGO_DB_NAME]
     rid = report_id if isinstance(report_id, str) else str(report_id)
 
-    # Store detections as GeoJSON for geospatial queries (if present)
+    # Store detections as GeoJSON for geospatial queries (indexes are ensured at API startup)
+    from ..mining.detection_store import build_detection_docs, write_detections
+    persisted = {'inserted': 0, 'rejected': [], 'failed': []}
     try:
-        det_col = db.get_collection('detections')
-        det_col.create_index([('geometry', '2dsphere')])
-        docs = []
-        for d in (detections or []):
-            geom = None
-            if isinstance(d, dict):
-                geom = d.get('geometry') or d.get('geojson')
-                if isinstance(geom, dict) and geom.get('type') == 'Feature':
-                    geom = geom.get('geometry')
-            if isinstance(geom, dict) and 'type' in geom:
-                docs.append({
-                    '_id': str(uuid4()),
-                    'report_id': rid,
-                    'geometry': geom,
-                    'properties': {
-                        'area_sqm': d.get('area_sqm') if isinstance(d, dict) else None,
-                        'confidence': d.get('confidence') if isinstance(d, dict) else None,
-                        'model': d.get('model') if isinstance(d, dict) else None,
-                    }
-                })
+        docs, rejected = build_detection_docs(rid, detections)
+        persisted['rejected'] = rejected
         if docs:
-            det_col.insert_many(docs)
-    except Exception:
-        # Non-fatal; continue
-        pass
+            res = write_detections(db.get_collection('detections'), docs, chunk_size=settings.DETECTION_WRITE_CHUNK)
+            persisted['inserted'] = res['inserted']
+            persisted['failed'] = res['failed']
+    except Exception as e:
+        print(f'Detection persistence failed for report {rid}: {e}')
+        persisted['failed'] = [{'_id': None, 'error': str(e)}]
 
     # Update mining report status and result summary
     rep_col = db.get_collection('mining_reports')
@@ -104,10 +89,18 @@ def process_mining_report_task(self, report_id: str, path: str):
                 'estimation': est,
                 'area_ha': 7.2,
                 'location': None,
-                'tx_hash': tx_hash
+                'tx_hash': tx_hash,
+                'detections_persisted': {
+                    'inserted': persisted['inserted'],
+                    'rejected': len(persisted['rejected']),
+                    'failed': len(persisted['failed']),
+                    # keep the report document small: first few reasons only
+                    'errors': (persisted['rejected'] + persisted['failed'])[:20],
+                },
             }
         }
     })
+    _mark_changed(db, 'report', rid)
 
     # Generate report and log to blockchain (stubs)
     try:
@@ -116,33 +109,135 @@ def process_mining_report_task(self, report_id: str, path: str):
     except Exception:
         pass
 
+    # Precompute the summary now that the result is final so /reports/{id}/summary is a plain read.
+    # Queued as its own task so the LLM call does not hold up the report (runs inline when eager).
+    try:
+        generate_report_summary_task.delay(rid)
+    except Exception as e:
+        print(f'Summary precompute failed for report {rid}: {e}')
+
     return {'report_id': report_id, 'status': 'processed'}
 
 
+def _mark_changed(db, kind: str, ref) -> None:
+    # Feed the /ai/chat/rag index (lazy import: app.ai imports this module)
+    from ..ai.rag.documents import mark_changed_sync
+    mark_changed_sync(db, kind, ref)
+
+
+def _ensure_report_summary(db, report_id: str) -> bool:
+    """(Re)generate the stored summary if the report result changed since it was produced.
+
+    Returns True when a new summary was written.
+    """
+    from datetime import datetime
+    from ..ai.llm import summarize_report, summary_input_hash
+    from ..config import settings
+    col = db.get_collection('mining_reports')
+    rep = col.find_one({'_id': report_id}, projection={'result': 1, 'summary_meta': 1})
+    if not rep or not rep.get('result'):
+        return False
+    h = summary_input_hash(rep['result'])
+    if ((rep.get('summary_meta') or {}).get('input_hash')) == h:
+        return False
+    text, degraded = summarize_report(rep['result'])
+    if degraded:
+        # Upstream failed: leave the summary unset so the next read or run retries
+        return False
+    # Only store if the result was not replaced while we were summarizing
+    col.update_one({'_id': report_id, 'result': rep['result']}, {'$set': {
+        'summary': text,
+        'summary_meta': {
+            'input_hash': h,
+            'model': settings.OPENAI_MODEL or 'gpt-4o-mini',
+            'generated_at': datetime.utcnow(),
+        },
+    }})
+    _mark_changed(db, 'report', report_id)
+    return True
+
+
+@celery_app.task(bind=True)
+def generate_report_summary_task(self, report_id: str):
+    from pymongo import MongoClient
+    from ..config import settings
+    client = MongoClient(settings.MONGO_URL)
+    db = client[settings.MONGO_DB_NAME]
+    return {'report_id': report_id, 'regenerated': _ensure_report_summary(db, report_id)}
+
+
 @celery_app.task(bind=True)
 def process_detection_job_task(self, job_id: str, paths: dict):
     from pymongo import MongoClient
     from ..config import settings
+    client = MongoClient(settings.MONGO_URL)
+    db = client[settings.MONGO_DB_NAME]
+    return _run_detection_job(db, job_id, paths)
+
+
+def _read_imagery_window(db, job_id: str, url: str) -> str:
+    """Local chip of the job's AOI from a remote COG (range requests only); url if the job has no AOI."""
+    j = db.get_collection('detection_jobs').find_one({'_id': job_id}, {'aoi_bbox': 1, 'imagery_provider': 1}) or {}
+    if not j.get('aoi_bbox'):
+        return url
+    from ..spatial.cog import read_aoi
+    from ..utils.file_storage import STORAGE_ROOT
+    gdal_options = {}
+    if j.get('imagery_provider') == 'earthdata':
+        from ..providers.earthdata import gdal_auth_options
+        gdal_options = gdal_auth_options()
+    chip = read_aoi(url, j['aoi_bbox'], STORAGE_ROOT / 'detect' / 'chips' / f'{job_id}.tif', gdal_options=gdal_options)
+    chip['path'] = _store_job_artifact(db, job_id, 'imagery_chip', chip['path'])
+    db.get_collection('detection_jobs').update_one({'_id': job_id}, {'$set': {'imagery_window': chip}})
+    return chip['path']
+
+
+def _store_job_artifact(db, job_id: str, name: str, path) -> str:
+    """Move a job raster into the artifact store (quota-managed, referenced by the job); returns its path."""
+    try:
+        from ..storage.artifacts import get_artifact_store
+        stored = get_artifact_store().put_file(path, kind='job', ref=f'job:{job_id}')
+        db.get_collection('detection_jobs').update_one({'_id': job_id}, {'$set': {f'artifacts.{name}': stored['path']}})
+        return stored['path']
+    except Exception:
+        # Non-fatal: the raster just stays where it was written
+        return str(path)
+
+
+def _run_detection_job(db, job_id: str, paths: dict, tiles: dict | None = None) -> dict:
+    """Run one detection job against an open pymongo database.
+
+    `tiles` is an optional prefetched Terrarium tile cache shared by batch runs.
+    """
     from datetime import datetime
     from ..ai.vision_model import detect_mining as detect_mining_demo
-    import os
+    from ..storage.artifacts import touch_artifact
+    # Inputs are opened by their stored path: keep them recently used for the quota's LRU
+    for p in (paths or {}).values():
+        if isinstance(p, str):
+            touch_artifact(p)
     # Run detection if imagery present; otherwise simulate
     imagery_path = (paths or {}).get('imagery')
     detections = []
     if imagery_path and isinstance(imagery_path, str):
+        from ..spatial.cog import is_remote
+        if is_remote(imagery_path):
+            # Remote COG: read only the AOI window when the job has one. A failed read (no
+            # overlap, auth, not a COG) fails the job: zero detections would read as "no mining"
+            try:
+                imagery_path = _read_imagery_window(db, job_id, imagery_path)
+            except Exception as e:
+                error = f'Imagery window read failed: {e}'
+                db.get_collection('detection_jobs').update_one({'_id': job_id}, {'$set': {
+                    'status': 'failed', 'completed_at': datetime.utcnow(), 'error': error,
+                }})
+                _mark_changed(db, 'job', job_id)
+                return {'job_id': job_id, 'status': 'failed', 'error': error}
         try:
-            # For s3:// URIs, a real implementation would download or stream
-            if imagery_path.startswith('s3://'):
-                detections = detect_mining_demo(imagery_path)
-            else:
-                detections = detect_mining_demo(imagery_path)
+            detections = detect_mining_demo(imagery_path)
         except Exception:
             detections = []
 
-    # Initialize DB client early for job doc reads/writes
-    client = MongoClient(settings.MONGO_URL)
-    db = client[settings.MONGO_DB_NAME]
-
     # DEM pipeline for bbox-only jobs (or augment imagery jobs)
     area_legal = 3.8  # ha
     area_illegal = 1.4  # ha
@@ -160,8 +255,9 @@ def process_detection_job_task(self, job_id: str, paths: dict):
             import anyio
             mosaic_dir = STORAGE_ROOT / 'dem' / 'mosaics'
             mosaic_dir.mkdir(parents=True, exist_ok=True)
+            zoom = int(j.get('dem_zoom') or 10)
             current_mosaic_path = mosaic_dir / f"job_{job_id}_current.tif"
-            anyio.run(build_mosaic_geotiff, tuple(bbox), 10, current_mosaic_path)
+            anyio.run(build_mosaic_geotiff, tuple(bbox), zoom, current_mosaic_path, 'EPSG:3857', tiles)
 
             # Compute estimates from current mosaic
             from ..ai.predictive_model import estimate_depth_volume
@@ -177,7 +273,7 @@ def process_detection_job_task(self, job_id: str, paths: dict):
             if older_date:
                 older_mosaic_path = mosaic_dir / f"job_{job_id}_older_{older_date}.tif"
                 # For Terrarium DEM, tiles are static over time; we still build a second mosaic for Δh scaffolding
-                anyio.run(build_mosaic_geotiff, tuple(bbox), 10, older_mosaic_path)
+                anyio.run(build_mosaic_geotiff, tuple(bbox), zoom, older_mosaic_path, 'EPSG:3857', tiles)
                 # Compute Δh stats (newer - older)
                 import rasterio
                 import numpy as np
@@ -198,6 +294,8 @@ def process_detection_job_task(self, job_id: str, paths: dict):
                 except Exception:
                     # Non-fatal; keep previous depth_stats
                     pass
+                _store_job_artifact(db, job_id, 'dem_older', older_mosaic_path)
+            _store_job_artifact(db, job_id, 'dem_current', current_mosaic_path)
     except Exception:
         # Non-fatal path; keep default stats
         pass
@@ -212,6 +310,7 @@ def process_detection_job_task(self, job_id: str, paths: dict):
             'result_map_url': result_map_url,
         }
     })
+    _mark_changed(db, 'job', job_id)
 
     # Fire an alert if illegal area too large
     try:
@@ -223,6 +322,7 @@ def process_detection_job_task(self, job_id: str, paths: dict):
                 'created_at': datetime.utcnow(), 'acknowledged': False,
             }
             r = db.get_collection('alerts').insert_one(alert)
+            _mark_changed(db, 'alert', r.inserted_id)
             # Try to broadcast over WS (best-effort; ignore failures if event loop not available)
             try:
                 from ..alerts.ws_manager import manager as alerts_manager
@@ -248,3 +348,114 @@ def process_detection_job_task(self, job_id: str, paths: dict):
         pass
 
     return { 'job_id': job_id, 'status': 'completed' }
+
+
+@celery_app.task(bind=True)
+def process_detection_batch_task(self, batch_id: str):
+    """Fan a detection batch out over its AOI jobs and fan the results back in.
+
+    The union of DEM tiles needed by every AOI is planned and downloaded once to a
+    per-batch directory on disk (at most DETECTION_BATCH_MAX_TILES tiles), then each job
+    runs in a thread pool against that shared tile cache. Per-AOI status is kept on the
+    batch document as jobs finish.
+    """
+    from pymongo import MongoClient
+    from ..config import settings
+    from datetime import datetime
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from ..dem.terrarium import plan_tiles, fetch_tiles
+    from ..utils.file_storage import STORAGE_ROOT
+    import anyio
+    import shutil
+
+    client = MongoClient(settings.MONGO_URL)
+    db = client[settings.MONGO_DB_NAME]
+    batches = db.get_collection('detection_batches')
+    batch = batches.find_one({'_id': batch_id})
+    if not batch:
+        return {'batch_id': batch_id, 'status': 'not-found'}
+    items = batch.get('items') or []
+    zoom = int(batch.get('zoom') or 10)
+    batches.update_one({'_id': batch_id}, {'$set': {'status': 'running', 'started_at': datetime.utcnow()}})
+
+    # Plan the union of tiles once so overlapping AOIs share downloads
+    tiles: dict = {}
+    planned = plan_tiles([it['bbox'] for it in items if it.get('bbox')], zoom)
+    tile_dir = STORAGE_ROOT / 'dem' / 'tiles' / str(batch_id)
+    if len(planned) <= int(settings.DETECTION_BATCH_MAX_TILES):
+        try:
+            tiles = anyio.run(fetch_tiles, planned, zoom, tile_dir, int(settings.DETECTION_BATCH_TILE_CONCURRENCY or 8))
+        except Exception:
+            # Jobs fall back to fetching their own tiles
+            tiles = {}
+    batches.update_one({'_id': batch_id}, {'$set': {'tiles_planned': len(planned), 'tiles_fetched': len(tiles)}})
+
+    def _one(item: dict) -> str:
+        job_id = item['job_id']
+        batches.update_one({'_id': batch_id, 'items.job_id': job_id}, {'$set': {'items.$.status': 'running'}})
+        try:
+            _run_detection_job(db, job_id, {}, tiles=tiles)
+            state, error = 'completed', None
+        except Exception as e:
+            state, error = 'failed', str(e)
+            db.get_collection('detection_jobs').update_one({'_id': job_id}, {'$set': {'status': 'failed', 'error': error}})
+            _mark_changed(db, 'job', job_id)
+        batches.update_one({'_id': batch_id, 'items.job_id': job_id}, {'$set': {'items.$.status': state, 'items.$.error': error}})
+        return state
+
+    counts = {'completed': 0, 'failed': 0}
+    workers = max(1, int(settings.DETECTION_BATCH_WORKERS or 4))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_one, it) for it in items]
+            for fut in as_completed(futures):
+                try:
+                    counts[fut.result()] += 1
+                except Exception:
+                    counts['failed'] += 1
+    finally:
+        shutil.rmtree(tile_dir, ignore_errors=True)
+
+    # Fan-in: aggregate per-job results into the batch record
+    totals = {'area_legal': 0.0, 'area_illegal': 0.0, 'volume_cubic_m': 0.0}
+    job_ids = [it['job_id'] for it in items]
+    for j in db.get_collection('detection_jobs').find({'_id': {'$in': job_ids}, 'status': 'completed'}):
+        for k in totals:
+            v = j.get(k)
+            if isinstance(v, (int, float)):
+                totals[k] += float(v)
+    status = 'completed' if counts['failed'] == 0 else ('failed' if counts['completed'] == 0 else 'partial')
+    batches.update_one({'_id': batch_id}, {'$set': {
+        'status': status,
+        'completed_at': datetime.utcnow(),
+        'summary': {**counts, **totals},
+    }})
+
+    try:
+        from ..utils.n8n_client import emit_event
+        anyio.run(emit_event, "detection.batch.completed", {"batch_id": batch_id, **counts, **totals})
+    except Exception:
+        pass
+
+    return {'batch_id': batch_id, 'status': status, **counts}
+
+
+@celery_app.task(bind=True)
+def ingest_cube_task(self, cube_id: str, scenes: list, variables: list, band_map: dict | None = None):
+    """Process dated scenes into an AOI's time-series cube, one slot per date.
+
+    A failing scene is recorded on the cube (meta 'failed') and does not stop the rest.
+    """
+    from ..spatial.cube import TimeSeriesCube
+
+    cube = TimeSeriesCube(cube_id)
+    done, failed = [], []
+    for item in scenes:
+        date, scene = item['date'], item['url']
+        try:
+            cube.ingest(date, scene, variables, band_map=band_map)
+            done.append(date[:10])
+        except Exception as e:
+            cube.record_failure(date, str(e))
+            failed.append(date[:10])
+    return {'cube_id': cube_id, 'ingested': done, 'failed': failed}
@@ -0,0 +1,213 @@
+"""
+In-process task executor used when Redis (and therefore a Celery worker) is unavailable.
+
+Celery's eager mode runs tasks inside the request handler; this executor instead hands
+them to a small process pool so the API returns immediately. The queue is bounded and
+each task's state is persisted to the Mongo 'task_runs' collection so it can be
+inspected and re-queued after a restart.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any
+from uuid import uuid4
+
+from ..config import settings
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _claim_run(task_id: str, owner: str) -> bool:
+    """Mark the run 'running' for owner; False if another process has taken it over since.
+
+    Upserts, so a run whose 'queued' write is still pending is recorded as running here
+    and the late write (insert-only, see LocalExecutor.submit) leaves it alone.
+    """
+    from pymongo.errors import DuplicateKeyError
+    try:
+        _runs_collection().update_one({'_id': task_id, 'owner': owner},
+                                      {'$set': {'status': 'running', 'started_at': datetime.utcnow()}},
+                                      upsert=True)
+        return True
+    except DuplicateKeyError:
+        # The record exists under another owner
+        return False
+    except Exception:
+        return True
+
+
+def _run_task(task_name: str, args: tuple, task_id: str, owner: str) -> Any:
+    # Executed in a child process: resolve the Celery task by name and run its body directly
+    if not _claim_run(task_id, owner):
+        return {'skipped': 'claimed by another process'}
+    from .celery_worker import celery_app
+    task = celery_app.tasks[task_name]
+    return task(*args)
+
+
+_runs_client = None
+
+
+def _runs_collection():
+    global _runs_client
+    if _runs_client is None:
+        from pymongo import MongoClient
+        _runs_client = MongoClient(settings.MONGO_URL, serverSelectionTimeoutMS=1500, connectTimeoutMS=1500)
+    return _runs_client[settings.MONGO_DB_NAME].get_collection('task_runs')
+
+
+class LocalExecutor:
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self._pool: ProcessPoolExecutor | None = None
+        # Single thread keeps Mongo state writes off the event loop and in order
+        self._state_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='task-state')
+        self._lock = threading.Lock()
+        self._inflight = 0
+        # Runs are only updated by the process that owns them (see recover)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: never fork the API process with its running event loop and Mongo clients
+            ctx = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    def _persist(self, task_id: str, fields: dict, on_insert: dict | None = None) -> None:
+        """Queue a state write; with on_insert the record is created if missing and those fields only set then."""
+        flt = {'_id': task_id} if on_insert is not None else {'_id': task_id, 'owner': self.owner}
+        update = {'$set': fields}
+        if on_insert:
+            update['$setOnInsert'] = on_insert
+
+        def _write():
+            try:
+                _runs_collection().update_one(flt, update, upsert=on_insert is not None)
+            except Exception as e:
+                logging.debug("task_runs write skipped for %s: %s", task_id, e)
+        try:
+            self._state_writer.submit(_write)
+        except RuntimeError:
+            # Writer already shut down (process exiting)
+            pass
+
+    def submit(self, task_name: str, args: tuple, task_id: str | None = None, claimed: bool = False) -> str:
+        """Queue a task; claimed=True for a run whose record recover() already owns."""
+        with self._lock:
+            if self._inflight >= self.queue_size:
+                raise QueueFull(f"local executor queue full ({self.queue_size})")
+            self._inflight += 1
+        task_id = task_id or str(uuid4())
+        if not claimed:
+            # Insert-only status: the child may already have claimed the run as 'running'
+            self._persist(task_id, {'name': task_name, 'args': list(args)}, on_insert={
+                'status': 'queued',
+                'owner': self.owner,
+                'created_at': datetime.utcnow(),
+            })
+        try:
+            fut = self._ensure_pool().submit(_run_task, task_name, tuple(args), task_id, self.owner)
+        except Exception:
+            with self._lock:
+                self._inflight -= 1
+            self._persist(task_id, {'status': 'failed', 'error': 'submit failed'})
+            raise
+
+        def _done(f):
+            with self._lock:
+                self._inflight -= 1
+            try:
+                result = f.result()
+                self._persist(task_id, {'status': 'completed', 'completed_at': datetime.utcnow(), 'result': result})
+            except Exception as e:
+                logging.warning("local task %s (%s) failed: %s", task_id, task_name, e)
+                self._persist(task_id, {'status': 'failed', 'completed_at': datetime.utcnow(), 'error': str(e)})
+
+        fut.add_done_callback(_done)
+        return task_id
+
+    def stats(self) -> dict:
+        return {'workers': self.workers, 'queue_size': self.queue_size, 'inflight': self._inflight}
+
+    def recover(self) -> int:
+        """Re-queue tasks left 'queued' by a previous process. Returns the number re-submitted.
+
+        Each run is claimed with an atomic queued -> running update (owner = this process)
+        before it is submitted, so when several API worker processes start together every
+        run is re-submitted by exactly one of them. Runs left 'running' may have partly
+        executed and are not replayed.
+        """
+        try:
+            col = _runs_collection()
+            pending = [t['_id'] for t in col.find({'status': 'queued'}, projection={'_id': 1}).limit(self.queue_size)]
+        except Exception:
+            return 0
+        n = 0
+        for run_id in pending:
+            try:
+                t = col.find_one_and_update({'_id': run_id, 'status': 'queued'}, {'$set': {
+                    'status': 'running', 'owner': self.owner, 'recovered_at': datetime.utcnow(),
+                }})
+            except Exception:
+                break
+            if t is None:
+                continue  # another process claimed it first
+            try:
+                self.submit(t['name'], tuple(t.get('args') or []), task_id=run_id, claimed=True)
+                n += 1
+            except QueueFull:
+                col.update_one({'_id': run_id, 'owner': self.owner}, {'$set': {'status': 'queued'}})
+                break
+            except Exception:
+                pass
+        return n
+
+    def shutdown(self, wait: bool = False) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=False)
+            self._pool = None
+        self._state_writer.shutdown(wait=wait)
+
+
+_executor: LocalExecutor | None = None
+
+
+def get_local_executor() -> LocalExecutor:
+    global _executor
+    if _executor is None:
+        _executor = LocalExecutor(settings.LOCAL_EXECUTOR_WORKERS, settings.LOCAL_EXECUTOR_QUEUE_SIZE)
+    return _executor
+
+
+def shutdown_local_executor(wait: bool = False) -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def local_mode() -> bool:
+    """True when tasks should go to the local executor instead of Celery."""
+    from .celery_worker import celery_app
+    return bool(settings.LOCAL_EXECUTOR_ENABLED and celery_app.conf.task_always_eager)
+
+
+def enqueue(task, *args) -> str:
+    """Dispatch a Celery task and return its task id.
+
+    Uses Celery when a broker is reachable; otherwise hands the task to the local process pool.
+    Raises QueueFull when the local queue is saturated.
+    """
+    if local_mode():
+        return get_local_executor().submit(task.name, args)
+    return task.delay(*args).id
@@ -1,14 +1,65 @@
+import hashlib
 import os
 from pathlib import Path
-from fastapi import UploadFile
+from uuid import uuid4
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from ..config import settings
 
 STORAGE_ROOT = Path(os.getenv('TRISHUL_STORAGE', '/tmp/trishul'))
 STORAGE_ROOT.mkdir(parents=True, exist_ok=True)
 
-async def save_upload_file(upload: UploadFile, subpath: str = '') -> str:
-    dest = STORAGE_ROOT / subpath
-    dest.mkdir(parents=True, exist_ok=True)
-    path = dest / upload.filename
-    with open(path, 'wb') as f:
-        f.write(await upload.read())
-    return str(path)
+
+def safe_filename(filename: str | None) -> str:
+    # Client-supplied names may carry directories ("../../x"); keep the last component only
+    name = Path(filename or '').name.strip()
+    return name or f'upload-{uuid4().hex[:8]}'
+
+
+async def stream_upload(upload: UploadFile, subpath: str = '', max_bytes: int | None = None, ref: str | None = None) -> dict:
+    """Stream an upload into the content-addressed artifact store in fixed-size chunks.
+
+    Memory stays at one chunk regardless of file size; the SHA-256 is computed while
+    writing and names the stored blob, so identical uploads are kept once and never
+    overwrite each other. subpath is recorded as the artifact kind; ref (e.g.
+    "report:<id>") marks the blob as in use. Raises HTTPException(413) (and removes
+    the partial file) past max_bytes.
+    Returns {'path', 'size', 'sha256', 'filename', 'deduplicated'}.
+    """
+    import anyio
+    from ..storage.artifacts import get_artifact_store
+    store = get_artifact_store()
+    limit = int(max_bytes if max_bytes is not None else settings.UPLOAD_MAX_BYTES)
+    chunk_size = max(64 * 1024, int(settings.UPLOAD_CHUNK_BYTES))
+    name = safe_filename(upload.filename)
+    part = store.tmp_dir / f'{uuid4().hex}.part'
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(part, 'wb') as f:
+            while True:
+                # UploadFile.read runs in a worker thread for spooled files
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if limit and size > limit:
+                    raise HTTPException(status_code=413, detail=f'File too large (limit {limit} bytes)')
+                digest.update(chunk)
+                await f.write(chunk)
+        sha = digest.hexdigest()
+        stored = await anyio.to_thread.run_sync(
+            lambda: store.put_file(part, name=name, kind=subpath or None, ref=ref, sha256=sha)
+        )
+    except BaseException:
+        try:
+            part.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    return {'path': stored['path'], 'size': size, 'sha256': sha, 'filename': name, 'deduplicated': stored['deduplicated']}
+
+
+async def save_upload_file(upload: UploadFile, subpath: str = '', max_bytes: int | None = None) -> str:
+    """Stream an upload to disk and return its path (see stream_upload for size/hash)."""
+    return (await stream_upload(upload, subpath, max_bytes))['path']
@@ -0,0 +1,170 @@
+"""
+Per-client request rate limiting (GCRA) with a shared backend.
+
+GCRA keeps one number per key, the theoretical arrival time (TAT), so memory is O(keys)
+regardless of traffic, and it allows bursts of up to max_requests per window. Keys
+whose TAT is in the past carry no state and are evicted.
+
+Backends:
+  - 'redis'  : one atomic Lua script per check using the Redis server clock, so every
+               uvicorn worker (and host) shares the same limit; keys expire on their own.
+  - 'memory' : in-process stand-in (per worker), size-capped with idle-key eviction.
+If Redis is configured but unreachable, checks fall back to memory instead of failing.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Tuple
+
+from fastapi import HTTPException, Request
+
+from ..config import settings
+
+try:
+    import redis.asyncio as aioredis  # type: ignore
+    _HAS_REDIS = True
+except Exception:
+    _HAS_REDIS = False
+
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval
+if new_tat - now > window + 1e-9 then
+  return {0, tostring(new_tat - now - window)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int = 100000) -> None:
+        self.max_keys = max(1, int(max_keys))
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+        self.evicted = 0
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        interval = window / limit
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + interval
+        if new_tat - now > window + 1e-9:
+            return False, new_tat - now - window
+        self._tat[key] = new_tat
+        self._tat.move_to_end(key)
+        self._evict(now)
+        return True, 0.0
+
+    def _evict(self, now: float) -> None:
+        # Oldest-touched keys first: drop the idle ones (TAT passed) and anything over the cap
+        while self._tat:
+            key, tat = next(iter(self._tat.items()))
+            if tat > now and len(self._tat) <= self.max_keys:
+                break
+            self._tat.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {'backend': 'memory', 'keys': len(self._tat), 'max_keys': self.max_keys, 'evicted': self.evicted}
+
+
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = 'rl:') -> None:
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self._script = self._redis.register_script(_GCRA_LUA)
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        allowed, retry = await self._script(keys=[self.prefix + key], args=[window / limit, window])
+        return bool(int(allowed)), float(retry)
+
+    def stats(self) -> dict:
+        return {'backend': 'redis'}
+
+
+class RateLimiter:
+    def __init__(self) -> None:
+        self.memory = MemoryBackend(settings.RATE_LIMIT_MAX_KEYS)
+        self.redis = None
+        if (settings.RATE_LIMIT_BACKEND or 'memory').lower() == 'redis':
+            if _HAS_REDIS:
+                self.redis = RedisBackend(settings.RATE_LIMIT_REDIS_URL or settings.REDIS_URL)
+            else:
+                logging.warning("RATE_LIMIT_BACKEND=redis but the redis package is missing; using memory")
+        self._redis_down_until = 0.0
+        self.rejected = 0
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        """(allowed, retry_after_s) for one request on key."""
+        if self.redis is not None and time.monotonic() >= self._redis_down_until:
+            try:
+                return await self.redis.hit(key, limit, window)
+            except Exception as e:
+                # Don't take endpoints down with Redis; retry it after a short pause
+                logging.warning("rate limiter: Redis unavailable (%s), using in-memory limits", e)
+                self._redis_down_until = time.monotonic() + 10.0
+        return await self.memory.hit(key, limit, window)
+
+    def stats(self) -> dict:
+        backend = self.redis.stats() if self.redis is not None else {}
+        return {
+            **self.memory.stats(),
+            **backend,
+            'redis_fallback': self.redis is not None and time.monotonic() < self._redis_down_until,
+            'rejected': self.rejected,
+        }
+
+
+_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
+
+
+def client_ip(request: Request | None) -> str:
+    if request is None:
+        return 'unknown'
+    # X-Forwarded-For first, then client host
+    return (request.headers.get('x-forwarded-for', '').split(',')[0].strip() or
+            (request.client.host if request.client else 'unknown'))
+
+
+def rate_limit(max_requests: int, window_sec: int):
+    """Limit an endpoint to max_requests per window_sec per client IP (429 + Retry-After)."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request | None = None
+            # Extract Request from FastAPI dependency-injected args
+            for a in args:
+                if isinstance(a, Request):
+                    request = a
+                    break
+            if request is None:
+                request = kwargs.get('request')
+            key = f"{client_ip(request)}:{getattr(func, '__name__', 'endpoint')}"
+            limiter = get_rate_limiter()
+            allowed, retry_after = await limiter.hit(key, max_requests, float(window_sec))
+            if not allowed:
+                limiter.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests. Please slow down.",
+                    headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+                )
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,293 @@
+"""
+Streaming download of remote files (scenes, granules) to local storage.
+
+fetch_to_file() holds at most one FETCH_CHUNK_BYTES chunk per connection in memory:
+  - the body is written to a '.part' file that is renamed into place only once it is
+    complete and verified;
+  - a dropped connection (or a 5xx) is resumed with an HTTP Range request from the
+    bytes already on disk, up to FETCH_RETRIES times; a server that ignores Range
+    makes the download start over;
+  - when the server accepts ranges and the file is at least FETCH_PARALLEL_MIN_BYTES,
+    it is split into FETCH_PARALLEL ranged parts fetched concurrently into a
+    preallocated file. The parts go to the post-redirect URL; when that is another
+    origin (Earthdata -> presigned S3/CloudFront) credentials are not sent there, and
+    an expired presigned URL is replaced by probing the original URL again;
+  - the result is checked against the announced size and, when given, an expected
+    SHA-256 (hashed while streaming, or in one pass afterwards for parallel fetches).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+import aiofiles
+import anyio
+import httpx
+
+from ..config import settings
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchTooLarge(FetchError):
+    pass
+
+
+class _ShortRead(Exception):
+    """Connection ended before the requested bytes arrived (retryable)."""
+
+
+class _BadRange(_ShortRead):
+    """A 206 whose Content-Range does not start where we asked (retryable)."""
+
+
+def _range_start(r: httpx.Response) -> Optional[int]:
+    m = _CONTENT_RANGE_RE.match(r.headers.get('Content-Range', ''))
+    return int(m.group(1)) if m else None
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, (httpx.TransportError, _ShortRead)):
+        return True
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code >= 500
+
+
+async def _backoff(attempt: int, url: str, e: BaseException) -> None:
+    delay = min(10.0, 0.5 * (2 ** (attempt - 1)))
+    logging.warning("fetch %s interrupted (%s); retry %s in %.1fs", url, e, attempt, delay)
+    await asyncio.sleep(delay)
+
+
+def _check_limit(size: Optional[int], limit: int) -> None:
+    if limit and size is not None and size > limit:
+        raise FetchTooLarge(f'remote file is {size} bytes, limit is {limit}')
+
+
+def _total_from(r: httpx.Response) -> Optional[int]:
+    """Full object size from a 200 (Content-Length) or 206 (Content-Range) response."""
+    if r.status_code == 206:
+        m = _CONTENT_RANGE_RE.match(r.headers.get('Content-Range', ''))
+        return int(m.group(3)) if m and m.group(3) != '*' else None
+    length = r.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def _probe(client: httpx.AsyncClient, url: str, headers: Dict[str, str]) -> Tuple[str, Optional[int], bool, Optional[str]]:
+    """(final_url, total_size, accepts_ranges, content_type) from a one-byte ranged GET.
+
+    A GET rather than HEAD because presigned object-store URLs (where Earthdata
+    redirects to) are usually signed for GET only.
+    """
+    async with client.stream('GET', url, headers={**headers, 'Range': 'bytes=0-0'}) as r:
+        r.raise_for_status()
+        return str(r.url), _total_from(r), r.status_code == 206, r.headers.get('Content-Type')
+
+
+async def _fetch_sequential(client: httpx.AsyncClient, url: str, part: Path, headers: Dict[str, str], limit: int) -> Dict:
+    chunk_size = int(settings.FETCH_CHUNK_BYTES)
+    digest = hashlib.sha256()
+    done = 0
+    total: Optional[int] = None
+    ctype: Optional[str] = None
+    attempt = 0
+    async with aiofiles.open(part, 'wb') as f:
+        while True:
+            req_headers = {**headers, 'Range': f'bytes={done}-'} if done else headers
+            try:
+                async with client.stream('GET', url, headers=req_headers) as r:
+                    r.raise_for_status()
+                    ctype = ctype or r.headers.get('Content-Type')
+                    if done and (r.status_code != 206 or _range_start(r) != done):
+                        # Server ignored the Range header, or answered another range: start over
+                        # from byte 0 (a misplaced 206 body would corrupt the file silently)
+                        await f.seek(0)
+                        await f.truncate()
+                        digest = hashlib.sha256()
+                        resumed_at, done = done, 0
+                        if r.status_code == 206:
+                            raise _BadRange(f'asked for bytes {resumed_at}-, got {r.headers.get("Content-Range")!r}')
+                    if total is None:
+                        total = _total_from(r)
+                        _check_limit(total, limit)
+                    async for data in r.aiter_bytes(chunk_size):
+                        done += len(data)
+                        _check_limit(done, limit)
+                        digest.update(data)
+                        await f.write(data)
+                if total is not None and done < total:
+                    raise _ShortRead(f'{done}/{total} bytes')
+                break
+            except Exception as e:
+                attempt += 1
+                if not _retryable(e) or attempt > int(settings.FETCH_RETRIES):
+                    raise
+                await _backoff(attempt, url, e)
+    return {'size': done, 'total': total, 'sha256': digest.hexdigest(), 'content_type': ctype}
+
+
+def _origin(url: str) -> Tuple[str, str, Optional[int]]:
+    u = httpx.URL(url)
+    return u.scheme, u.host, u.port
+
+
+class _RangeTarget:
+    """Where the ranged GETs of a parallel fetch go.
+
+    Credentials (Authorization header, client auth) are only sent when the post-redirect
+    URL has the origin they were given for; httpx strips them itself only when it follows
+    a redirect, and presigned object-store URLs reject a second auth mechanism anyway.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, final_url: str, headers: Dict[str, str]) -> None:
+        self.client = client
+        self.url = url
+        self.headers = headers
+        self.generation = 0
+        self._lock = asyncio.Lock()
+        self._set(final_url)
+
+    def _set(self, final_url: str) -> None:
+        self.final_url = final_url
+        self.redirected = _origin(final_url) != _origin(self.url)
+        if self.redirected:
+            self.request_headers = {k: v for k, v in self.headers.items() if k.lower() != 'authorization'}
+            self.auth = None
+        else:
+            self.request_headers = self.headers
+            self.auth = httpx.USE_CLIENT_DEFAULT
+
+    async def refresh(self, seen_generation: int) -> None:
+        """Probe the original URL again for a fresh redirect (once per expiry, shared by all parts)."""
+        async with self._lock:
+            if self.generation == seen_generation:
+                final_url, *_ = await _probe(self.client, self.url, self.headers)
+                self._set(final_url)
+                self.generation += 1
+
+
+def _expired(e: BaseException) -> bool:
+    # Presigned URLs answer 400/401/403 once they expire
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (400, 401, 403)
+
+
+async def _fetch_range(target: _RangeTarget, part: Path, start: int, end: int) -> None:
+    chunk_size = int(settings.FETCH_CHUNK_BYTES)
+    pos = start
+    attempt = 0
+    refreshes = 0
+    async with aiofiles.open(part, 'r+b') as f:
+        while pos <= end:
+            generation = target.generation
+            try:
+                async with target.client.stream('GET', target.final_url, auth=target.auth,
+                                                headers={**target.request_headers, 'Range': f'bytes={pos}-{end}'}) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise FetchError('server stopped honouring Range requests')
+                    if _range_start(r) != pos:
+                        raise _BadRange(f'asked for bytes {pos}-{end}, got {r.headers.get("Content-Range")!r}')
+                    await f.seek(pos)
+                    async for data in r.aiter_bytes(chunk_size):
+                        data = data[:end + 1 - pos]
+                        await f.write(data)
+                        pos += len(data)
+                        if pos > end:
+                            break
+                if pos <= end:
+                    raise _ShortRead(f'range {start}-{end} stopped at {pos}')
+            except Exception as e:
+                if target.redirected and _expired(e) and refreshes < int(settings.FETCH_RETRIES):
+                    refreshes += 1
+                    logging.warning("presigned URL for %s rejected (%s); re-probing", target.url, e)
+                    await target.refresh(generation)
+                    continue
+                attempt += 1
+                if not _retryable(e) or attempt > int(settings.FETCH_RETRIES):
+                    raise
+                await _backoff(attempt, target.url, e)
+
+
+async def _fetch_parallel(target: _RangeTarget, part: Path, total: int, parts: int) -> None:
+    async with aiofiles.open(part, 'wb') as f:
+        await f.truncate(total)
+    step = -(-total // parts)
+    ranges = [(s, min(total, s + step) - 1) for s in range(0, total, step)]
+    tasks = [asyncio.create_task(_fetch_range(target, part, s, e)) for s, e in ranges]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def fetch_to_file(
+    url: str,
+    dest: Path | str,
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    auth=None,
+    expected_sha256: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+    parallel: Optional[int] = None,
+) -> Dict:
+    """Download url to dest without buffering it in memory.
+
+    Returns {'path', 'size', 'sha256', 'content_type'}. Raises FetchTooLarge past
+    max_bytes (default FETCH_MAX_BYTES, 0 = unlimited), FetchError on a size or
+    checksum mismatch, and httpx errors for non-retryable HTTP failures.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = dest.with_name(f'.{dest.name}.{uuid4().hex[:8]}.part')
+    # Identity encoding so Content-Length/Range offsets refer to the bytes we store
+    headers = {'Accept-Encoding': 'identity', **(headers or {})}
+    limit = int(max_bytes if max_bytes is not None else settings.FETCH_MAX_BYTES)
+    parts = max(1, int(parallel if parallel is not None else settings.FETCH_PARALLEL))
+    timeout = httpx.Timeout(float(settings.FETCH_TIMEOUT_S), connect=15.0)
+    try:
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True, auth=auth) as client:
+            result = None
+            if parts > 1:
+                final_url, total, ranges, ctype = await _probe(client, url, headers)
+                _check_limit(total, limit)
+                if ranges and total and total >= int(settings.FETCH_PARALLEL_MIN_BYTES):
+                    # Range requests go straight to the post-redirect URL (without credentials
+                    # when that is another origin; see _RangeTarget)
+                    await _fetch_parallel(_RangeTarget(client, url, final_url, headers), part, total, parts)
+                    result = {'size': part.stat().st_size, 'total': total, 'sha256': None, 'content_type': ctype}
+            if result is None:
+                result = await _fetch_sequential(client, url, part, headers, limit)
+        if result['total'] is not None and result['size'] != result['total']:
+            raise FetchError(f"size mismatch: got {result['size']} bytes, expected {result['total']}")
+        if result['sha256'] is None:
+            result['sha256'] = await anyio.to_thread.run_sync(_sha256_file, part)
+        if expected_sha256 and result['sha256'] != expected_sha256.strip().lower():
+            raise FetchError(f"checksum mismatch: got sha256 {result['sha256']}")
+        os.replace(part, dest)
+    except BaseException:
+        try:
+            part.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    return {'path': str(dest), 'size': result['size'], 'sha256': result['sha256'], 'content_type': result['content_type']}
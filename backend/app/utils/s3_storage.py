@@ -35,6 +35,26 @@ def save_bytes_to_s3(key: str, data: bytes, content_type: str = 'application/oct
         raise RuntimeError('S3 not configured')
     c = s3_client()
     c.put_object(Bucket=settings.__dict__['S3_BUCKET'], Key=key, Body=data, ContentType=content_type)
+    return _object_url(key)
+
+
+def upload_file_to_s3(key: str, path: str | Path, content_type: str = 'application/octet-stream') -> str:
+    """Upload a local file with a multipart upload in S3_MULTIPART_CHUNK_BYTES parts.
+
+    boto3 reads the file part by part, so memory stays bounded for large scenes.
+    Blocking; call it from a worker thread in async code.
+    """
+    if not s3_enabled():
+        raise RuntimeError('S3 not configured')
+    from boto3.s3.transfer import TransferConfig  # type: ignore
+    chunk = max(5 * 1024 * 1024, int(settings.S3_MULTIPART_CHUNK_BYTES))  # S3 minimum part size
+    cfg = TransferConfig(multipart_threshold=chunk, multipart_chunksize=chunk, max_concurrency=4)
+    c = s3_client()
+    c.upload_file(str(path), settings.__dict__['S3_BUCKET'], key, ExtraArgs={'ContentType': content_type}, Config=cfg)
+    return _object_url(key)
+
+
+def _object_url(key: str) -> str:
     base = settings.__dict__.get('S3_PUBLIC_BASE')
     if base:
         return f"{base.rstrip('/')}/{key}"
@@ -0,0 +1,128 @@
+"""
+Load benchmark for the chat endpoints.
+
+Drives /ai/chat, /ai/chat/stream and/or /ai/chat/rag at a fixed concurrency and reports
+throughput, status codes, p50/p95/p99 latency and, for the stream, time-to-first-token.
+Pair it with scripts/llm_standin.py to load-test without spending OpenAI quota:
+
+    python scripts/llm_standin.py --port 8099 &
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=standin uvicorn app.main:app --port 8000 &
+    python scripts/bench_chat.py --endpoint all --concurrency 32 --requests 500 --distinct-clients --vary
+
+--distinct-clients sends a different X-Forwarded-For per virtual user so the per-IP
+endpoint limits do not cap the run; --vary makes every prompt unique so the LLM
+response cache does not answer for the upstream.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+ENDPOINTS = {
+    'chat': '/ai/chat',
+    'stream': '/ai/chat/stream',
+    'rag': '/ai/chat/rag',
+}
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(p / 100.0 * len(s)) - 1))  # nearest rank
+    return s[k]
+
+
+async def _one(client: httpx.AsyncClient, kind: str, prompt: str, headers: Dict[str, str]) -> Dict:
+    url = ENDPOINTS[kind]
+    started = time.perf_counter()
+    ttft = None
+    try:
+        if kind == 'stream':
+            payload = {'messages': [{'role': 'user', 'content': prompt}]}
+            async with client.stream('POST', url, json=payload, headers=headers) as r:
+                async for line in r.aiter_lines():
+                    if ttft is None and line.startswith('data:') and '"token"' in line:
+                        ttft = time.perf_counter() - started
+                    if line.startswith('data:') and '"error"' in line:
+                        return {'status': 'stream_error', 'latency': time.perf_counter() - started, 'ttft': ttft}
+                status = r.status_code
+        else:
+            payload = {'question': prompt} if kind == 'rag' else {'messages': [{'role': 'user', 'content': prompt}]}
+            r = await client.post(url, json=payload, headers=headers)
+            status = r.status_code
+    except httpx.HTTPError as e:
+        return {'status': type(e).__name__, 'latency': time.perf_counter() - started, 'ttft': ttft}
+    return {'status': status, 'latency': time.perf_counter() - started, 'ttft': ttft}
+
+
+async def run(kind: str, args) -> Dict:
+    results: List[Dict] = []
+    counter = iter(range(args.requests))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        async def user(uid: int):
+            headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+            if args.distinct_clients:
+                headers['X-Forwarded-For'] = f'10.{uid // 65536 % 256}.{uid // 256 % 256}.{uid % 256}'
+            for i in counter:
+                prompt = f'{args.prompt} (#{i})' if args.vary else args.prompt
+                results.append(await _one(client, kind, prompt, headers))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user(u) for u in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+
+    ok = [r for r in results if r['status'] == 200]
+    lat = [r['latency'] * 1000 for r in ok]
+    ttft = [r['ttft'] * 1000 for r in ok if r['ttft'] is not None]
+    ms = lambda v: round(v, 1) if v is not None else None
+    return {
+        'endpoint': ENDPOINTS[kind],
+        'requests': len(results),
+        'concurrency': args.concurrency,
+        'wall_s': round(wall, 2),
+        'throughput_rps': round(len(results) / wall, 1) if wall > 0 else None,
+        'status': dict(Counter(str(r['status']) for r in results)),
+        'latency_ms': {'p50': ms(percentile(lat, 50)), 'p95': ms(percentile(lat, 95)), 'p99': ms(percentile(lat, 99)), 'max': ms(max(lat) if lat else None)},
+        'ttft_ms': {'p50': ms(percentile(ttft, 50)), 'p95': ms(percentile(ttft, 95)), 'p99': ms(percentile(ttft, 99))} if kind == 'stream' else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='Benchmark TrishulVision chat endpoints')
+    ap.add_argument('--base-url', default='http://127.0.0.1:8000')
+    ap.add_argument('--endpoint', choices=[*ENDPOINTS, 'all'], default='chat')
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--requests', type=int, default=200, help='total requests per endpoint')
+    ap.add_argument('--prompt', default='How is illegal mining area estimated from satellite detections?')
+    ap.add_argument('--vary', action='store_true', help='make every prompt unique (bypass response cache)')
+    ap.add_argument('--distinct-clients', action='store_true', help='one X-Forwarded-For per virtual user')
+    ap.add_argument('--token', default=None, help='bearer token if the endpoints require auth')
+    ap.add_argument('--timeout', type=float, default=120.0)
+    ap.add_argument('--json', action='store_true', help='print one JSON document instead of a table')
+    args = ap.parse_args()
+
+    kinds = list(ENDPOINTS) if args.endpoint == 'all' else [args.endpoint]
+    reports = [asyncio.run(run(k, args)) for k in kinds]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for rep in reports:
+        lat, tt = rep['latency_ms'], rep['ttft_ms']
+        print(f"{rep['endpoint']}: {rep['requests']} req @ c={rep['concurrency']} in {rep['wall_s']}s "
+              f"({rep['throughput_rps']} req/s) status={rep['status']}")
+        print(f"  latency ms  p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}")
+        if tt:
+            print(f"  TTFT ms     p50={tt['p50']} p95={tt['p95']} p99={tt['p99']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Offline OpenAI-compatible stand-in for load tests and development.
+
+Serves POST /v1/chat/completions (plain and stream=true SSE) and POST /v1/embeddings
+with configurable latency, token rate and error injection, so /ai/chat, /ai/chat/stream
+and /ai/chat/rag can be driven hard without spending OpenAI quota.
+
+Run it next to the API (from backend/) and point the backend at it:
+
+    python scripts/llm_standin.py --port 8099
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=standin uvicorn app.main:app
+
+Behaviour comes from STANDIN_* environment variables (see StandinConfig) and can be
+changed at runtime with POST /_standin/config {"ttft_ms": 50, "error_rate": 0.1, ...}.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class StandinConfig:
+    def __init__(self) -> None:
+        self.ttft_ms = float(os.getenv('STANDIN_TTFT_MS', '300'))  # delay before the first token
+        self.jitter_ms = float(os.getenv('STANDIN_JITTER_MS', '100'))
+        self.tokens_per_s = float(os.getenv('STANDIN_TOKENS_PER_S', '50'))
+        self.reply_tokens = int(os.getenv('STANDIN_REPLY_TOKENS', '120'))
+        self.error_rate = float(os.getenv('STANDIN_ERROR_RATE', '0'))  # fraction answered with 500
+        self.rate_limit_rate = float(os.getenv('STANDIN_429_RATE', '0'))  # fraction answered with 429
+        self.retry_after_s = float(os.getenv('STANDIN_RETRY_AFTER_S', '1'))
+        self.seed = os.getenv('STANDIN_SEED')
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for k, v in values.items():
+            if hasattr(self, k) and k != 'update':
+                setattr(self, k, type(getattr(self, k))(v) if getattr(self, k) is not None else v)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in vars(self).items()}
+
+
+config = StandinConfig()
+counters = {'requests': 0, 'streams': 0, 'errors_injected': 0, 'throttled_injected': 0}
+_rng = random.Random(config.seed)
+_WORDS = (
+    'mining lease boundary excavation detected area hectares volume depth compliance report '
+    'satellite imagery change detection polygon alert survey district permit review'
+).split()
+
+app = FastAPI(title='TrishulVision LLM stand-in')
+
+
+def _reply_words(messages: list, n: int) -> list[str]:
+    # Deterministic per prompt so response-cache and coalescing behave like the real API
+    last = next((str(m.get('content') or '') for m in reversed(messages or []) if m.get('role') == 'user'), '')
+    rng = random.Random(hashlib.sha256(last.encode('utf-8')).hexdigest())
+    return ['(stand-in)'] + [rng.choice(_WORDS) for _ in range(max(1, n - 1))]
+
+
+def _usage(messages: list, completion_tokens: int) -> Dict[str, int]:
+    prompt = sum(len(str(m.get('content') or '')) for m in messages or []) // 4
+    return {'prompt_tokens': prompt, 'completion_tokens': completion_tokens, 'total_tokens': prompt + completion_tokens}
+
+
+def _injected_error():
+    r = _rng.random()
+    if r < config.rate_limit_rate:
+        counters['throttled_injected'] += 1
+        return JSONResponse(
+            {'error': {'message': 'Rate limit reached (stand-in)', 'type': 'requests'}},
+            status_code=429,
+            headers={'retry-after': str(config.retry_after_s), 'x-ratelimit-remaining-requests': '0'},
+        )
+    if r < config.rate_limit_rate + config.error_rate:
+        counters['errors_injected'] += 1
+        return JSONResponse({'error': {'message': 'Injected server error (stand-in)', 'type': 'server_error'}}, status_code=500)
+    return None
+
+
+async def _first_token_delay() -> None:
+    delay = max(0.0, config.ttft_ms + _rng.uniform(-config.jitter_ms, config.jitter_ms)) / 1000.0
+    await asyncio.sleep(delay)
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters['requests'] += 1
+    err = _injected_error()
+    if err is not None:
+        return err
+    messages = body.get('messages') or []
+    n = min(int(body.get('max_tokens') or config.reply_tokens), config.reply_tokens)
+    words = _reply_words(messages, n)
+    model = body.get('model') or 'stand-in'
+    created = int(time.time())
+    per_token = 1.0 / config.tokens_per_s if config.tokens_per_s > 0 else 0.0
+
+    if body.get('stream'):
+        counters['streams'] += 1
+
+        async def gen():
+            await _first_token_delay()
+            for i, w in enumerate(words):
+                chunk = {
+                    'id': 'chatcmpl-standin', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': w if i == 0 else ' ' + w}, 'finish_reason': None}],
+                }
+                yield f'data: {json.dumps(chunk)}\n\n'
+                if per_token:
+                    await asyncio.sleep(per_token)
+            yield f'data: {json.dumps({"id": "chatcmpl-standin", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})}\n\n'
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(gen(), media_type='text/event-stream')
+
+    # Non-streaming: the whole generation time is spent before responding
+    await _first_token_delay()
+    if per_token:
+        await asyncio.sleep(per_token * len(words))
+    return {
+        'id': 'chatcmpl-standin',
+        'object': 'chat.completion',
+        'created': created,
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(words)}, 'finish_reason': 'stop'}],
+        'usage': _usage(messages, len(words)),
+    }
+
+
+@app.post('/v1/embeddings')
+async def embeddings(request: Request):
+    body = await request.json()
+    counters['requests'] += 1
+    err = _injected_error()
+    if err is not None:
+        return err
+    inputs = body.get('input')
+    inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+    await asyncio.sleep(max(0.0, config.ttft_ms / 4000.0))
+    data = []
+    for i, text in enumerate(inputs):
+        digest = hashlib.sha256(str(text).encode('utf-8')).digest()
+        vec = [((digest[j % 32] ^ (j * 31)) % 256) / 255.0 - 0.5 for j in range(64)]
+        data.append({'object': 'embedding', 'index': i, 'embedding': vec})
+    return {'object': 'list', 'data': data, 'model': body.get('model') or 'stand-in', 'usage': {'prompt_tokens': 0, 'total_tokens': 0}}
+
+
+@app.get('/_standin/config')
+async def get_config():
+    return {'config': config.as_dict(), 'counters': counters}
+
+
+@app.post('/_standin/config')
+async def set_config(values: Dict[str, Any]):
+    config.update(values)
+    return {'config': config.as_dict()}
+
+
+if __name__ == '__main__':
+    import argparse
+    import uvicorn
+    ap = argparse.ArgumentParser(description='OpenAI-compatible stand-in server')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8099)
+    args = ap.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
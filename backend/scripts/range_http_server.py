@@ -0,0 +1,128 @@
+"""
+Static file server with HTTP Range support, for testing remote raster access offline.
+
+python -m http.server ignores Range headers (every request returns the whole file),
+which hides whether a client really reads windows. This server answers single-range
+requests with 206 and counts the bytes it sends, so you can check that a windowed
+detect-from-url job moves kilobytes rather than the whole scene:
+
+    python scripts/range_http_server.py --dir /data/scenes --port 8098 &
+    curl -X POST localhost:8000/ai/models/detect-from-url -H 'Content-Type: application/json' \\
+         -d '{"url": "http://127.0.0.1:8098/scene_cog.tif", "aoi_bbox": [85.30, 23.60, 85.33, 23.63]}'
+    curl localhost:8098/_stats     # {"requests": ..., "range_requests": ..., "bytes_sent": ...}
+
+Standard library only.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+_stats = {'requests': 0, 'range_requests': 0, 'bytes_sent': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**inc) -> None:
+    with _stats_lock:
+        for k, v in inc.items():
+            _stats[k] += v
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    server_verbose = False
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/_stats':
+            return self._send_json(dict(_stats))
+        if self.path.split('?')[0] == '/_stats/reset':
+            with _stats_lock:
+                for k in _stats:
+                    _stats[k] = 0
+            return self._send_json(dict(_stats))
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def _send_json(self, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, head: bool) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        # Multi-range requests are answered with the full body, which RFC 9110 allows
+        m = _RANGE_RE.match(self.headers.get('Range', '').strip())
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:  # suffix range: last N bytes
+                start = max(0, size - int(m.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(length))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        _count(requests=1, range_requests=int(status == 206))
+        if head:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                block = f.read(min(256 * 1024, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
+                _count(bytes_sent=len(block))
+
+    def log_message(self, fmt, *args):
+        if self.server_verbose:
+            super().log_message(fmt, *args)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='Range-capable static file server')
+    ap.add_argument('--dir', default='.', help='directory to serve')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8098)
+    ap.add_argument('--verbose', action='store_true', help='log every request')
+    args = ap.parse_args()
+
+    RangeHandler.server_verbose = args.verbose
+    handler = lambda *a, **kw: RangeHandler(*a, directory=args.dir, **kw)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f'serving {os.path.abspath(args.dir)} on http://{args.host}:{args.port} (stats at /_stats)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()